@@ -17,55 +17,89 @@
 # ##### END GPL LICENSE BLOCK #####
 
 import bpy
-from mathutils import Vector
-from mathutils import geometry
-import math
+import hashlib
+import numpy as np
 from bpy.props import FloatProperty, IntProperty, BoolProperty, EnumProperty, StringProperty
+from .triangulation import key_changes, observation_rays, reprojection_errors, triangulate_rays
+from .utils import worker_module
 
+# Fewer track frames than this are solved in Blender, starting the processes would take longer
+POOL_MIN_POINTS = 20000
 
-def Get2DFromTrack(track, clip, clipob, frame):
-    # print("track: ", track)
-    # print("clip: ", clip)
-    # print("clipob: ", clipob)
 
-    D = bpy.data
-    trackptr = D.movieclips[clip].tracking.objects[clipob].tracks[track]
-    markerAtFrame = trackptr.markers.find_frame(frame)
-    if markerAtFrame == None:
-        return None
-    return list(markerAtFrame.co.xy)
+def IsStatic(ob):
+    # True if the object, its lens and its parents can't change from one frame to the next
+    for owner in (ob, ob.data):
+        anim = owner.animation_data
+        if anim is not None and (anim.action is not None or len(anim.drivers) > 0 or len(anim.nla_tracks) > 0):
+            return False
+    return ob.parent is None and len(ob.constraints) == 0
 
 
-def GetRayFromTrack(track, clip, clipob, frame, scene):
-    D = bpy.data
-    coord2D = Get2DFromTrack(track, clip, clipob, frame)
-    if coord2D == None:
-        return None
-    camera = D.objects[clip]
-    frame = camera.data.view_frame(scene=scene)
-    rayend = Vector((frame[2][0] + coord2D[0] * (frame[0][0] - frame[2][0]),
-                     frame[2][1] + coord2D[1] * (frame[0][1] - frame[2][1]), frame[0][2]))
-    rayend = camera.matrix_world.normalized() * rayend
-    return [camera.location, rayend]
+class CameraCache():
+    '''
+    World matrix and frame corners of the cameras on every frame, in numpy arrays. They are evaluated once per frame for
+    all the cameras together, or only once for cameras that don't move, instead of once per track.
+
+    Usage:  cameras = CameraCache(scene, names, frames)
+            cameras.matrices[c, f], cameras.corners[c, f]    (camera names[c] on frame frames[f])
+    '''
+    def __init__(self, scene, names, frames):
+        D = bpy.data
+        self.names = names
+        self.matrices = np.empty((len(names), len(frames), 4, 4))
+        self.corners = np.empty((len(names), len(frames), 2, 3))
+        moving = []
+        for c, name in enumerate(names):
+            if IsStatic(D.objects[name]):
+                self.matrices[c], self.corners[c] = self.Evaluate(D.objects[name], scene)
+            else:
+                moving.append(c)
+        if not moving:
+            return
+        current = scene.frame_current
+        for f, cf in enumerate(frames):
+            scene.frame_set(cf)
+            for c in moving:
+                self.matrices[c, f], self.corners[c, f] = self.Evaluate(D.objects[names[c]], scene)
+        scene.frame_set(current)
 
+    @staticmethod
+    def Evaluate(camera, scene):
+        frame = camera.data.view_frame(scene=scene)
+        return np.array(camera.matrix_world.normalized()), np.array([frame[2], frame[0]])
 
-def ReadTracks(scene, MaxError):
+
+def GetMarkers(track, frames):
+    '''
+
+    :param track: Blender MovieTrackingTrack
+    :param frames: range of frame numbers
+    :return: (indices in frames (n,), normalized positions (n, 2)) of the markers of the track on those frames
+    '''
+    count = len(track.markers)
+    markerFrames = np.empty(count, dtype=np.int32)
+    co = np.empty(count * 2, dtype=np.float32)
+    track.markers.foreach_get("frame", markerFrames)
+    track.markers.foreach_get("co", co)
+    index = markerFrames - frames.start
+    inside = (index >= 0) & (index < len(frames))
+    return index[inside], co.reshape(-1, 2)[inside]
+
+
+def GetTrackClips():
     D = bpy.data
     tracks = {}
-    TotalError = 0
-    ErrorCount = 0.000001
     #
     # Make a list of empties in the scene. This will be used to filter useful tracks
     #
     Empties = []
-    # print("Empty List")
     for emptyOb in D.objects:
         if emptyOb.type == "EMPTY":
             Empties.append(emptyOb.name)
-
-            #
-            # Make a list of track objects, with a list of associated clips
-            #
+    #
+    # Make a list of track objects, with a list of associated clips
+    #
     for clip in D.movieclips:
         for clipob in clip.tracking.objects:
             for track in clipob.tracks:
@@ -75,42 +109,241 @@ def ReadTracks(scene, MaxError):
                         tracks[trackname].append([clip.name, clipob.name])
                     else:
                         tracks[trackname] = [[clip.name, clipob.name]]
-                        # print("tracks:")
-                        # print(tracks)
-                        #
-                        # for each frame, triangulate the tracks, and add keyframes to the empties
-                        #
-    for cf in range(scene.frame_start, scene.frame_end + 1):
-        print(cf)
-        for trackname, cliplist in tracks.items():
-            #            print("Frame: ", cf, " Track: ", trackname)
-            ray = []
-            for clip in cliplist:
-                newRay = GetRayFromTrack(trackname, clip[0], clip[1], cf, scene)
-                #                print(newRay)
-                if newRay != None:
-                    ray.append(newRay)
-            if len(ray) > 1:
-                result = geometry.intersect_line_line(ray[0][0], ray[0][1], ray[1][0], ray[1][1])
-                error = result[0] - result[1]
-                errorval = math.sqrt(error[0] ** 2 + error[1] ** 2 + error[2] ** 2)
-                #                print("Error: ", errorval)
-                EmptyObj = D.objects[trackname]
-                EmptyObj['Error'] = errorval
-                EmptyObj.keyframe_insert(data_path='["Error"]', frame=(cf))
-                if errorval < MaxError:
-                    print("Adding kf: ", trackname, cf)
-                    EmptyLocation = 0.5 * (result[0] + result[1])
-                    EmptyObj.location = EmptyLocation
-                    EmptyObj.keyframe_insert(data_path='location', frame=(cf))
-                    TotalError += errorval
-                    ErrorCount += 1
-                    # print(TotalError)
-                else:
-                    print("Deleting kf: ", trackname, cf)
-                    EmptyObj.keyframe_delete(data_path='location', frame=(cf))
-    Average = TotalError / ErrorCount
+    return tracks
+
+
+class Observations():
+    '''
+    The markers of every track on every frame, from all the clips the track is in, and the cameras of those clips. The
+    markers are kept as they are in the clips, so a later run can tell which ones changed since, see Changed.
+
+    Usage:  obs = Observations(scene, tracks, frames)
+            origins, directions, mask = obs.Rays(t, f)    (t, f: arrays of track and frame indices)
+            positions, errors, reprojection = obs.Solve(t, f, processes)
+    '''
+    def __init__(self, scene, tracks, frames):
+        D = bpy.data
+        self.frames = frames
+        self.names = sorted(tracks)
+        self.clips = [tracks[trackname] for trackname in self.names]
+        cameraNames = sorted(set(clip[0] for cliplist in self.clips for clip in cliplist))
+        views = max(len(cliplist) for cliplist in self.clips)
+        # camera of every clip of every track, -1 where a track is in less clips
+        self.views = np.full((len(self.names), views), -1, dtype=np.intp)
+        # normalized marker positions, NaN where a clip has no marker on a frame
+        self.coords = np.full((len(self.names), len(frames), views, 2), np.nan, dtype=np.float32)
+        for t, trackname in enumerate(self.names):
+            for v, clip in enumerate(self.clips[t]):
+                self.views[t, v] = cameraNames.index(clip[0])
+                f, co = GetMarkers(D.movieclips[clip[0]].tracking.objects[clip[1]].tracks[trackname], frames)
+                self.coords[t, f, v] = co
+        self.mask = ~np.isnan(self.coords[..., 0])
+        self.cameras = CameraCache(scene, cameraNames, frames)
+        # the cameras are named after their clips, reprojection errors are measured in the pixels of the clip
+        self.sizes = np.array([D.movieclips[name].size for name in cameraNames], dtype=np.float64).reshape(-1, 2)
+
+    def Rays(self, t, f):
+        '''
+        Builds the rays of many tracks and frames in one go, for triangulation.triangulate_rays.
+
+        :param t: (n,) track indices
+        :param f: (n,) frame indices
+        :return: (origins (n, views, 3), directions (n, views, 3), mask (n, views)), mask is False where a clip has no
+                 marker on the frame
+        '''
+        return observation_rays(self.coords, self.views, self.cameras.matrices, self.cameras.corners, t, f)
+
+    def Solve(self, t, f, processes=1):
+        '''
+
+        :param t: (n,) track indices
+        :param f: (n,) frame indices
+        :param processes: Number of processes solving chunks of frames in parallel
+        :return: (positions (n, 3), errors (n,), reprojection (n, views)), see triangulation.triangulate_rays and
+                 triangulation.reprojection_errors. reprojection has the distance in pixels between the marker of every
+                 clip of the track and the position seen by the camera of that clip
+        '''
+        if processes > 1 and len(t) >= POOL_MIN_POINTS:
+            worker = worker_module("triangulation")
+            return worker.triangulate_in_processes(self.coords, self.views, self.cameras.matrices,
+                                                   self.cameras.corners, self.sizes, t, f, processes)
+        positions, errors, _ = triangulate_rays(*self.Rays(t, f))
+        reprojection = reprojection_errors(positions, self.coords, self.views, self.cameras.matrices,
+                                           self.cameras.corners, self.sizes, t, f)
+        return positions, errors, reprojection
+
+    def Changed(self, previous):
+        '''
+
+        :param previous: Observations of an earlier run
+        :return: (tracks, frames) bool array, True where a marker of the track or a camera that sees it changed since,
+                 None if the tracks, clips or frames are not the same anymore
+        '''
+        if (previous.frames != self.frames or previous.names != self.names or previous.clips != self.clips or
+                previous.cameras.names != self.cameras.names):
+            return None
+        same = (self.coords == previous.coords) | (np.isnan(self.coords) & np.isnan(previous.coords))
+        markers = ~same.all(axis=(2, 3))
+        # (cameras, frames)
+        cameras = ((self.cameras.matrices != previous.cameras.matrices).any(axis=(2, 3)) |
+                   (self.cameras.corners != previous.cameras.corners).any(axis=(2, 3)))
+        seen = self.mask | previous.mask
+        moved = cameras[self.views[:, None, :], np.arange(len(self.frames))[None, :, None]] & (self.views >= 0)[:, None]
+        return markers | (moved & seen).any(axis=2)
+
+
+def WriteKeys(ob, data_path, index, frames, values, remove=(), group=""):
+    '''
+    Keys a property of the object on many frames at once, with foreach_get and foreach_set instead of one
+    keyframe_insert per frame. Keys that already exist on the frames get the new value in place and keep their
+    interpolation, easing and handle types, their handles move with them. Keys on other frames are left alone.
+
+    :param ob: Blender Object
+    :param data_path: Path of the property, like keyframe_insert
+    :param index: Index of the property array, 0 for single values
+    :param frames: Frames to key
+    :param values: Values of the property on those frames
+    :param remove: Frames whose keys are deleted
+    :param group: Action group of the F-curve, if it has to be created
+    '''
+    anim = ob.animation_data or ob.animation_data_create()
+    if anim.action is None:
+        anim.action = bpy.data.actions.new(ob.name + "Action")
+    fcurve = anim.action.fcurves.find(data_path, index)
+    if fcurve is None:
+        if len(frames) == 0:
+            return
+        fcurve = anim.action.fcurves.new(data_path, index, group)
+
+    points = fcurve.keyframe_points
+    count = len(points)
+    frames = np.asarray(frames, dtype=np.float32)
+    values = np.asarray(values, dtype=np.float32)
+    co = np.empty((count, 2), dtype=np.float32)
+    points.foreach_get("co", co.ravel())
+    at, found, deleted = key_changes(co[:, 0], frames, remove)
+    # new keys are added at the end, update() sorts them in
+    new = ~found
+    points.add(int(new.sum()))
+    size = len(points)
+    co = np.empty((size, 2), dtype=np.float32)
+    left = np.empty((size, 2), dtype=np.float32)
+    right = np.empty((size, 2), dtype=np.float32)
+    points.foreach_get("co", co.ravel())
+    points.foreach_get("handle_left", left.ravel())
+    points.foreach_get("handle_right", right.ravel())
+    old = at[found]
+    shift = values[found] - co[old, 1]
+    co[old, 1] = values[found]
+    left[old, 1] += shift
+    right[old, 1] += shift
+    for array in (co, left, right):
+        array[count:] = np.column_stack((frames[new], values[new]))
+    points.foreach_set("co", co.ravel())
+    points.foreach_set("handle_left", left.ravel())
+    points.foreach_set("handle_right", right.ravel())
+    # the handles of the new keys are placed by update
+    for i in range(count, size):
+        points[i].handle_left_type = points[i].handle_right_type = 'AUTO_CLAMPED'
+    for i in deleted:
+        points.remove(points[int(i)], fast=True)
+    fcurve.update()
+
+
+def KeysDigest(ob):
+    # digest of the keys ReadTracks writes, to notice when they were changed since, by hand or by an undo
+    anim = ob.animation_data
+    if anim is None or anim.action is None:
+        return None
+    digest = hashlib.md5()
+    for data_path, index in (('["Error"]', 0), ('location', 0), ('location', 1), ('location', 2)):
+        fcurve = anim.action.fcurves.find(data_path, index)
+        if fcurve is not None:
+            co = np.empty(len(fcurve.keyframe_points) * 2, dtype=np.float32)
+            fcurve.keyframe_points.foreach_get("co", co)
+            digest.update(co.tobytes())
+        digest.update(b"|")
+    return digest.hexdigest()
+
+
+# Result of the last run on every scene, by scene name: the Observations, the positions and errors of all the tracks on
+# all the frames, the Max Error and the KeysDigest of every empty
+_lastRun = {}
+
+
+def ReadTracks(scene, MaxError, OnlyChanged=True, Processes=1):
+    D = bpy.data
+    tracks = GetTrackClips()
+    if not tracks:
+        return 0
+    frames = range(scene.frame_start, scene.frame_end + 1)
+    obs = Observations(scene, tracks, frames)
+    shape = obs.mask.shape[:2]
+    #
+    # Only the tracks and frames whose markers or cameras changed since the last run are triangulated again
+    #
+    last = _lastRun.get(scene.name) if OnlyChanged else None
+    solve = obs.Changed(last["observations"]) if last is not None else None
+    if solve is None:
+        last = None
+        solve = np.ones(shape, dtype=bool)
+        positions = np.full(shape + (3,), np.nan)
+        errors = np.full(shape, np.nan)
+        reprojection = np.full(obs.mask.shape, np.nan)
+    else:
+        positions = last["positions"].copy()
+        errors = last["errors"].copy()
+        reprojection = last["reprojection"].copy()
+    t, f = np.nonzero(solve)
+    if len(t):
+        positions[t, f], errors[t, f], reprojection[t, f] = obs.Solve(t, f, Processes)
+    print("Triangulated {} of {} track frames".format(len(t), solve.size))
+    with np.errstate(invalid='ignore'):
+        accepted = errors < MaxError
+        write = solve.copy()
+        if last is not None:
+            # frames on the other side of a new Max Error, and empties whose keys changed since, are keyed again
+            write |= accepted != (last["errors"] < last["maxError"])
+            for t, trackname in enumerate(obs.names):
+                if last["keys"].get(trackname) != KeysDigest(D.objects[trackname]):
+                    write[t] = True
+    #
+    # Key the empties. Frames seen by less than two clips are left alone, as are rays that are parallel
+    #
+    keyFrames = np.array(frames)
+    keys = {}
+    for t, trackname in enumerate(obs.names):
+        EmptyObj = D.objects[trackname]
+        solved = write[t] & ~np.isnan(errors[t])
+        if solved.any():
+            EmptyObj['Error'] = float(errors[t, solved][-1])
+            WriteKeys(EmptyObj, '["Error"]', 0, keyFrames[solved], errors[t, solved])
+            # reprojection error in pixels, one property per clip the track is in
+            for v, clip in enumerate(obs.clips[t]):
+                seen = solved & obs.mask[t, :, v]
+                if seen.any():
+                    prop = "Reprojection " + clip[0]
+                    EmptyObj[prop] = float(reprojection[t, seen, v][-1])
+                    WriteKeys(EmptyObj, '["{}"]'.format(prop), 0, keyFrames[seen], reprojection[t, seen, v])
+            # rejected frames lose their location key
+            keep, reject = solved & accepted[t], solved & ~accepted[t]
+            for i in range(3):
+                WriteKeys(EmptyObj, 'location', i, keyFrames[keep], positions[t, keep, i], keyFrames[reject],
+                          "Object Transforms")
+        keys[trackname] = KeysDigest(EmptyObj)
+    _lastRun[scene.name] = dict(observations=obs, positions=positions, errors=errors, reprojection=reprojection,
+                                maxError=MaxError, keys=keys)
+    if write.any():
+        # show the new animation
+        scene.frame_set(scene.frame_current)
+    Average = float(errors[accepted].sum() / (accepted.sum() + 0.000001))
     print("Average: ", Average)
+    for c, name in enumerate(obs.cameras.names):
+        clipErrors = reprojection[(obs.views[:, None, :] == c) & accepted[:, :, None]]
+        clipErrors = clipErrors[~np.isnan(clipErrors)]
+        if len(clipErrors):
+            print("Reprojection error of {}: {:.3f} px average, {:.3f} px max".format(name, clipErrors.mean(),
+                                                                                    clipErrors.max()))
     return Average
 
 
@@ -122,16 +355,24 @@ class MESH_OT_triangulate(bpy.types.Operator):
     bl_options = {'REGISTER', 'UNDO'}
     MaxError = FloatProperty(name="Max Error", description="Max Error", default=1.0, min=0, soft_max=100)
     AvError = FloatProperty(name="Average Error", description="Average Error", default=0.0, min=0)
+    OnlyChanged = BoolProperty(name="Only Changed",
+                               description="Triangulate again only the frames whose markers or cameras changed since "
+                                           "the last run", default=True)
+    Processes = IntProperty(name="Processes",
+                            description="Processes triangulating chunks of frames in parallel, 1 triangulates in Blender",
+                            default=1, min=1, max=64)
 
     def execute(self, context):
         scene = context.scene
-        self.AvError = ReadTracks(scene, self.MaxError)
+        self.AvError = ReadTracks(scene, self.MaxError, self.OnlyChanged, self.Processes)
         return {'FINISHED'}
 
     def draw(self, context):
         layout = self.layout
         layout.prop(self, 'MaxError')
         layout.prop(self, 'AvError')
+        layout.prop(self, 'OnlyChanged')
+        layout.prop(self, 'Processes')
 
 
 class VIEW_3D_PT_triangulate(bpy.types.Panel):
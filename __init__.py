@@ -8,7 +8,7 @@ bl_info = {
     "blender": (2, 79, 0),
     "location": "View3D > Tools",
     "description": "Tools for animating a 3D model with triangulation",
-    "warning": "Depended on numpy and scipy",
+    "warning": "Depended on numpy and scipy, Pillow is optional (background frame reading)",
     "wiki_url": "",
     "category": "Motion Tracking"
 }
@@ -22,8 +22,19 @@ if "bpy" in locals():
 
     empties_to_bones = importlib.reload(empties_to_bones)
     properties = importlib.reload(properties)
+    detection = importlib.reload(detection)
+    raw_frames = importlib.reload(raw_frames)
+    pipeline = importlib.reload(pipeline)
+    frames = importlib.reload(frames)
+    png_writer = importlib.reload(png_writer)
     sequence_converter = importlib.reload(sequence_converter)
+    association = importlib.reload(association)
+    motion = importlib.reload(motion)
+    track_store = importlib.reload(track_store)
+    detection_cache = importlib.reload(detection_cache)
     marker_tracker = importlib.reload(marker_tracker)
+    batch_tracker = importlib.reload(batch_tracker)
+    triangulation = importlib.reload(triangulation)
     Triangulate = importlib.reload(Triangulate)
     print("Reloaded")
 
@@ -32,8 +43,19 @@ else:
 
     from . import empties_to_bones
     from . import properties
+    from . import detection
+    from . import raw_frames
+    from . import pipeline
+    from . import frames
+    from . import png_writer
     from . import sequence_converter
+    from . import association
+    from . import motion
+    from . import track_store
+    from . import detection_cache
     from . import marker_tracker
+    from . import batch_tracker
+    from . import triangulation
     from . import Triangulate
 
     print("Imported")
@@ -46,8 +68,8 @@ from .empties_to_bones import (
     VIEW_3D_OT_PoseBones
 )
 from .sequence_converter import (
-    CLIP_OT_ToSequence,
     ConvertModalOperator,
+    ConvertRawModalOperator,
     ConvertPanel
 )
 from .Triangulate import (
@@ -60,14 +82,17 @@ from .marker_tracker import (
     CLIP_OT_assignMarkersOnColor,
     TrackMarkersModalOperator,
     TrackPanel,
+    CLIP_OT_addTrackColor,
+    CLIP_OT_removeTrackColor,
     CLIP_PT_color
 )
+from .batch_tracker import CLIP_OT_batchTrack
 
 classes = (
     CLIP_PT_EmptiesPoseBones,
     VIEW_3D_OT_PoseBones,
-    CLIP_OT_ToSequence,
     ConvertModalOperator,
+    ConvertRawModalOperator,
     ConvertPanel,
     MESH_OT_triangulate,
     VIEW_3D_PT_triangulate,
@@ -76,7 +101,10 @@ classes = (
     CLIP_OT_assignMarkersOnColor,
     TrackMarkersModalOperator,
     TrackPanel,
-    CLIP_PT_color
+    CLIP_OT_addTrackColor,
+    CLIP_OT_removeTrackColor,
+    CLIP_PT_color,
+    CLIP_OT_batchTrack
 )
 
 def register():
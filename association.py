@@ -0,0 +1,81 @@
+#Assignment of tracked markers to the points detected in a new frame. Works on plain arrays of pixel positions,
+#marker_tracker.moveMarkers reads the tracks from Blender and writes the result back.
+
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from scipy.spatial import cKDTree
+
+
+def candidate_pairs(positions, points, gate):
+    '''
+    Finds every (track, point) pair closer than the gate of the track, using a KD-tree over the points.
+
+    :param positions: (n, 2) array of track positions
+    :param points: (m, 2) array of detected points
+    :param gate: Maximum distance, one value or one per track
+    :return: (track index, point index, distance) arrays
+    '''
+    positions = np.asarray(positions, dtype=np.float64).reshape(-1, 2)
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    gate = np.broadcast_to(np.asarray(gate, dtype=np.float64), (len(positions),))
+    if len(positions) == 0 or len(points) == 0:
+        empty = np.zeros(0, dtype=np.intp)
+        return empty, empty, np.zeros(0)
+
+    near = cKDTree(positions).query_ball_tree(cKDTree(points), gate.max())
+    ti = np.repeat(np.arange(len(positions)), [len(hits) for hits in near])
+    pi = np.array([p for hits in near for p in hits], dtype=np.intp)
+    d = np.hypot(*(positions[ti] - points[pi]).T)
+
+    keep = d < gate[ti]
+    return ti[keep], pi[keep], d[keep]
+
+
+def associate(positions, points, gate):
+    '''
+    Global minimum cost assignment of tracks to points. Only pairs closer than the gate are allowed, as many tracks as
+    possible get a point and among those solutions the total distance is the smallest. Unlike a greedy search, a track can't
+    take the point of a neighbour just because it comes first.
+
+    The gated pairs form a bipartite graph, each connected part of it is solved on its own with the Hungarian algorithm
+    (scipy.optimize.linear_sum_assignment), so dense marker sets stay fast.
+
+    :param positions: (n, 2) array of track positions
+    :param points: (m, 2) array of detected points
+    :param gate: Maximum distance, one value or one per track
+    :return: (track index, point index) arrays of the matched pairs
+    '''
+    n, m = len(positions), len(points)
+    ti, pi, d = candidate_pairs(positions, points, gate)
+    if len(ti) == 0:
+        empty = np.zeros(0, dtype=np.intp)
+        return empty, empty
+
+    #tracks are nodes 0..n-1 and points n..n+m-1 of the graph
+    graph = coo_matrix((np.ones(len(ti), dtype=np.int8), (ti, pi + n)), shape=(n + m, n + m))
+    num, component = connected_components(graph, directed=False)
+    pair_component = component[ti]
+
+    #parts made of a single pair need no solving
+    pairs_per_component = np.bincount(pair_component, minlength=num)
+    single = pairs_per_component[pair_component] == 1
+    tracks, matched = [ti[single]], [pi[single]]
+
+    order = np.argsort(pair_component, kind='mergesort')
+    order = order[~single[order]]
+    bounds = np.flatnonzero(np.diff(pair_component[order])) + 1
+    for part in np.split(order, bounds) if len(order) else []:
+        rows, r = np.unique(ti[part], return_inverse=True)
+        cols, c = np.unique(pi[part], return_inverse=True)
+        #pairs outside the gate cost more than all the allowed pairs together, so they are only used if nothing else fits
+        forbidden = d[part].sum() + 1
+        cost = np.full((len(rows), len(cols)), forbidden)
+        cost[r, c] = d[part]
+        sol_r, sol_c = linear_sum_assignment(cost)
+        ok = cost[sol_r, sol_c] < forbidden
+        tracks.append(rows[sol_r[ok]])
+        matched.append(cols[sol_c[ok]])
+
+    return np.concatenate(tracks), np.concatenate(matched)
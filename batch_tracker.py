@@ -0,0 +1,244 @@
+#Batch tracking: tracks a whole frame range in one loop, without the modal operator, its timer and the scene/area switching of
+#CLIP_OT_moveMarkers. Frames are detected with the NUMPY backend only, the compositor backend needs a Clip Editor to render from.
+#
+#It can be used from the Track Markers panel (CLIP_OT_batchTrack) or without the UI, see headless_track.py:
+#   blender -b scene.blend --python headless_track.py -- --clip MyClip --end 500 --save
+#Without the UI the clip has to be an image sequence, or a movie converted to raw frames (see raw_frames.py).
+
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import sys
+import time
+
+import bpy
+from .detection_cache import file_identity
+from .frames import get_frame_source, grab_frame, movie_needs_raw_frames
+from .marker_tracker import (
+    apply_frame_points,
+    flush_track_store,
+    frame_file_path,
+    get_detect_settings,
+    get_detection_cache,
+    get_marker_index,
+    get_motion_model,
+    reset_motion_model,
+    save_detection_cache,
+    start_track_store,
+    track_frame
+)
+from .pipeline import NO_DECODER, compact_to_points, detect_compact, done_future, have_decoder
+from .utils import worker_module
+
+#Frames queued per worker process, enough to keep every process busy while the main process applies the results
+FRAMES_PER_PROCESS = 4
+
+
+def detect_in_processes(clip, frames, settings, processes, cache=None):
+    '''
+    Detects the frames of an image sequence, or of a clip converted to raw frames, on a pool of processes. Every process
+    reads its frames from disk and only sends back the centroids and areas of the clusters, see pipeline.detect_file.
+    Frames the workers can't read are read by Blender and detected here.
+
+    :param clip: Blender MovieClip with source 'SEQUENCE', or with raw frames
+    :param frames: Frames to detect
+    :param settings: pipeline.DetectSettings
+    :param processes: Number of worker processes
+    :param cache: Optional DetectionCache, cached frames are not sent to the workers and new results are added to it
+    :return: Generator of (frame, one list of 2D Point locations per color), in the order of frames
+    '''
+    worker = worker_module("pipeline")
+    worker_settings = worker.DetectSettings(*settings)
+
+    def result(frame, path, future):
+        compact = None
+        if future is not None:
+            try:
+                compact = future.result()
+            except (OSError, ValueError) as e:
+                print("Reading frame {} through Blender: {}".format(frame, e))
+        if compact is None:
+            pixels, srgb = grab_frame(clip, frame)
+            compact = detect_compact(pixels, srgb, settings)
+        if cache is not None:
+            cache.put(frame, file_identity(path), compact)
+        return frame, compact_to_points(compact)
+
+    raw = get_frame_source(clip).raw
+    queue = deque()
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        try:
+            for frame in frames:
+                path = frame_file_path(clip, frame)
+                compact = cache.get(frame, file_identity(path)) if cache is not None else None
+                if compact is not None:
+                    queue.append((frame, path, done_future(compact)))
+                elif raw is not None and frame in raw:
+                    queue.append((frame, path, pool.submit(worker.detect_raw_frame, raw.path, frame, worker_settings)))
+                elif clip.source != 'MOVIE' and worker.can_decode(path):
+                    queue.append((frame, path, pool.submit(worker.detect_file, path, worker_settings)))
+                else:
+                    queue.append((frame, path, None))
+                if len(queue) >= processes * FRAMES_PER_PROCESS:
+                    yield result(*queue.popleft())
+            while queue:
+                yield result(*queue.popleft())
+        finally:
+            #tracking stopped early, don't wait for the frames nobody needs
+            for frame, path, future in queue:
+                if future is not None:
+                    future.cancel()
+
+
+def can_detect_in_processes(clip):
+    #True if worker processes can read the frames of the clip themselves, see detect_in_processes
+    return get_frame_source(clip).raw is not None or (clip.source != 'MOVIE' and have_decoder())
+
+
+def track_range(clip, start, end, props, progress=None):
+    '''
+    Tracks the markers of the clip from frame start to frame end. Like the modal operator, the tracks need markers at start,
+    the frames after it are tracked.
+
+    :param clip: Blender MovieClip
+    :param start: Last frame that already has markers
+    :param end: Last frame to track
+    :param props: Tracking settings, context.window_manager.op_props
+    :param progress: Optional function called after every frame with (frame, fraction of the range done)
+    :return: Number of frames tracked
+    '''
+    tracks = clip.tracking.tracks
+    if end <= start or len(tracks) == 0:
+        return 0
+
+    #velocities from an earlier run don't apply anymore
+    reset_motion_model(clip)
+    motion = get_motion_model(clip, props.max_dist) if props.use_prediction else None
+    start_track_store(clip, tracks, start + 1, end)
+
+    #with several processes, the frames are detected ahead on the pool and only associated here, in frame order.
+    #Frames are always searched whole then, search windows need the result of the previous frame.
+    frames = range(start + 1, end + 1)
+    detected = ((frame, None) for frame in frames)
+    if props.detect_processes > 1 and can_detect_in_processes(clip):
+        settings = get_detect_settings(props, clip, workers=1)
+        detected = detect_in_processes(clip, frames, settings, props.detect_processes,
+                                       get_detection_cache(props, clip, settings))
+    elif props.detect_processes > 1:
+        print("Detecting in a single process: " + (NO_DECODER if clip.source != 'MOVIE' else
+                                                   "movie frames can only be read by Blender, convert the clip to raw frames"))
+
+    total = end - start
+    try:
+        for frame, point_sets in detected:
+            index = get_marker_index(clip, tracks, frame)
+            if point_sets is None:
+                track_frame(props, clip, frame, motion, index)
+            else:
+                apply_frame_points(props, clip, frame, point_sets, motion, index)
+
+            done = frame - start
+            if props.flush_every and done % props.flush_every == 0:
+                flush_track_store(clip, tracks)
+            if progress is not None:
+                progress(frame, done / total)
+    finally:
+        detected.close()
+        #whatever was tracked is kept, even if a frame failed
+        flush_track_store(clip, tracks, stop=True)
+        save_detection_cache(clip)
+    return total
+
+
+class CLIP_OT_batchTrack(bpy.types.Operator):
+    '''
+        Tracks from the current frame to the end frame of the scene in one go. Much faster than TrackMarkersModalOperator
+        but Blender doesn't redraw until it is done, progress is shown on the mouse cursor.
+    '''
+    bl_idname = "clip.batch_track"
+    bl_label = "Batch Track"
+    bl_description = "Track current markers up to the end frame as fast as possible. Blender is blocked until it is done"
+
+    def execute(self, context):
+        scene = context.scene
+        props = context.window_manager.op_props
+        clip = context.edit_movieclip
+        if movie_needs_raw_frames(clip):
+            #track_range only has the NUMPY backend, reading every movie frame into numpy is too slow here
+            self.report({'ERROR'}, "Convert the movie to raw frames before batch tracking it on this Blender version")
+            return {'CANCELLED'}
+        if props.detection_backend != 'NUMPY':
+            #track_range only has the NUMPY backend, the setting is left as it is for the other operators
+            self.report({'WARNING'}, "Batch tracking always uses the NUMPY backend")
+        if props.detect_processes > 1 and clip.source != 'MOVIE' and not can_detect_in_processes(clip):
+            self.report({'WARNING'}, NO_DECODER)
+
+        wm = context.window_manager
+        wm.progress_begin(0, 100)
+        t = time.time()
+        try:
+            count = track_range(clip, scene.frame_current, scene.frame_end, props,
+                                lambda frame, done: wm.progress_update(int(done * 100)))
+        finally:
+            wm.progress_end()
+        print("Tracked {} frames in {:.2f} seconds".format(count, time.time() - t))
+
+        scene.frame_current = scene.frame_end
+        return {'FINISHED'}
+
+    @classmethod
+    def poll(cls, context):
+        return context.edit_movieclip is not None
+
+
+def print_progress(frame, done):
+    print("Tracked frame {} ({:.0f}%)".format(frame, done * 100))
+    sys.stdout.flush()
+
+
+def main(argv=None):
+    '''
+    Command line entry point, see headless_track.py. Arguments come after '--' on the Blender command line.
+
+    :param argv: Arguments, sys.argv after '--' if None
+    '''
+    if argv is None:
+        argv = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else []
+    scene = bpy.context.scene
+    parser = argparse.ArgumentParser(prog="headless_track.py", description="Track the color markers of a clip")
+    parser.add_argument("--clip", help="Name of the clip to track, the first clip if not given")
+    parser.add_argument("--start", type=int, default=scene.frame_current, help="Frame with the markers to track from")
+    parser.add_argument("--end", type=int, default=scene.frame_end, help="Last frame to track")
+    parser.add_argument("--max-dist", type=float, help="Maximum distance a marker can move between two frames")
+    parser.add_argument("--workers", type=int, help="Threads used to detect the markers of a frame")
+    parser.add_argument("--processes", type=int, help="Processes detecting frames in parallel, image sequences only")
+    parser.add_argument("--no-prediction", action="store_true", help="Don't predict the motion of the markers")
+    parser.add_argument("--save", action="store_true", help="Save the .blend file when done")
+    args = parser.parse_args(argv)
+
+    if args.clip is None and len(bpy.data.movieclips) == 0:
+        parser.error("the file has no clips")
+    clip = bpy.data.movieclips[args.clip] if args.clip else bpy.data.movieclips[0]
+    movie = clip.source == 'MOVIE' and get_frame_source(clip).raw is None
+    if (movie and bpy.app.background) or movie_needs_raw_frames(clip):
+        #movie frames are read from the Viewer Node of a compositor render, Blender doesn't run it in background
+        #mode and before 2.83 copying them out of it is too slow, see frames.movie_needs_raw_frames
+        parser.error("can't read the frames of movie clip {} without the UI, convert it to an image sequence or to raw "
+                     "frames first".format(clip.name))
+
+    props = bpy.context.window_manager.op_props
+    if args.max_dist is not None:
+        props.max_dist = args.max_dist
+    if args.workers is not None:
+        props.detect_workers = args.workers
+    if args.processes is not None:
+        props.detect_processes = args.processes
+    if args.no_prediction:
+        props.use_prediction = False
+
+    t = time.time()
+    count = track_range(clip, args.start, args.end, props, print_progress)
+    print("Tracked {} frames of {} in {:.2f} seconds".format(count, clip.name, time.time() - t))
+
+    if args.save:
+        bpy.ops.wm.save_mainfile()
@@ -0,0 +1,662 @@
+#Pure NumPy/SciPy marker detection. Nothing in this module touches bpy, so it can work on any decoded RGBA frame
+#(Blender image buffers, files read from disk, ...) and the result is the same list of points getPoints returns.
+
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from scipy.ndimage import binary_dilation, find_objects, label
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+#Settings of the CompositorNodeChromaMatte used by getPoints. Tolerance and threshold are angles in radians.
+CHROMA_TOLERANCE = 0.69
+CHROMA_THRESHOLD = 0.52
+CHROMA_GAIN = 1.0
+
+#The compositor writes the inverted matte to an 8 bit png and getPoints keeps every pixel that is not pure black. The
+#File Output node applies the display transform to 8 bit files (sRGB display, Default view in the scene getPoints
+#renders), so a linear matte value is kept once its sRGB encoding, 12.92 * value down there, rounds to at least 1/255.
+#This is the closest the NUMPY backend gets, the two backends don't match exactly: the render dithers before rounding,
+#another view transform (Filmic) moves the cut, and the compositor weights centroids with the display values.
+MATTE_EPSILON = 0.5 / 255 / 12.92
+
+#sRGB byte value -> linear float. The compositor works on linear pixels, Image.pixels of a byte image is sRGB.
+_SRGB_TO_LINEAR = np.where(np.arange(256) / 255.0 <= 0.04045,
+                           np.arange(256) / 255.0 / 12.92,
+                           np.power((np.arange(256) / 255.0 + 0.055) / 1.055, 2.4)).astype(np.float32)
+
+
+def srgb_to_linear(rgb):
+    '''
+
+    :param rgb: Array of sRGB values in the 0..1 range, or bytes
+    :return: Array of linear values, same shape, float32
+    '''
+    #quantize to bytes and use a lookup table, this is how the values were stored in the first place
+    idx = rgb if rgb.dtype == np.uint8 else np.clip(rgb * 255 + 0.5, 0, 255).astype(np.uint8)
+    return _SRGB_TO_LINEAR.take(idx.ravel()).reshape(idx.shape)
+
+
+#linear values halfway between two bytes, see linear_to_srgb
+_SRGB_MIDPOINTS = (_SRGB_TO_LINEAR[1:] + _SRGB_TO_LINEAR[:-1]) / 2
+
+
+def linear_to_srgb(linear):
+    '''
+    Inverse of srgb_to_linear.
+
+    :param linear: Array of linear values
+    :return: uint8 array of the sRGB bytes closest to them, same shape
+    '''
+    return np.searchsorted(_SRGB_MIDPOINTS, linear).astype(np.uint8)
+
+
+def to_srgb_bytes(pixels, srgb, out=None):
+    '''
+
+    :param pixels: (height, width, channels) array with values in the 0..1 range
+    :param srgb: True if pixels are sRGB encoded, False if they are linear
+    :param out: Optional uint8 array to write to
+    :return: uint8 array of sRGB bytes, the way Blender saves a byte image. Alpha is not converted.
+    '''
+    if out is None:
+        out = np.empty(pixels.shape, dtype=np.uint8)
+    if srgb:
+        out[...] = np.clip(pixels * 255 + 0.5, 0, 255)
+    else:
+        out[..., :3] = linear_to_srgb(pixels[..., :3])
+        out[..., 3:] = np.clip(pixels[..., 3:] * 255 + 0.5, 0, 255)
+    return out
+
+
+def to_float(values):
+    #byte values to the 0..1 range, other arrays as float32
+    if values.dtype == np.uint8:
+        return values / np.float32(255)
+    return values.astype(np.float32, copy=False)
+
+
+def _chroma(rgb):
+    #Cb and Cr channels (ITU BT.709, as in the compositor's RGB to YCC conversion), rescaled to -1..1
+    r, g, b = rgb[..., 0], rgb[..., 1], rgb[..., 2]
+    cb = 2 * (-0.101 * r - 0.338 * g + 0.439 * b) + 1.0 / 255
+    cr = 2 * (0.439 * r - 0.399 * g - 0.040 * b) + 1.0 / 255
+    return cb, cr
+
+
+def chroma_key(rgba, color, tolerance=CHROMA_TOLERANCE, threshold=CHROMA_THRESHOLD, gain=CHROMA_GAIN, srgb=True):
+    '''
+    Same algorithm as Blender's Chroma Key node (from the book "Video Demystified"), followed by the Invert node used in getPoints.
+
+    :param rgba: (height, width, 4) or (height, width, 3) array with values in the 0..1 range, or uint8 bytes
+    :param color: Key color (r, g, b[, a]), passed to the node as is
+    :param tolerance: Acceptance angle in radians
+    :param threshold: Cutoff angle in radians, pixels this close to the key are fully keyed
+    :param gain: Falloff of the matte
+    :param srgb: True if rgba holds sRGB encoded values (byte images), False if it is already linear (float buffers)
+    :return: (height, width) float32 array, 0 where the pixel is not the key color and up to 1 where it is
+    '''
+    rgb = rgba[..., :3]
+    if srgb:
+        rgb = srgb_to_linear(rgb)
+    else:
+        rgb = to_float(rgb)
+
+    key_cb, key_cr = _chroma(np.asarray(color[:3], dtype=np.float32))
+    theta = np.arctan2(key_cr, key_cb)
+    cos_t, sin_t = np.float32(np.cos(theta)), np.float32(np.sin(theta))
+
+    #rotate cb and cr into x/z space
+    cb, cr = _chroma(rgb)
+    x_angle = cb * cos_t + cr * sin_t
+    z_angle = cr * cos_t - cb * sin_t
+
+    #if kfg is <0 then the pixel is outside of the key color
+    kfg = x_angle - np.abs(z_angle) / np.float32(np.tan(tolerance / 2.0))
+    alpha = np.ones(kfg.shape, dtype=np.float32)
+    #only pixels inside the acceptance angle need the rest of the work
+    inside = np.flatnonzero(kfg > 0)
+    keyed = 1 - kfg.ravel()[inside] / np.float32(gain)
+    #within the cutoff angle the pixel is fully keyed
+    keyed[np.abs(np.arctan2(z_angle.ravel()[inside], x_angle.ravel()[inside])) < threshold / 2.0] = 0
+    alpha.ravel()[inside] = keyed
+
+    #don't make something that was more transparent less transparent
+    if rgba.shape[-1] > 3:
+        alpha = np.minimum(alpha, to_float(rgba[..., 3]))
+
+    #invert, the key color becomes white
+    return np.clip(1 - alpha, 0, 1).astype(np.float32, copy=False)
+
+
+def chroma_matte(rgba, color, **kwargs):
+    '''
+    Binary version of chroma_key, close to the png rendered by the compositor and thresholded in getPoints, see
+    MATTE_EPSILON.
+
+    :param rgba: (height, width, 4) array with values in the 0..1 range
+    :param color: Key color
+    :param kwargs: See chroma_key
+    :return: (height, width) bool array, True on pixels of the key color
+    '''
+    return chroma_key(rgba, color, **kwargs) > MATTE_EPSILON
+
+
+#Detected clusters. area is the exact pixel count of each cluster, centroid its (x, y) intensity weighted center in pixels
+#(pixel centers sit on .5, like the bounding box centers getPoints used to return) and bbox is (y_min, x_min, y_max, x_max)
+#with the max values exclusive.
+Blobs = namedtuple("Blobs", "area centroid bbox")
+
+#Running sums behind Blobs. Sums of different parts of a cluster can be added together, which is how clusters split
+#between tiles are put back together. sx and sy are the weighted sums of the pixel coordinates, total the sum of the weights.
+_Sums = namedtuple("_Sums", "area total sx sy bbox")
+
+
+def empty_blobs():
+    return Blobs(np.zeros(0, dtype=np.intp), np.zeros((0, 2)), np.zeros((0, 4), dtype=np.intp))
+
+
+def _empty_sums():
+    return _Sums(np.zeros(0, dtype=np.intp), np.zeros(0), np.zeros(0), np.zeros(0), np.zeros((0, 4), dtype=np.intp))
+
+
+def _weighted_sums(lbl, xs, ys, weights, n):
+    #per label weight total and weighted coordinate sums of the listed pixels
+    wt = np.ones(len(lbl)) if weights is None else weights[ys, xs].astype(np.float64)
+    total = np.bincount(lbl, wt, minlength=n)
+    #a cluster without any weight falls back to its plain mean
+    empty = total <= 0
+    if empty.any():
+        wt[empty[lbl]] = 1
+        total = np.bincount(lbl, wt, minlength=n)
+    return total, np.bincount(lbl, wt * xs, minlength=n), np.bincount(lbl, wt * ys, minlength=n)
+
+
+def _label_sums(labelled_array, num_features, weights=None):
+    w = labelled_array.shape[1]
+    idx = np.flatnonzero(labelled_array)
+    lbl = labelled_array.ravel()[idx] - 1
+    ys, xs = np.divmod(idx, w)
+
+    area = np.bincount(lbl, minlength=num_features)
+    total, sx, sy = _weighted_sums(lbl, xs, ys, weights, num_features)
+    bbox = np.array([(sl[0].start, sl[1].start, sl[0].stop, sl[1].stop) for sl in find_objects(labelled_array)],
+                    dtype=np.intp).reshape(-1, 4)
+    return _Sums(area, total, sx, sy, bbox)
+
+
+def _finalize(sums):
+    if len(sums.area) == 0:
+        return empty_blobs()
+    centroid = np.column_stack((sums.sx / sums.total + 0.5, sums.sy / sums.total + 0.5))
+    return Blobs(sums.area.astype(np.intp), centroid, sums.bbox.astype(np.intp))
+
+
+def component_stats(labelled_array, num_features, weights=None):
+    '''
+    Statistics of all the labels of a labelled image in one vectorized pass.
+
+    :param labelled_array: (height, width) int array from scipy.ndimage.label
+    :param num_features: Number of labels in labelled_array
+    :param weights: Optional (height, width) array of pixel intensities used to weight the centroids
+    :return: Blobs with one entry per label, label i is at index i-1
+    '''
+    return _finalize(_label_sums(labelled_array, num_features, weights))
+
+
+def filter_blobs(blobs, thresh, height):
+    '''
+
+    :param blobs: Blobs
+    :param thresh: Minimum amount of connected pixels that form a cluster
+    :param height: Clusters with a y coordinate above this value are ignored
+    :return: Blobs that are big enough and below the ignored height
+    '''
+    keep = (blobs.area > thresh) & (blobs.centroid[:, 1] > height)
+    return Blobs(blobs.area[keep], blobs.centroid[keep], blobs.bbox[keep])
+
+
+def find_runs(matte):
+    '''
+    Run-length encodes the foreground of a binary image. Only rows that contain foreground are expanded, so the work
+    after the first scan depends on the foreground and not on the size of the frame.
+
+    :param matte: (height, width) bool array
+    :return: (row, start, end) int arrays, one entry per horizontal run of foreground pixels in raster order, end exclusive
+    '''
+    h, w = matte.shape
+    rows = np.flatnonzero(matte.any(axis=1))
+    padded = np.zeros((len(rows), w + 2), dtype=np.int8)
+    padded[:, 1:-1] = matte[rows]
+    edges = np.diff(padded, axis=1)
+    r, start = np.nonzero(edges == 1)
+    end = np.nonzero(edges == -1)[1]
+    return rows[r], start, end
+
+
+def label_runs(row, start, end, width):
+    '''
+    8-connected labeling of runs, same result as scipy.ndimage.label with a (3,3) structure of ones.
+
+    :param row: Run rows, from find_runs
+    :param start: Run starts, from find_runs
+    :param end: Run ends, from find_runs
+    :param width: Width of the image
+    :return: (labels, num_features). labels holds the 0 based label of every run, labels are numbered in raster order
+    '''
+    n = len(row)
+    if n == 0:
+        return np.zeros(0, dtype=np.intp), 0
+
+    #every run gets a key that sorts runs in raster order. A run of the row above touches the current one (diagonals included)
+    #if it ends at or after our start and starts at or before our end, these form a contiguous range of runs.
+    stride = width + 2
+    key_start = row * stride + start
+    key_end = row * stride + end
+    above = (row - 1) * stride
+    lo = np.searchsorted(key_end, above + start, 'left')
+    hi = np.searchsorted(key_start, above + end, 'right')
+    count = np.maximum(hi - lo, 0)
+
+    src = np.repeat(np.arange(n), count)
+    dst = np.repeat(lo, count) + np.arange(count.sum()) - np.repeat(np.cumsum(count) - count, count)
+    graph = coo_matrix((np.ones(len(src), dtype=np.int8), (src, dst)), shape=(n, n)).tocsr()
+    num_features, labels = connected_components(graph, directed=False)
+
+    #renumber in order of first appearance, like label() does
+    first = np.unique(labels, return_index=True)[1]
+    rank = np.empty(num_features, dtype=np.intp)
+    rank[np.argsort(first)] = np.arange(num_features)
+    return rank[labels], num_features
+
+
+def _expand_runs(start, end):
+    #run index and column of every pixel covered by the runs
+    length = end - start
+    run = np.repeat(np.arange(len(start)), length)
+    return run, start[run] + np.arange(len(run)) - np.repeat(np.cumsum(length) - length, length)
+
+
+def _run_sums(row, start, end, labels, num_features, weights=None):
+    length = end - start
+    area = np.bincount(labels, length, minlength=num_features)
+
+    if weights is None:
+        total = area.astype(np.float64)
+        sx = np.bincount(labels, length * (start + end - 1) / 2.0, minlength=num_features)
+        sy = np.bincount(labels, length * row, minlength=num_features)
+    else:
+        #expand the runs to pixels, this only touches foreground pixels
+        run, xs = _expand_runs(start, end)
+        total, sx, sy = _weighted_sums(labels[run], xs, row[run], weights, num_features)
+
+    #group the runs of each label to get the bounding boxes
+    order = np.argsort(labels, kind='mergesort')
+    first = np.searchsorted(labels[order], np.arange(num_features))
+    bbox = np.column_stack((np.minimum.reduceat(row[order], first),
+                            np.minimum.reduceat(start[order], first),
+                            np.maximum.reduceat(row[order], first) + 1,
+                            np.maximum.reduceat(end[order], first)))
+    return _Sums(area, total, sx, sy, bbox)
+
+
+def run_component_stats(row, start, end, labels, num_features, weights=None):
+    '''
+    component_stats for labelled runs.
+
+    :param row: Run rows, from find_runs
+    :param start: Run starts, from find_runs
+    :param end: Run ends, from find_runs
+    :param labels: Run labels, from label_runs
+    :param num_features: Number of labels
+    :param weights: Optional (height, width) array of pixel intensities used to weight the centroids
+    :return: Blobs with one entry per label
+    '''
+    if num_features == 0:
+        return empty_blobs()
+    return _finalize(_run_sums(row, start, end, labels, num_features, weights))
+
+
+def _matte_sums(matte, weights, sparse):
+    '''
+    Labels a matte and returns the sums of its clusters along with the labels (1 based, 0 is background) of its first and
+    last row, which is what is needed to stitch it to the tiles above and below.
+    '''
+    w = matte.shape[1]
+    if sparse:
+        row, start, end = find_runs(matte)
+        labels, num_features = label_runs(row, start, end, w)
+        if num_features == 0:
+            return _empty_sums(), np.zeros((2, w), dtype=np.intp)
+        edges = np.zeros((2, w), dtype=np.intp)
+        for i, r in enumerate((0, matte.shape[0] - 1)):
+            on_row = row == r
+            run, xs = _expand_runs(start[on_row], end[on_row])
+            edges[i, xs] = labels[on_row][run] + 1
+        return _run_sums(row, start, end, labels, num_features, weights), edges
+
+    #specifies what pattern to look for in the image and labels each pattern found with a number.
+    #See scipy.ndimage.measurements.label for more information on how this works.
+    labelled_array, num_features = label(matte, np.ones((3, 3), dtype=np.uint8))
+    return _label_sums(labelled_array, num_features, weights), labelled_array[[0, -1]]
+
+
+def find_blobs(matte, thresh, height, weights=None, sparse=False):
+    '''
+
+    :param matte: (height, width) array, non-zero where the key color was found. Row 0 is the top of the image
+    :param thresh: Minimum amount of connected pixels that form a cluster
+    :param height: Clusters with a y coordinate above this value are ignored
+    :param weights: Optional pixel intensities, see component_stats
+    :param sparse: Label run-length encoded rows instead of the full frame. Faster for mattes that are mostly background
+    :return: Blobs of all the clusters found
+    '''
+    sums = _matte_sums(matte > 0, weights, sparse)[0]
+    return filter_blobs(_finalize(sums), thresh, height)
+
+
+def _stitch(tiles, offsets):
+    '''
+    Joins clusters that continue from one tile into the next.
+
+    :param tiles: List of (sums, edge rows) from _matte_sums, one per horizontal tile, top to bottom
+    :param offsets: First image row of every tile
+    :return: _Sums of the whole image
+    '''
+    counts = [len(sums.area) for sums, edges in tiles]
+    first_id = np.concatenate(([0], np.cumsum(counts)))
+    n = first_id[-1]
+    if n == 0:
+        return _empty_sums()
+
+    #clusters touching across a seam, diagonals included, get connected in a graph of all the tile clusters
+    src, dst = [], []
+    for i in range(len(tiles) - 1):
+        bottom, top = tiles[i][1][1], tiles[i + 1][1][0]
+        for dx in (-1, 0, 1):
+            a = bottom[max(dx, 0):len(bottom) + min(dx, 0)]
+            b = top[max(-dx, 0):len(top) + min(-dx, 0)]
+            both = (a > 0) & (b > 0)
+            src.append(first_id[i] + a[both] - 1)
+            dst.append(first_id[i + 1] + b[both] - 1)
+    src = np.concatenate(src).astype(np.intp) if src else np.zeros(0, dtype=np.intp)
+    dst = np.concatenate(dst).astype(np.intp) if dst else np.zeros(0, dtype=np.intp)
+    graph = coo_matrix((np.ones(len(src), dtype=np.int8), (src, dst)), shape=(n, n)).tocsr()
+    num_features, group = connected_components(graph, directed=False)
+
+    #tiles are stacked top to bottom and label in raster order, so the lowest id of a group is its first pixel in raster
+    #order. Numbering groups by it gives the same order as labeling the whole image.
+    first = np.full(num_features, n, dtype=np.intp)
+    np.minimum.at(first, group, np.arange(n))
+    rank = np.empty(num_features, dtype=np.intp)
+    rank[np.argsort(first)] = np.arange(num_features)
+    group = rank[group]
+
+    area = np.concatenate([sums.area for sums, edges in tiles])
+    total = np.concatenate([sums.total for sums, edges in tiles])
+    sx = np.concatenate([sums.sx for sums, edges in tiles])
+    sy = np.concatenate([sums.sy + sums.total * off for (sums, edges), off in zip(tiles, offsets)])
+    bbox = np.concatenate([sums.bbox + (off, 0, off, 0) for (sums, edges), off in zip(tiles, offsets)])
+
+    order = np.argsort(group, kind='mergesort')
+    starts = np.searchsorted(group[order], np.arange(num_features))
+    bbox = bbox[order]
+    return _Sums(np.bincount(group, area, minlength=num_features),
+                 np.bincount(group, total, minlength=num_features),
+                 np.bincount(group, sx, minlength=num_features),
+                 np.bincount(group, sy, minlength=num_features),
+                 np.column_stack((np.minimum.reduceat(bbox[:, 0], starts),
+                                  np.minimum.reduceat(bbox[:, 1], starts),
+                                  np.maximum.reduceat(bbox[:, 2], starts),
+                                  np.maximum.reduceat(bbox[:, 3], starts))))
+
+
+def _detect_tile(rgba, color, srgb, sparse):
+    key = chroma_key(rgba, color, srgb=srgb)
+    return _matte_sums(key > MATTE_EPSILON, key, sparse)
+
+
+def detect_blobs(rgba, color, thresh, height, srgb=True, sparse=False, workers=1):
+    '''
+
+    :param rgba: (height, width, 4) array, row 0 is the top of the image
+    :param color: Color to search for
+    :param thresh: Minimum amount of connected pixels that form a cluster
+    :param height: Clusters with a y coordinate above this value are ignored
+    :param srgb: See chroma_key
+    :param sparse: See find_blobs
+    :param workers: Number of threads. With more than one, the frame is split in horizontal tiles that are keyed and
+                    labelled in parallel (numpy and scipy release the GIL) and clusters crossing the seams are stitched
+                    back together. The result is the same as with a single worker.
+    :return: Blobs of all the clusters found
+    '''
+    h = rgba.shape[0]
+    workers = max(1, min(workers, h // 2))
+    if workers == 1:
+        return filter_blobs(_finalize(_detect_tile(rgba, color, srgb, sparse)[0]), thresh, height)
+
+    offsets = [h * i // workers for i in range(workers + 1)]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        tiles = list(pool.map(lambda i: _detect_tile(rgba[offsets[i]:offsets[i + 1]], color, srgb, sparse),
+                              range(workers)))
+    return filter_blobs(_finalize(_stitch(tiles, offsets[:-1])), thresh, height)
+
+
+def merge_windows(windows, shape):
+    '''
+    Clips windows to the image and merges the ones that overlap or touch, so that no cluster is split between two windows.
+
+    :param windows: (n, 4) array-like of (y_min, x_min, y_max, x_max), max values exclusive
+    :param shape: (height, width) of the image
+    :return: (m, 4) int array of disjoint windows
+    '''
+    boxes = np.asarray(windows, dtype=np.float64).reshape(-1, 4)
+    boxes = np.column_stack((np.floor(boxes[:, :2]), np.ceil(boxes[:, 2:])))
+    boxes = np.clip(boxes, 0, [shape[0], shape[1], shape[0], shape[1]]).astype(np.intp)
+    boxes = boxes[(boxes[:, 2] > boxes[:, 0]) & (boxes[:, 3] > boxes[:, 1])]
+
+    #merging two windows can make the result reach a third one, repeat until nothing changes
+    while len(boxes) > 1:
+        touch = ((boxes[:, None, 0] <= boxes[None, :, 2]) & (boxes[None, :, 0] <= boxes[:, None, 2]) &
+                 (boxes[:, None, 1] <= boxes[None, :, 3]) & (boxes[None, :, 1] <= boxes[:, None, 3]))
+        n, group = connected_components(coo_matrix(touch), directed=False)
+        if n == len(boxes):
+            break
+        merged = np.zeros((n, 4), dtype=np.intp)
+        merged[:, :2] = max(shape)
+        np.minimum.at(merged[:, 0], group, boxes[:, 0])
+        np.minimum.at(merged[:, 1], group, boxes[:, 1])
+        np.maximum.at(merged[:, 2], group, boxes[:, 2])
+        np.maximum.at(merged[:, 3], group, boxes[:, 3])
+        boxes = merged
+    return boxes
+
+
+def detect_blobs_in_windows(rgba, color, thresh, height, windows, srgb=True, sparse=False):
+    '''
+    detect_blobs restricted to parts of the frame. Only the pixels inside the windows are keyed and labelled.
+
+    Clusters cut by the border of a window (and not by the border of the frame) are dropped, their area and centroid
+    would be wrong. Windows should be larger than the search radius by at least the size of a marker.
+
+    :param rgba: (height, width, 4) array, row 0 is the top of the image
+    :param color: Color to search for
+    :param thresh: Minimum amount of connected pixels that form a cluster
+    :param height: Clusters with a y coordinate above this value are ignored
+    :param windows: (n, 4) array-like of (y_min, x_min, y_max, x_max) in pixels, they can overlap
+    :param srgb: See chroma_key
+    :param sparse: See find_blobs
+    :return: Blobs of all the clusters found inside the windows
+    '''
+    h, w = rgba.shape[:2]
+    found = []
+    for y0, x0, y1, x1 in merge_windows(windows, (h, w)):
+        blobs = _finalize(_detect_tile(rgba[y0:y1, x0:x1], color, srgb, sparse)[0])
+        bbox = blobs.bbox + (y0, x0, y0, x0)
+        cut = (((bbox[:, 0] == y0) & (y0 > 0)) | ((bbox[:, 1] == x0) & (x0 > 0)) |
+               ((bbox[:, 2] == y1) & (y1 < h)) | ((bbox[:, 3] == x1) & (x1 < w)))
+        found.append(Blobs(blobs.area[~cut], blobs.centroid[~cut] + (x0, y0), bbox[~cut]))
+    if not found:
+        return empty_blobs()
+    blobs = Blobs(*[np.concatenate(parts) for parts in zip(*found)])
+    return filter_blobs(blobs, thresh, height)
+
+
+def detect_blobs_pyramid(rgba, color, thresh, height, factor=2, srgb=True, sparse=False):
+    '''
+    Coarse to fine detection. Every factor-th pixel of every factor-th row is keyed to find candidate clusters, then the
+    full resolution pixels are keyed only in the blocks around the candidates and measured there.
+
+    A cluster at least factor pixels wide and tall always keeps a pixel in the coarse frame, so markers above the default
+    threshold survive factor 2 and 4. Clusters are then measured at full resolution, so positions match detect_blobs
+    unless a cluster reaches more than one block away from its sampled pixels (long thin shapes, not markers).
+
+    :param rgba: (height, width, 4) array, row 0 is the top of the image
+    :param color: Color to search for
+    :param thresh: Minimum amount of connected pixels that form a cluster
+    :param height: Clusters with a y coordinate above this value are ignored
+    :param factor: Downsampling factor of the coarse pass
+    :param srgb: See chroma_key
+    :param sparse: See find_blobs
+    :return: Blobs of all the clusters found
+    '''
+    h, w = rgba.shape[:2]
+    coarse = chroma_key(rgba[::factor, ::factor], color, srgb=srgb) > MATTE_EPSILON
+    if not coarse.any():
+        return empty_blobs()
+
+    #every coarse pixel stands for a factor x factor block, the blocks next to a candidate are searched too
+    roi = binary_dilation(coarse, np.ones((3, 3), dtype=bool))
+    roi = np.repeat(np.repeat(roi, factor, axis=0), factor, axis=1)[:h, :w]
+    ys, xs = np.nonzero(roi)
+
+    key = np.zeros((h, w), dtype=np.float32)
+    key[ys, xs] = chroma_key(rgba[ys, xs], color, srgb=srgb)
+    blobs = _finalize(_matte_sums(key > MATTE_EPSILON, key, sparse)[0])
+    return filter_blobs(blobs, thresh, height)
+
+
+def window_around(points, radius):
+    '''
+
+    :param points: (n, 2) array-like of (x, y) pixel positions
+    :param radius: Half size of the windows, the same for all the points or (n,) one per point
+    :return: (n, 4) array of (y_min, x_min, y_max, x_max) windows centered on the points
+    '''
+    pts = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    return np.column_stack((pts[:, 1] - radius, pts[:, 0] - radius, pts[:, 1] + radius, pts[:, 0] + radius))
+
+
+class ColorLUT():
+    '''
+    Quantized RGB lookup table classifying pixels between several key colors in a single pass over the frame.
+
+    Every cell of a bins x bins x bins grid over the RGB cube is keyed against every color with chroma_key. The cell gets
+    the class of the color that keys it the most (1 for the first color, 2 for the second, ...) or 0 if no color keys it.
+    Classifying a frame is then one table lookup per pixel, whatever the number of colors.
+
+    Usage:  lut = get_color_lut(colors)
+            classes, strength = lut.classify(rgba)
+    '''
+    def __init__(self, colors, bins=64, srgb=True, tolerance=CHROMA_TOLERANCE, threshold=CHROMA_THRESHOLD, gain=CHROMA_GAIN):
+        self.bins = bins
+        self.colors = [tuple(c[:3]) for c in colors]
+        #centers of the cells, in the same encoding as the frames that will be classified
+        axis = (np.arange(bins, dtype=np.float32) + 0.5) / bins
+        grid = np.stack(np.meshgrid(axis, axis, axis, indexing='ij'), axis=-1).reshape(-1, 3)
+
+        keys = np.stack([chroma_key(grid, c, tolerance, threshold, gain, srgb) for c in self.colors])
+        best = keys.argmax(axis=0)
+        self.strength = keys.max(axis=0).astype(np.float32)
+        self.classes = np.where(self.strength > MATTE_EPSILON, best + 1, 0).astype(np.uint8)
+
+    def classify(self, rgba):
+        '''
+
+        :param rgba: (height, width, 4) array with values in the 0..1 range, or uint8 bytes
+        :return: ((height, width) uint8 class of every pixel, (height, width) float32 key strength of that class)
+        '''
+        q = np.clip(to_float(rgba[..., :3]) * self.bins, 0, self.bins - 1).astype(np.intp)
+        idx = ((q[..., 0] * self.bins + q[..., 1]) * self.bins + q[..., 2]).ravel()
+        shape = rgba.shape[:2]
+        return self.classes.take(idx).reshape(shape), self.strength.take(idx).reshape(shape)
+
+
+_luts = {}
+
+
+def get_color_lut(colors, bins=64, srgb=True):
+    '''
+
+    :param colors: List of key colors
+    :param bins: Cells per channel
+    :param srgb: See chroma_key
+    :return: ColorLUT for these settings. Tables are kept and only rebuilt when the settings change.
+    '''
+    key = (tuple(tuple(round(v, 6) for v in c[:3]) for c in colors), bins, srgb)
+    lut = _luts.get(key)
+    if lut is None:
+        #settings changed, the old tables are not needed anymore
+        _luts.clear()
+        lut = _luts[key] = ColorLUT(colors, bins, srgb)
+    return lut
+
+
+def detect_color_blobs(rgba, colors, thresh, height, srgb=True, sparse=False):
+    '''
+    Detection for several colors at once, the frame is classified with a ColorLUT and each class is labelled separately.
+
+    :param rgba: (height, width, 4) array, row 0 is the top of the image
+    :param colors: List of key colors
+    :param thresh: Minimum amount of connected pixels that form a cluster, one value or one per color
+    :param height: Clusters with a y coordinate above this value are ignored
+    :param srgb: See chroma_key
+    :param sparse: See find_blobs
+    :return: List with the Blobs of every color
+    '''
+    threshes = np.broadcast_to(thresh, (len(colors),))
+    classes, strength = get_color_lut(colors, srgb=srgb).classify(rgba)
+    return [filter_blobs(_finalize(_matte_sums(classes == i + 1, strength, sparse)[0]), threshes[i], height)
+            for i in range(len(colors))]
+
+
+def blobs_to_points(blobs):
+    #List of (x, y) tuples, the format the rest of the addon works with
+    return [tuple(p) for p in blobs.centroid.tolist()]
+
+
+def points_from_matte(matte, thresh, height, weights=None, sparse=False):
+    '''
+
+    :param matte: (height, width) array, non-zero where the key color was found. Row 0 is the top of the image
+    :param thresh: Minimum amount of connected pixels that form a cluster
+    :param height: Clusters with a y coordinate above this value are ignored
+    :param weights: Optional pixel intensities, see component_stats
+    :param sparse: See find_blobs
+    :return: List of 2D Point locations where makers should be placed.
+    '''
+    return blobs_to_points(find_blobs(matte, thresh, height, weights, sparse))
+
+
+def detect_points(rgba, color, thresh, height, srgb=True, sparse=False, workers=1, windows=None, pyramid=1):
+    '''
+    In-memory replacement for the render, save and reload steps of getPoints.
+
+    :param rgba: (height, width, 4) array, row 0 is the top of the image
+    :param color: Color to search for
+    :param thresh: Minimum amount of connected pixels that form a cluster
+    :param height: Clusters with a y coordinate above this value are ignored
+    :param srgb: See chroma_key
+    :param sparse: See find_blobs
+    :param workers: See detect_blobs
+    :param windows: Optional (n, 4) array of (y_min, x_min, y_max, x_max) windows, see detect_blobs_in_windows.
+                    If None, the whole frame is searched.
+    :param pyramid: Downsampling factor of a coarse pass used to find candidates, see detect_blobs_pyramid. 1 disables it.
+    :return: List of 2D Point locations where makers should be placed.
+    '''
+    if windows is not None:
+        return blobs_to_points(detect_blobs_in_windows(rgba, color, thresh, height, windows, srgb, sparse))
+    if pyramid > 1:
+        return blobs_to_points(detect_blobs_pyramid(rgba, color, thresh, height, pyramid, srgb, sparse))
+    return blobs_to_points(detect_blobs(rgba, color, thresh, height, srgb, sparse, workers))
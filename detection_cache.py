@@ -0,0 +1,142 @@
+#Detection results kept on disk, so tracking the same frames again (to try another max_dist, for example) doesn't have to
+#look at the pixels. Only the main process reads and writes the cache file, worker results are added to it there.
+
+import hashlib
+import os
+import re
+
+import numpy as np
+
+from .detection import CHROMA_GAIN, CHROMA_THRESHOLD, CHROMA_TOLERANCE
+
+#Change when detection changes in a way that makes older results wrong, old cache files are then ignored
+CACHE_VERSION = 2
+CACHE_SUFFIX = ".detections.npz"
+
+
+def cache_path(clip_path, sequence):
+    '''
+
+    :param clip_path: Absolute path of the movie, or of the first image of a sequence
+    :param sequence: True for image sequences
+    :return: Path of the cache file, next to the clip
+    '''
+    base = os.path.splitext(clip_path)[0] if sequence else clip_path
+    if sequence:
+        #one cache for the whole sequence, not named after its first frame
+        base = re.sub(r"[-_.]?\d+$", "", base) or base
+    return base + CACHE_SUFFIX
+
+
+def file_identity(path):
+    '''
+
+    :param path: Frame file path
+    :return: (path, size, modification time in ns) of the file, None if it can't be read. The path is part of it because
+             the file a frame number points to changes with the clip's frame start and offset.
+    '''
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return os.path.normcase(os.path.abspath(path)), st.st_size, getattr(st, "st_mtime_ns", int(st.st_mtime * 1e9))
+
+
+def settings_digest(settings):
+    '''
+
+    :param settings: pipeline.DetectSettings
+    :return: Hex digest of everything the detected clusters depend on. The number of threads doesn't change the result.
+    '''
+    key = (CACHE_VERSION, CHROMA_TOLERANCE, CHROMA_THRESHOLD, CHROMA_GAIN,
+           [tuple(round(float(v), 6) for v in c) for c in settings.colors], list(settings.thresholds),
+           round(float(settings.height), 6), bool(settings.sparse), int(settings.pyramid))
+    return hashlib.md5(repr(key).encode()).hexdigest()
+
+
+class DetectionCache():
+    '''
+    Centroids and areas of the clusters found on every frame of a clip, for one set of detection settings.
+
+    A frame is found in the cache only if it comes from the same file, with the same size and modification time, as when it
+    was detected.
+    The cache file holds the results of a single set of settings, when the settings change it starts empty again.
+
+    The file is a numpy .npz archive: the settings digest, per frame its number, file path, size, modification time and
+    cluster count per color, then the centroids and areas of all the frames one after the other.
+
+    Usage:  cache = DetectionCache(path, settings)
+            compact = cache.get(frame, identity)      (None if not cached)
+            cache.put(frame, identity, compact)
+            cache.save()
+    '''
+    def __init__(self, path, settings):
+        self.path = path
+        self.settings = settings
+        self.digest = settings_digest(settings)
+        #{frame: (identity, compact)}, see pipeline.detect_file for the compact format
+        self.frames = {}
+        self.dirty = False
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with np.load(self.path) as data:
+                if str(data["digest"]) != self.digest:
+                    return
+                frames, paths, sizes, mtimes = data["frames"], data["paths"], data["sizes"], data["mtimes"]
+                counts = data["counts"]
+                centroids, areas = data["centroids"], data["areas"]
+        except (OSError, KeyError, ValueError) as e:
+            print("Ignoring detection cache {}: {}".format(self.path, e))
+            return
+
+        ends = np.cumsum(counts.ravel()).reshape(counts.shape)
+        starts = ends - counts
+        for i, frame in enumerate(frames.tolist()):
+            compact = [(centroids[s:e], areas[s:e]) for s, e in zip(starts[i].tolist(), ends[i].tolist())]
+            self.frames[frame] = ((str(paths[i]), int(sizes[i]), int(mtimes[i])), compact)
+
+    def get(self, frame, identity):
+        entry = self.frames.get(frame)
+        if identity is None or entry is None or entry[0] != identity:
+            return None
+        return entry[1]
+
+    def put(self, frame, identity, compact):
+        if identity is None:
+            return
+        entry = self.frames.get(frame)
+        if entry is not None and entry[0] == identity and entry[1] is compact:
+            return
+        self.frames[frame] = (identity, compact)
+        self.dirty = True
+
+    def save(self):
+        #writes the cache file if something was added, the old file is only replaced once the new one is complete
+        if not self.dirty:
+            return
+        frames = sorted(self.frames)
+        colors = len(self.settings.colors)
+        entries = [self.frames[f] for f in frames]
+        counts = np.array([[len(a) for c, a in compact] for identity, compact in entries], dtype=np.int32)
+        parts = [part for identity, compact in entries for part in compact]
+        tmp = self.path + ".tmp"
+        try:
+            with open(tmp, "wb") as f:
+                np.savez(f,
+                         digest=np.array(self.digest),
+                         frames=np.array(frames, dtype=np.int32),
+                         paths=np.array([e[0][0] for e in entries], dtype=np.str_),
+                         sizes=np.array([e[0][1] for e in entries], dtype=np.int64),
+                         mtimes=np.array([e[0][2] for e in entries], dtype=np.int64),
+                         counts=counts.reshape(len(frames), colors),
+                         centroids=np.concatenate([c for c, a in parts] or [np.zeros((0, 2))]).astype(np.float32),
+                         areas=np.concatenate([a for c, a in parts] or [np.zeros(0)]).astype(np.int32))
+            os.replace(tmp, self.path)
+        except OSError as e:
+            print("Couldn't save detection cache {}: {}".format(self.path, e))
+            return
+        self.dirty = False
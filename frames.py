@@ -0,0 +1,342 @@
+#Frame acquisition for the tracking operators. Pixels of the current clip frame are copied straight from Blender into a numpy
+#buffer that is reused from frame to frame, so nothing is written to disk by the addon itself. FrameSource adds decoding
+#ahead and a cache of decoded frames on top of that.
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import re
+
+import numpy as np
+import bpy
+from .pipeline import can_decode, decode_frame
+from .raw_frames import open_raw_frames
+
+#Datablocks used to pull frames out of Blender. They are created once and reused for every frame.
+GRAB_SCENE = "MarkerTrackerGrab"
+GRAB_IMAGE = "MarkerTrackerFrame"
+VIEWER_IMAGE = "Viewer Node"
+
+#Image.pixels has foreach_get since Blender 2.83. Before that, copying a frame out of an Image makes a python float per
+#value
+PIXELS_FOREACH_GET = bpy.app.version >= (2, 83, 0)
+
+#Image sequence file names: everything before the frame number, the frame number and the extension
+SEQUENCE_NAME = re.compile(r"^(.*?)(\d+)(\.\w+)?$")
+
+#Frames decoded ahead of the one being tracked, and the memory the decoded frames can take, see FrameSource
+PREFETCH_FRAMES = 4
+PREFETCH_THREADS = 2
+CACHE_MEMORY = 1024 * 2 ** 20
+
+
+def sequence_frame_path(clip, frame):
+    '''
+    Like Blender, the file clip.filepath points to is shown at scene frame clip.frame_start, moved by clip.frame_offset,
+    and the numbers of the files that follow keep its zero padding.
+
+    :param clip: Blender MovieClip with source 'SEQUENCE'
+    :param frame: Frame number
+    :return: Absolute path of the image file for that frame
+    '''
+    path = bpy.path.abspath(clip.filepath)
+    match = SEQUENCE_NAME.match(path)
+    if match is None:
+        return path
+    head, digits, ext = match.groups()
+    number = int(digits) + frame - clip.frame_start + clip.frame_offset
+    return "{}{:0{}d}{}".format(head, max(number, 0), len(digits), ext or "")
+
+
+class FrameGrabber():
+    '''
+    Copies clip frames into a preallocated numpy buffer.
+
+    Image sequences are loaded into a single Image datablock which is reloaded for every frame.
+    Movies are decoded by a small compositor scene (MovieClip -> Viewer) that is built once, the frame is read back from the
+    Viewer Node image instead of being saved as a png.
+
+    Usage:  grabber = get_grabber(clip)
+            pixels, srgb = grabber.grab(frame)
+
+    pixels is a (height, width, 4) view of the internal buffer, row 0 is the top of the image. It is only valid until the next grab.
+    '''
+    def __init__(self, clip):
+        self.clip_name = clip.name
+        self.buffer = np.empty(0, dtype=np.float32)
+
+    @property
+    def clip(self):
+        return bpy.data.movieclips[self.clip_name]
+
+    def grab(self, frame):
+        clip = self.clip
+        if clip.source == 'MOVIE':
+            img = self._render_movie_frame(clip, frame)
+        else:
+            path = sequence_frame_path(clip, frame)
+            #decoding the file is much faster than going through an Image, see read_image
+            if can_decode(path):
+                try:
+                    return decode_frame(path)
+                except (OSError, ValueError) as e:
+                    print("Reading frame {} through Blender: {}".format(frame, e))
+            img = self._load_sequence_frame(path)
+        return self.read_image(img), img.colorspace_settings.name == 'sRGB'
+
+    def owns(self, pixels):
+        #True if pixels is a view of the buffer, that the next grab overwrites
+        return np.may_share_memory(pixels, self.buffer)
+
+    def read_image(self, img):
+        '''
+
+        :param img: Blender Image
+        :return: (height, width, 4) view on the internal buffer with the pixels of img, top row first
+        '''
+        w, h = img.size
+        if self.buffer.size != w * h * 4:
+            self.buffer = np.empty(w * h * 4, dtype=np.float32)
+        if hasattr(img.pixels, "foreach_get"):
+            img.pixels.foreach_get(self.buffer)
+        else:
+            #Blender 2.79 has no foreach_get on property arrays. img.pixels[:] makes a python float per value, for a
+            #1080p frame that is slow, which is why grab decodes image sequence files itself when it can
+            self.buffer[:] = img.pixels[:]
+        #Blender stores images bottom to top
+        return self.buffer.reshape(h, w, 4)[::-1]
+
+    def _load_sequence_frame(self, path):
+        img = bpy.data.images.get(GRAB_IMAGE)
+        if img is None:
+            img = bpy.data.images.load(path, False)
+            img.name = GRAB_IMAGE
+        elif img.filepath != path:
+            img.filepath = path
+            img.reload()
+        return img
+
+    def _render_movie_frame(self, clip, frame):
+        scene = self._get_grab_scene(clip)
+        scene.frame_current = frame
+        bpy.ops.render.render(scene=scene.name)
+        return bpy.data.images[VIEWER_IMAGE]
+
+    def _get_grab_scene(self, clip):
+        scene = bpy.data.scenes.get(GRAB_SCENE)
+        if scene is None:
+            scene = bpy.data.scenes.new(GRAB_SCENE)
+            #the render needs a camera even though only the compositor is used
+            cam = bpy.data.objects.new(GRAB_SCENE, bpy.data.cameras.new(GRAB_SCENE))
+            scene.objects.link(cam)
+            scene.camera = cam
+            scene.use_nodes = True
+            scene.render.use_compositing = True
+            scene.render.resolution_percentage = 100
+
+        tree = scene.node_tree
+        input_node = tree.nodes.get("Clip")
+        if input_node is None:
+            for node in tree.nodes:
+                tree.nodes.remove(node)
+            input_node = tree.nodes.new(type="CompositorNodeMovieClip")
+            input_node.name = "Clip"
+            output_node = tree.nodes.new(type="CompositorNodeComposite")
+            viewer_node = tree.nodes.new(type="CompositorNodeViewer")
+            tree.links.new(input_node.outputs[0], output_node.inputs[0])
+            tree.links.new(input_node.outputs[0], viewer_node.inputs[0])
+        input_node.clip = clip
+        scene.render.resolution_x = clip.size[0]
+        scene.render.resolution_y = clip.size[1]
+        return scene
+
+
+class FrameSource():
+    '''
+    Frames of a clip as numpy arrays. Every frame asked for starts decoding the next few frames on a thread pool, in the
+    direction the frames are being asked for, and decoded frames are kept in a least recently used cache with a memory
+    cap. Tracking a range again, or going back and forth over it, doesn't decode the same files again.
+
+    Only image sequences the threads can read (see pipeline.can_decode) are decoded ahead, other frames are read through
+    the FrameGrabber when they are asked for, and cached as well.
+
+    If the clip was converted to a raw frame container (clip.raw_frames_path, see raw_frames.py), its frames are views on
+    that file instead, nothing is decoded or cached.
+
+    Usage:  source = get_frame_source(clip, prefetch, memory)
+            pixels, srgb = source.get(frame)
+
+    pixels belongs to the cache, it must not be modified.
+    '''
+    def __init__(self, clip, prefetch=PREFETCH_FRAMES, memory=CACHE_MEMORY):
+        self.clip_name = clip.name
+        self.filepath = clip.filepath
+        self.prefetch = prefetch
+        self.memory = memory
+        #{frame: (pixels, srgb)}, least recently used first
+        self.frames = OrderedDict()
+        self.used = 0
+        #{frame: future} of the frames being decoded ahead
+        self.pending = {}
+        self.pool = ThreadPoolExecutor(max_workers=PREFETCH_THREADS)
+        self.last = None
+
+    @property
+    def clip(self):
+        return bpy.data.movieclips[self.clip_name]
+
+    def get(self, frame):
+        '''
+
+        :param frame: Frame number
+        :return: ((height, width, 4) pixel array, True if the pixels are sRGB encoded)
+        '''
+        if self.is_raw(frame):
+            return self.raw.get(frame)
+
+        entry = self.frames.get(frame)
+        if entry is not None:
+            self.frames.move_to_end(frame)
+        else:
+            future = self.pending.pop(frame, None)
+            if future is not None:
+                try:
+                    entry = future.result()
+                except (OSError, ValueError) as e:
+                    print("Reading frame {} through Blender: {}".format(frame, e))
+            if entry is None:
+                entry = self._read(frame)
+            self._store(frame, entry)
+
+        step = -1 if self.last is not None and frame < self.last else 1
+        self.last = frame
+        self._prefetch(frame, step)
+        return entry
+
+    @property
+    def raw(self):
+        #RawFrames of the clip, None if it has none or they don't match the clip
+        clip = self.clip
+        path = bpy.path.abspath(clip.raw_frames_path) if clip.raw_frames_path else ""
+        if not path:
+            return None
+        try:
+            raw = open_raw_frames(path)
+        except (OSError, ValueError) as e:
+            print("Can't use raw frames {}: {}".format(path, e))
+            return None
+        if (raw.width, raw.height) != tuple(clip.size):
+            print("Raw frames {} are {}x{}, the clip is {}x{}".format(path, raw.width, raw.height, *clip.size))
+            return None
+        return raw
+
+    def is_raw(self, frame):
+        #True if the frame is read from the raw frame container of the clip
+        raw = self.raw
+        return raw is not None and frame in raw
+
+    def clear(self):
+        for future in self.pending.values():
+            future.cancel()
+        self.pending = {}
+        self.frames.clear()
+        self.used = 0
+
+    def _read(self, frame):
+        grabber = get_grabber(self.clip)
+        pixels, srgb = grabber.grab(frame)
+        #the grabber reuses its buffer for the next frame
+        return (pixels.copy() if grabber.owns(pixels) else pixels), srgb
+
+    def _store(self, frame, entry):
+        size = entry[0].nbytes
+        if size > self.memory:
+            return
+        while self.frames and self.used + size > self.memory:
+            old, (pixels, srgb) = self.frames.popitem(last=False)
+            self.used -= pixels.nbytes
+        self.frames[frame] = entry
+        self.used += size
+
+    def _prefetch(self, frame, step):
+        clip = self.clip
+        if clip.source == 'MOVIE' or self.prefetch <= 0:
+            #movie frames can only be read by Blender, on the main thread
+            return
+        first, last = clip.frame_start, clip.frame_start + clip.frame_duration - 1
+        ahead = [f for f in range(frame + step, frame + step * (self.prefetch + 1), step) if first <= f <= last]
+
+        #frames that aren't ahead anymore aren't needed soon
+        for f in list(self.pending):
+            if f not in ahead:
+                self.pending.pop(f).cancel()
+        for f in ahead:
+            if f in self.frames or f in self.pending:
+                continue
+            path = sequence_frame_path(clip, f)
+            if not can_decode(path):
+                return
+            self.pending[f] = self.pool.submit(decode_frame, path)
+
+
+_grabbers = {}
+
+
+def movie_needs_raw_frames(clip):
+    '''
+    Movie frames are rendered by the grab scene and copied out of the Viewer Node image. Without PIXELS_FOREACH_GET that
+    copy is slower than the png the COMPOSITOR backend renders, so movies are only worth reading with the NUMPY backend
+    once they are converted to raw frames (see sequence_converter.py).
+
+    :param clip: Blender MovieClip
+    :return: True if clip is a movie that the NUMPY backend should not read on this Blender version
+    '''
+    return clip.source == 'MOVIE' and not PIXELS_FOREACH_GET and get_frame_source(clip).raw is None
+
+
+def get_grabber(clip):
+    '''
+
+    :param clip: Blender MovieClip
+    :return: The FrameGrabber of this clip. Grabbers are kept between calls so their buffer is reused.
+    '''
+    grabber = _grabbers.get(clip.name)
+    if grabber is None:
+        grabber = _grabbers[clip.name] = FrameGrabber(clip)
+    return grabber
+
+
+_sources = {}
+
+
+def get_frame_source(clip, prefetch=None, memory=None):
+    '''
+
+    :param clip: Blender MovieClip
+    :param prefetch: Frames to decode ahead, unchanged if None
+    :param memory: Memory the cache of decoded frames can take in bytes, unchanged if None
+    :return: The FrameSource of this clip, kept between calls with its cache. The cache is emptied if the clip was
+             pointed to other files.
+    '''
+    source = _sources.get(clip.name)
+    if source is None:
+        source = _sources[clip.name] = FrameSource(clip)
+    elif source.filepath != clip.filepath:
+        source.clear()
+        source.filepath = clip.filepath
+    if prefetch is not None:
+        source.prefetch = prefetch
+    if memory is not None and memory != source.memory:
+        source.memory = memory
+        if source.used > memory:
+            source.clear()
+    return source
+
+
+def grab_frame(clip, frame):
+    '''
+
+    :param clip: Blender MovieClip
+    :param frame: Frame number
+    :return: ((height, width, 4) pixel array, True if the pixels are sRGB encoded), see FrameSource
+    '''
+    return get_frame_source(clip).get(frame)
@@ -0,0 +1,22 @@
+#Runs the batch tracker without the Blender UI:
+#   blender -b scene.blend --python headless_track.py -- --clip MyClip --start 1 --end 500 --save
+#Run it from the addon folder, or give the full path of this file. See batch_tracker.main for the arguments.
+#Movie clips can't be read in background mode, track an image sequence or a movie converted to raw frames.
+
+import importlib
+import os
+import sys
+
+import bpy
+
+addon_dir = os.path.dirname(os.path.abspath(__file__))
+package = os.path.basename(addon_dir)
+if os.path.dirname(addon_dir) not in sys.path:
+    sys.path.append(os.path.dirname(addon_dir))
+
+addon = importlib.import_module(package)
+#the addon may not be enabled in the preferences of this Blender, its properties are needed anyway
+if not hasattr(bpy.types.WindowManager, "op_props"):
+    addon.register()
+
+importlib.import_module(package + ".batch_tracker").main()
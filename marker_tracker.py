@@ -8,7 +8,6 @@ else:
     raise ImportError("Need numpy")
 sp = importlib.util.find_spec("scipy")
 if sp is not None:
-    from scipy.ndimage.measurements import find_objects, label
     from scipy.ndimage import imread
 else:
     raise ImportError("Need scipy")
@@ -20,19 +19,153 @@ from .utils import (
     get_vars_from_context,
     normalized_to_space,
     space_to_normalized,
-    dist,
     GlDrawOnScreen,
     draw_callback
 )
+from .detection import (
+    blobs_to_points,
+    detect_color_blobs,
+    detect_points,
+    points_from_matte,
+    window_around
+)
+from .frames import get_frame_source, grab_frame, movie_needs_raw_frames, sequence_frame_path
+from .association import associate
+from .motion import MotionModel
+from .track_store import MarkerIndex, TrackStore
+from .pipeline import (
+    NO_DECODER,
+    DetectionPipeline,
+    DetectSettings,
+    can_decode,
+    compact_to_points,
+    detect_compact,
+    have_decoder
+)
+from .detection_cache import DetectionCache, cache_path, file_identity, settings_digest
 
 from pprint import pprint as pp
 import time
 
 
+def read_frame(props, clip, frame):
+    #pixels of a clip frame, the next frames are decoded ahead with the settings in props
+    return get_frame_source(clip, props.prefetch_frames, props.frame_cache_size * 2 ** 20).get(frame)
+
 @time_it
-def getPoints(img, color, thresh,context):
+def get_frame_points(props, clip, frame, windows=None):
+    '''
+    NUMPY backend equivalent of get_frame_image followed by getPoints. The frame is copied from Blender into a reused
+    numpy buffer or decoded ahead by the FrameSource of the clip (see frames.py), no temporary png is written or read.
+
+    :param props: Tracking settings, context.window_manager.op_props
+    :param clip: Blender MovieClip to detect on
+    :param frame: Frame number
+    :param windows: Optional regions of the frame to search, see get_track_windows. None searches the whole frame.
+    :return: List of 2D Point locations where makers should be placed.
+    '''
+    pixels, srgb = read_frame(props, clip, frame)
+    return detect_points(pixels, clip.track_color.color, clip.track_color.thresh, props.ignore_height,
+                         srgb=srgb, sparse=props.labeling == 'SPARSE', workers=props.detect_workers, windows=windows,
+                         pyramid=int(props.pyramid_factor))
+
+def use_numpy_backend(props, clip):
+    #True if the frames of the clip are detected with the NUMPY backend. Movies stay on the COMPOSITOR backend where
+    #reading their frames into numpy is slower than the render, see frames.movie_needs_raw_frames
+    return props.detection_backend == 'NUMPY' and not movie_needs_raw_frames(clip)
+
+def get_track_colors(clip):
+    #All the ColorProperty settings of a clip, the main color first
+    return [clip.track_color] + list(clip.extra_colors)
+
+@time_it
+def get_frame_points_by_color(props, clip, frame):
+    '''
+    Multi color version of get_frame_points. The frame is classified once against all the colors of the clip with a
+    lookup table (see detection.ColorLUT), then the clusters of every color are found.
+
+    :param props: Tracking settings, context.window_manager.op_props
+    :param clip: Blender MovieClip to detect on
+    :param frame: Frame number
+    :return: One list of 2D Point locations per color, in the order of get_track_colors
+    '''
+    colors = get_track_colors(clip)
+    pixels, srgb = read_frame(props, clip, frame)
+    blobs = detect_color_blobs(pixels, [c.color for c in colors], [c.thresh for c in colors], props.ignore_height,
+                               srgb=srgb, sparse=props.labeling == 'SPARSE')
+    return [blobs_to_points(b) for b in blobs]
+
+def group_tracks_by_color(tracks, colors):
     '''
 
+    :param tracks: Blender Tracks on source clip
+    :param colors: ColorProperty list, see get_track_colors
+    :return: One list of tracks per color. Tracks go to the color closest to their custom color, or to the first color
+             if they don't use a custom color.
+    '''
+    groups = [[] for _ in colors]
+    for t in tracks:
+        best = 0
+        if t.use_custom_color:
+            best = min(range(len(colors)), key=lambda i: sum((a - b) ** 2 for a, b in zip(colors[i].color, t.color)))
+        groups[best].append(t)
+    return groups
+
+def get_last_marker(track, frame):
+    '''
+
+    :param track: Blender Track
+    :param frame: Frame number
+    :return: The last marker of the track before frame, None if there is none
+    '''
+    ct = 1
+    mrk = None
+    while mrk == None:
+        if (frame-ct<0):
+            print("Something is wrong here")
+            break
+        mrk = track.markers.find_frame(frame-ct)
+        ct+=1
+    return mrk
+
+def get_track_windows(tracks, frame, size, radius, margin, index=None, motion=None):
+    '''
+    Regions of the frame where the tracked markers can be found, used to skip detection on the rest of the frame. They
+    are placed where moveMarkers will look for the markers: lost tracks around their last position, the other tracks
+    around their predicted position when there is a motion model.
+
+    :param tracks: Blender Tracks on source clip
+    :param frame: Frame number
+    :param size: Image size
+    :param radius: How far from its last position a marker is searched for, max_dist
+    :param margin: Added to the search radius of every track, so whole markers fit in the windows
+    :param index: Optional MarkerIndex valid at frame
+    :param motion: Optional MotionModel, see moveMarkers
+    :return: (n, 4) array of windows, one per track with markers before frame, or None if no track has any and the
+             whole frame has to be searched.
+    '''
+    active, lost = [], []
+    for t in tracks:
+        last = _get_last(t, frame, index)
+        if last is None:
+            continue
+        (lost if last[2] else active).append((t, last))
+    if not active and not lost:
+        return None
+    everything = active + lost
+    positions = np.array([space_to_normalized(last[1], size) for t, last in everything]).reshape(-1, 2)
+    gates = np.full(len(everything), float(radius))
+    if motion is not None and active:
+        idx = motion.sync([t.name for t, last in active], positions[:len(active)], [last[0] for t, last in active])
+        positions[:len(active)], gates[:len(active)] = motion.peek(idx, frame)
+    return window_around(positions, gates + margin)
+
+@time_it
+def getPoints(img, color, thresh, context):
+    '''
+    Builds the matte with a CompositorNodeTree, renders it to a png and reads it back. The NUMPY backend uses
+    get_frame_points instead.
+
     :param img: Image to work on, as BlenderData
     :param color: Color to search for
     :param thresh: Minimum amount of connected pixels that form a cluster
@@ -110,28 +243,9 @@ def getPoints(img, color, thresh,context):
             return []
 
         #this converts the image to 1's and 0's
-        img = np.where(sc_img > 0 ,1, 0)
-
-        #specifies what pattern to look for in the image and labels each pattern found with a number.
-        #See scipy.ndimage.measurements.label and find_objects for more information on how this works.
-        labelled_array, num_features = label(img, np.ones((3,3),dtype=np.uint8))
-        #Finds all the labels in the image
-        slices = find_objects(labelled_array)
-
-        points_from_slices = []
-        for i,sl in enumerate(slices):
-            ct = np.count_nonzero(labelled_array[sl])
-
-            #print("Slice {} has {} values".format(i,ct))
-            #If the current slice has more non-zero pixels than the treshold specified, then this is a cluster.
-            if ct>thresh:
-                #Get the average x coordinate and the average y coord of the slice and append to the result.
-                cordx = (sl[1].start + sl[1].stop) / 2
-                cordy = (sl[0].start + sl[0].stop) / 2
-                if cordy > height:
-                    points_from_slices.append((cordx,cordy))
-
+        img = sc_img > 0
 
+        points_from_slices = points_from_matte(img, thresh, height, weights=sc_img, sparse=props.labeling == 'SPARSE')
 
         bpy.data.objects.remove(bpy.data.objects[cameraKey], True)
 
@@ -198,11 +312,7 @@ def get_frame_image(context):
     else:
         #If it's an image sequence, simply use the current frame, instead of rendering a temporary image.
         print("Its an image sequence at frame {}".format(scene.frame_current))
-        img_path = str(scene.frame_current).zfill(5)
-        base = an.filepath[:an.filepath.find('0')]
-        format = an.filepath[an.filepath.rfind('.'):]
-        real_path =  base + img_path + format
-        context.window_manager.op_props.dir = real_path
+        context.window_manager.op_props.dir = sequence_frame_path(an, scene.frame_current)
 
 def set_marker_search_area(marker,sz,img=(0,0)):
     #Sets the search size of a marker to sz
@@ -213,30 +323,129 @@ def set_marker_search_area(marker,sz,img=(0,0)):
     marker.search_max = (-a,-b)
 
 @time_it
-def assignMarkers(img, points, context):
+def assignMarkers(size, points, context, settings=None):
+    '''
+
+    :param size: Image size
+    :param points: Points where markers should be added
+    :param context: Blender Context
+    :param settings: ColorProperty the points were found with, defaults to clip.track_color. If given, the new tracks get
+                     its color as custom color, this is how tracks of different colors are told apart.
+    '''
     scene, props, space, clip, tracks, current_frame, clip_end, clip_start = get_vars_from_context(context)
+    color_tag = settings is not None
+    settings = settings if color_tag else clip.track_color
 
     #new_size = (-pattern_size,+pattern_size,-pattern_size,-pattern_size,pattern_size,)
     #These 3 constants will help with precise adjustment of the marker pattern size
-    ratio_x = clip.track_color.pattern_size / clip.size[0]
-    ratio_y = clip.track_color.pattern_size / clip.size[1]
+    ratio_x = settings.pattern_size / clip.size[0]
+    ratio_y = settings.pattern_size / clip.size[1]
     signs = [(-1, -1), (1, -1), (1, 1), (-1, 1)]
 
-    for i in points:
-        #add the points to the scene as markers. Have to convert the point location to Blender space coordinates.
-        bpy.ops.clip.add_marker(location=normalized_to_space(i,img.size))
+    #Tracks are created through the data API instead of bpy.ops.clip.add_marker, which is slow and pushes an undo step for
+    #every marker. Only the new tracks are set up, tracks added earlier keep their settings.
+    for p in points:
+        track = tracks.new(frame=scene.frame_current)
+        marker = track.markers.find_frame(scene.frame_current)
+        #Have to convert the point location to Blender space coordinates.
+        marker.co = normalized_to_space(p,size)
 
-    #Sets pattern size and search size of added markers.
-    for track in tracks:
-        track.markers[0].frame = scene.frame_current
-        for i,corner in enumerate(track.markers[0].pattern_corners):
+        #Sets pattern size and search size of added markers.
+        for i,corner in enumerate(marker.pattern_corners):
             corner[0] = ratio_x * signs[i][0]
             corner[1] = ratio_y * signs[i][1]
-        set_marker_search_area(track.markers[0],clip.track_color.search_size,clip.size)
+        set_marker_search_area(marker,settings.search_size,clip.size)
+
+        if color_tag:
+            track.color = settings.color[:3]
+            track.use_custom_color = True
 
     return
 
-def moveMarkers(tracks,points,frame,size,d):
+#Motion models of the clips being tracked, by clip name. See get_motion_model
+_motion_models = {}
+
+def get_motion_model(clip, max_dist):
+    '''
+
+    :param clip: Blender MovieClip
+    :param max_dist: Largest search radius
+    :return: The MotionModel of the clip, kept between frames so it can learn the velocity of the tracks
+    '''
+    model = _motion_models.get(clip.name)
+    if model is None:
+        model = _motion_models[clip.name] = MotionModel(max_dist)
+    model.max_gate = max_dist
+    return model
+
+def reset_motion_model(clip):
+    #forget the velocities learned so far, used when a new tracking run starts
+    _motion_models.pop(clip.name, None)
+
+#Track stores of the clips being tracked by the modal operator or the batch tracker, by clip name. See get_marker_index
+_marker_indices = {}
+
+def get_marker_index(clip, tracks, frame):
+    '''
+
+    :param clip: Blender MovieClip
+    :param tracks: Blender Tracks of the clip
+    :param frame: Frame about to be tracked
+    :return: MarkerIndex of the clip valid at frame. While a tracking run owns a TrackStore of the clip (see
+             start_track_store) the store is returned and kept from one frame to the next. Otherwise the index is built
+             again from the markers, the user may have moved, muted or deleted some since the last frame was tracked.
+    '''
+    index = _marker_indices.get(clip.name)
+    if index is not None and index.matches(tracks, frame):
+        return index
+    if index is not None:
+        #tracking didn't continue from the last tracked frame or the tracks changed, the stored markers reach Blender
+        #before the store is dropped
+        index.flush(tracks)
+        del _marker_indices[clip.name]
+    return MarkerIndex(tracks, frame)
+
+def start_track_store(clip, tracks, start, end):
+    #From now on moveMarkers writes the markers of this clip to a TrackStore, see flush_track_store
+    if end < start:
+        #nothing left to track, the current frame is already at or past the end frame
+        return
+    _marker_indices[clip.name] = TrackStore(tracks, start, end)
+
+def flush_track_store(clip, tracks, stop=False):
+    '''
+    Writes the markers kept in the TrackStore of the clip to Blender.
+
+    :param clip: Blender MovieClip
+    :param tracks: Blender Tracks of the clip
+    :param stop: If True, the store is dropped and markers are written directly again
+    '''
+    index = _marker_indices.get(clip.name)
+    if getattr(index, "deferred", False):
+        index.flush(tracks)
+        if stop:
+            del _marker_indices[clip.name]
+
+def _get_last(t, frame, index):
+    #(frame, co, mute) of the last marker of the track before frame, from the index if there is one
+    if index is not None:
+        return index.last(t.name)
+    mrk = get_last_marker(t, frame)
+    return (mrk.frame, tuple(mrk.co), mrk.mute) if mrk is not None else None
+
+def _insert_marker(t, frame, co, index):
+    if not getattr(index, "deferred", False):
+        t.markers.insert_frame(frame,co)
+    if index is not None:
+        index.insert(t.name, frame, co)
+
+def _mute_last_marker(t, last, mute, index):
+    if not getattr(index, "deferred", False):
+        t.markers.find_frame(last[0]).mute = mute
+    if index is not None:
+        index.set_mute(t.name, mute)
+
+def moveMarkers(tracks,points,frame,size,d,motion=None,index=None):
 
     '''
 
@@ -245,65 +454,145 @@ def moveMarkers(tracks,points,frame,size,d):
     :param frame: Frame number
     :param size: Image size
     :param d: Maximum distance a marker can move
+    :param motion: Optional MotionModel. If given, active markers are searched for around their predicted position, each
+                   within its own radius (never more than d), instead of within d of their last position. Lost markers
+                   are always searched for within d of their last position.
+    :param index: Optional MarkerIndex valid at frame, used to find the last markers. It is updated with the changes made.
+                  If it is a TrackStore, the changes are only made in the store.
     :return: Nothing, but it assigns each existing marker to a new position or records the marker as lost.
     '''
-    #keep track of lost markers
-    lost = {}
+    #split the tracks in active ones and lost ones, based on their last recorded marker
+    active, lost = [], []
     for t in tracks:
-        #find the last recorded marker for this track
-        marked = False
-        ct = 1
-        mrk = None
-        while mrk == None:
-            if (frame-ct<0):
-                print("Something is wrong here")
-                break
-            mrk = t.markers.find_frame(frame-ct)
-            ct+=1
-        #if the last recorder marker is disabled, add this track to the lost tracks
-        if mrk.mute:
-            lost[t.name] = (t,mrk)
+        last = _get_last(t, frame, index)
+        if last is None:
             continue
-
-        #we now check what is the closest point to the location of this marker and move the marker to that location
-        pos = space_to_normalized(mrk.co,size)
-        for i,p in enumerate(points):
-          if dist(pos,p)<d:
-              t.markers.insert_frame(frame,normalized_to_space(p,size))
-              points.pop(i)
-              marked = True
-              break
-        #if no points were found close enough to this marker, we disable the marker.
-        if not marked:
-                mrk.mute = True
+        #if the last recorder marker is disabled, add this track to the lost tracks
+        (lost if last[2] else active).append((t, last))
+
+    #where to look for each track and how far
+    everything = active + lost
+    positions = np.array([space_to_normalized(last[1],size) for t, last in everything]).reshape(-1, 2)
+    gates = np.full(len(everything), float(d))
+    if motion is not None:
+        idx = motion.sync([t.name for t, last in everything], positions, [last[0] for t, last in everything])
+        predicted, predicted_gates = motion.predict(idx[:len(active)], frame)
+        #lost tracks are still searched around where they were last seen, within d
+        positions[:len(active)] = predicted
+        gates[:len(active)] = predicted_gates
+
+    #every active track is moved to a point within its gate, all the tracks are assigned at once so that the
+    #total distance is the smallest. See association.associate
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    ti, pi = associate(positions[:len(active)], points, gates[:len(active)])
+    for i, p in zip(ti, pi):
+        _insert_marker(active[i][0], frame, normalized_to_space(points[p],size), index)
+    if motion is not None:
+        motion.update(idx[ti], points[pi])
+    #if no points were found close enough to this marker, we disable the marker.
+    unmatched = np.ones(len(active), dtype=bool)
+    unmatched[ti] = False
+    for i in np.flatnonzero(unmatched):
+        _mute_last_marker(active[i][0], active[i][1], True, index)
 
     #if there are points that haven't been assigned yet, check within lost tracks if any of them is close enough to be assigned to a new point.
-    if len(points) > 0:
-        keys = []
-        for k,vl in lost.items():
-            t,mrk = vl
-            pos = space_to_normalized(mrk.co,size)
-            for (i,p) in enumerate(points):
-                if (dist(pos,p)<d):
-                    mrk.mute = False
-                    t.markers.insert_frame(frame,normalized_to_space(p,size))
-                    points.pop(i)
-                    keys.append(k)
-        for k in keys:
-            del lost[k]
-    pp(lost)
+    free = np.ones(len(points), dtype=bool)
+    free[pi] = False
+    points = points[free]
+    if len(points) > 0 and lost:
+        ti, pi = associate(positions[len(active):], points, gates[len(active):])
+        for i, p in zip(ti, pi):
+            t, last = lost[i]
+            _mute_last_marker(t, last, False, index)
+            _insert_marker(t, frame, normalized_to_space(points[p],size), index)
+        if motion is not None:
+            motion.restart(idx[len(active) + ti], points[pi], frame)
+        found = set(ti.tolist())
+        lost = [l for i, l in enumerate(lost) if i not in found]
+    pp([t.name for t, last in lost])
+    if index is not None:
+        index.advance(frame + 1)
     return
 
 
+def track_frame(props, clip, frame, motion=None, index=None):
+    '''
+    Detects the markers of a frame with the NUMPY backend and moves the tracks of the clip to them. Doesn't need a
+    context, so it can also run from the batch tracker (see batch_tracker.py).
+
+    :param props: Tracking settings, context.window_manager.op_props
+    :param clip: Blender MovieClip
+    :param frame: Frame to track, the tracks must have markers before it
+    :param motion: Optional MotionModel, see moveMarkers
+    :param index: Optional MarkerIndex or TrackStore valid at frame, see moveMarkers
+    '''
+    cache = get_detection_cache(props, clip)
+    if cache is not None:
+        #cached frames are searched whole, with search windows the result would depend on the tracks
+        apply_frame_points(props, clip, frame, get_cached_points(props, cache, clip, frame), motion, index)
+        return
+
+    if len(clip.extra_colors):
+        apply_frame_points(props, clip, frame, get_frame_points_by_color(props, clip, frame), motion, index)
+        return
+
+    #between full frame passes, only search around the tracks
+    windows = None
+    if props.roi_detection and frame % props.full_detect_every != 0:
+        windows = get_track_windows(clip.tracking.tracks, frame, clip.size, props.max_dist,
+                                    clip.track_color.search_size / 2, index, motion)
+    apply_frame_points(props, clip, frame, [get_frame_points(props, clip, frame, windows)], motion, index)
+
+def apply_frame_points(props, clip, frame, point_sets, motion=None, index=None):
+    '''
+    Moves the tracks of the clip to the markers detected on a frame.
+
+    :param props: Tracking settings, context.window_manager.op_props
+    :param clip: Blender MovieClip
+    :param frame: Frame the points were found on
+    :param point_sets: One list of 2D Point locations per color, in the order of get_track_colors
+    :param motion: Optional MotionModel, see moveMarkers
+    :param index: Optional MarkerIndex or TrackStore valid at frame, see moveMarkers
+    '''
+    tracks = clip.tracking.tracks
+    groups = group_tracks_by_color(tracks, get_track_colors(clip)) if len(point_sets) > 1 else [tracks]
+    for group, points in zip(groups, point_sets):
+        moveMarkers(group,points,frame,clip.size,props.max_dist,motion,index)
+
+def get_detect_settings(props, clip, workers=None):
+    '''
+
+    :param props: Tracking settings, context.window_manager.op_props
+    :param clip: Blender MovieClip
+    :param workers: Threads per frame, props.detect_workers if None
+    :return: pipeline.DetectSettings, a copy of the detection settings that can be used outside of the main thread
+    '''
+    colors = get_track_colors(clip)
+    return DetectSettings(colors=[tuple(c.color) for c in colors], thresholds=[c.thresh for c in colors],
+                          height=props.ignore_height, sparse=props.labeling == 'SPARSE',
+                          workers=props.detect_workers if workers is None else workers, pyramid=int(props.pyramid_factor))
+
+
 class CLIP_OT_colortrack(bpy.types.Operator):
     '''
         This operator will use the image pointed at by context.window_manager.op_props.dir to find the clusters of points which will
-        form the new markers.
+        form the new markers. With the NUMPY detection backend the current frame is grabbed directly instead.
     '''
     bl_idname = "clip.color_track"
     bl_label = "Track Color"
 
     def execute(self, context):
+        clip = context.space_data.clip
+        use_numpy = use_numpy_backend(context.window_manager.op_props, clip)
+        if use_numpy and len(clip.extra_colors):
+            colors = get_track_colors(clip)
+            for settings, points in zip(colors, get_frame_points_by_color(context.window_manager.op_props, clip, context.scene.frame_current)):
+                assignMarkers(clip.size, points, context, settings)
+            return {'FINISHED'}
+        if use_numpy:
+            points = get_frame_points(context.window_manager.op_props, clip, context.scene.frame_current)
+            assignMarkers(clip.size, points, context)
+            return {'FINISHED'}
 
         with ScenarioManager(context,context.scene.name,context.area.type) as sc:
             #this will delete safedelete.png if the source clip is a MOVIE
@@ -316,7 +605,7 @@ class CLIP_OT_colortrack(bpy.types.Operator):
             context.window_manager.op_props.dir = bpy.data.filepath[:bpy.data.filepath.rfind("\\")] + "\\temp\\" + "safedelete.png"
             points = getPoints(img, context.space_data.clip.track_color.color, context.space_data.clip.track_color.thresh,context)
 
-            assignMarkers(img, points, context)
+            assignMarkers(img.size, points, context)
 
 
         return {'FINISHED'}
@@ -334,7 +623,9 @@ class CLIP_OT_assignMarkersOnColor(bpy.types.Operator):
 
     def execute(self, context):
 
-        get_frame_image(context)
+        #the NUMPY backend grabs the frame itself
+        if not use_numpy_backend(context.window_manager.op_props, context.edit_movieclip):
+            get_frame_image(context)
         bpy.ops.clip.color_track()
 
 
@@ -353,6 +644,12 @@ class CLIP_OT_moveMarkers(bpy.types.Operator):
             scene, props, space, clip, tracks, current_frame, clip_end, clip_start = get_vars_from_context(context)
             cur = scene.frame_current
             scene.frame_current+=1
+            motion = get_motion_model(clip, props.max_dist) if props.use_prediction else None
+            index = get_marker_index(clip, tracks, scene.frame_current)
+            if use_numpy_backend(props, clip):
+                track_frame(props, clip, scene.frame_current, motion, index)
+                return {'FINISHED'}
+
             get_frame_image(context)
             delete_it = True
             if context.edit_movieclip.source != 'MOVIE':
@@ -362,7 +659,9 @@ class CLIP_OT_moveMarkers(bpy.types.Operator):
             context.window_manager.op_props.dir = bpy.data.filepath[:bpy.data.filepath.rfind("\\")] + "\\temp\\" + "safedelete.png"
             points = getPoints(img, context.space_data.clip.track_color.color,
                                context.space_data.clip.track_color.thresh, context)
-            moveMarkers(tracks,points,scene.frame_current,clip.size,props.max_dist)
+            #the compositor only keys the main color, tracks of the extra colors are left alone
+            main_tracks = group_tracks_by_color(tracks, get_track_colors(clip))[0]
+            moveMarkers(main_tracks,points,scene.frame_current,clip.size,props.max_dist,motion,index)
 
 
         return {'FINISHED'}
@@ -371,6 +670,63 @@ class CLIP_OT_moveMarkers(bpy.types.Operator):
     def poll(cls,context):
         return (context.area.spaces.active.clip is not None)
 
+#Detection caches of the clips, by clip name. See get_detection_cache
+_detection_caches = {}
+
+def frame_file_path(clip, frame):
+    #file the pixels of a frame come from
+    if clip.source == 'MOVIE':
+        return bpy.path.abspath(clip.filepath)
+    return sequence_frame_path(clip, frame)
+
+def get_detection_cache(props, clip, settings=None):
+    '''
+
+    :param props: Tracking settings, context.window_manager.op_props
+    :param clip: Blender MovieClip
+    :param settings: pipeline.DetectSettings the frames are detected with, get_detect_settings if None
+    :return: DetectionCache of the clip for these settings, stored next to the clip. None if props.use_detection_cache
+             is off.
+    '''
+    if not props.use_detection_cache:
+        return None
+    settings = settings if settings is not None else get_detect_settings(props, clip)
+    path = cache_path(bpy.path.abspath(clip.filepath), clip.source != 'MOVIE')
+    cache = _detection_caches.get(clip.name)
+    if cache is None or cache.path != path or cache.digest != settings_digest(settings):
+        if cache is not None:
+            cache.save()
+        cache = _detection_caches[clip.name] = DetectionCache(path, settings)
+    cache.settings = settings
+    return cache
+
+def save_detection_cache(clip):
+    #writes the new results of the clip to its cache file
+    cache = _detection_caches.get(clip.name)
+    if cache is not None:
+        cache.save()
+
+def get_cached_points(props, cache, clip, frame):
+    '''
+    Whole frame detection through the cache, pixels are only read if the frame isn't cached or its file changed.
+
+    :param props: Tracking settings, context.window_manager.op_props
+    :param cache: DetectionCache, see get_detection_cache
+    :param clip: Blender MovieClip
+    :param frame: Frame number
+    :return: One list of 2D Point locations per color, in the order of get_track_colors
+    '''
+    identity = file_identity(frame_file_path(clip, frame))
+    compact = cache.get(frame, identity)
+    if compact is None:
+        pixels, srgb = read_frame(props, clip, frame)
+        compact = detect_compact(pixels, srgb, cache.settings)
+        cache.put(frame, identity, compact)
+    return compact_to_points(compact)
+
+#Longest time a TIMER event of background tracking spends applying finished frames, in seconds
+PIPELINE_STEP_TIME = 0.05
+
 class TrackMarkersModalOperator(bpy.types.Operator):
     '''
         Invokes CLIP_OT_moveMarkers repeteadly until we reach the end frame of the currenct clip in the current scene.
@@ -386,6 +742,8 @@ class TrackMarkersModalOperator(bpy.types.Operator):
     gl = GlDrawOnScreen()
     progress = 0
     start = 0
+    #DetectionPipeline when detecting on background threads, see pipeline_step
+    pipe = None
 
 
     def modal(self, context, event):
@@ -403,20 +761,88 @@ class TrackMarkersModalOperator(bpy.types.Operator):
             self.cancel(context)
             return {'FINISHED'}
 
+        #detection runs on background threads, the timer keeps running while this step applies the finished frames
+        if self.pipe is not None:
+            self.pipeline_step(context)
+            return {'RUNNING_MODAL'}
+
         #Stop timer while executing work
         self.stop_timer(context)
 
         #invoke CLIP_OT_moveMarkers
         bpy.ops.clip.movemarkers('INVOKE_DEFAULT')
-
-        self.progress = (self.current - self.start + 1) / self.total
-        self.current+=1
+        self.frame_done(context)
 
         # Start timer again for the next iteration
         self.start_timer(context)
 
         return {'RUNNING_MODAL'}
 
+    def frame_done(self, context):
+        self.progress = (self.current - self.start + 1) / self.total
+        self.current+=1
+
+        #markers are tracked into a TrackStore, write them to the clip from time to time so progress can be seen
+        flush_every = context.window_manager.op_props.flush_every
+        if flush_every and (self.current - self.start) % flush_every == 0:
+            clip = bpy.data.movieclips[self.clip_name]
+            flush_track_store(clip, clip.tracking.tracks)
+
+    def pipeline_step(self, context):
+        '''
+        One TIMER event of background tracking: queues the next frames for detection and applies the frames that are done.
+        Only the association and the marker writes run here, on the main thread.
+        '''
+        scene = context.scene
+        props = context.window_manager.op_props
+        clip = bpy.data.movieclips[self.clip_name]
+
+        cache = get_detection_cache(props, clip, self.pipe.settings)
+        source = get_frame_source(clip)
+
+        #keep the queue full. Image files are decoded by the threads, movie frames can only be read by Blender so one
+        #frame is read per step to keep the UI responsive
+        while not self.pipe.full() and self.next_frame <= scene.frame_end:
+            frame = self.next_frame
+            self.next_frame += 1
+            compact = cache.get(frame, file_identity(frame_file_path(clip, frame))) if cache is not None else None
+            if compact is not None:
+                self.pipe.submit_result(frame, compact)
+                continue
+            if source.is_raw(frame):
+                #a view on the raw frame file, nothing to decode
+                self.pipe.submit_pixels(frame, *source.get(frame))
+                continue
+            if clip.source != 'MOVIE':
+                path = sequence_frame_path(clip, frame)
+                if can_decode(path):
+                    self.pipe.submit_file(frame, path)
+                    continue
+            #the frame belongs to the FrameSource cache, which doesn't change it
+            self.pipe.submit_pixels(frame, *read_frame(props, clip, frame))
+            break
+
+        t = time.time()
+        while self.pipe.ready() and time.time() - t < PIPELINE_STEP_TIME:
+            frame, compact = self.pop_frame(clip)
+            if cache is not None:
+                cache.put(frame, file_identity(frame_file_path(clip, frame)), compact)
+            motion = get_motion_model(clip, props.max_dist) if props.use_prediction else None
+            index = get_marker_index(clip, clip.tracking.tracks, frame)
+            apply_frame_points(props, clip, frame, compact_to_points(compact), motion, index)
+            scene.frame_current = frame
+            self.frame_done(context)
+
+    def pop_frame(self, clip):
+        frame = self.pipe.oldest()
+        try:
+            return self.pipe.pop()
+        except (OSError, ValueError) as e:
+            #a file the threads can't read, Blender reads it instead
+            print("Reading frame {} through Blender: {}".format(frame, e))
+            pixels, srgb = grab_frame(clip, frame)
+            return frame, detect_compact(pixels, srgb, self.pipe.settings)
+
     def invoke(self, context, event):
 
         scene, props, space, clip, tracks, current_frame, clip_end, clip_start = get_vars_from_context(context)
@@ -424,6 +850,18 @@ class TrackMarkersModalOperator(bpy.types.Operator):
         self.progress = 0
         self.start = scene.frame_current
         self.current = self.start
+        #velocities from an earlier run don't apply anymore
+        reset_motion_model(clip)
+        #CLIP_OT_moveMarkers tracks the frames after the current one
+        self.clip_name = clip.name
+        start_track_store(clip, tracks, scene.frame_current + 1, scene.frame_end)
+        if props.use_pipeline and use_numpy_backend(props, clip):
+            #frames are spread over the threads, one thread per frame
+            self.pipe = DetectionPipeline(get_detect_settings(props, clip, workers=1), props.detect_workers,
+                                          props.pipeline_depth)
+            if clip.source != 'MOVIE' and not clip.raw_frames_path and not have_decoder():
+                self.report({'WARNING'}, NO_DECODER)
+            self.next_frame = scene.frame_current + 1
 
         # draw progress
         args = (self, context)
@@ -447,6 +885,12 @@ class TrackMarkersModalOperator(bpy.types.Operator):
     def cancel(self, context):
         self.stop_timer(context)
         bpy.types.SpaceClipEditor.draw_handler_remove(self._draw_handler,'WINDOW')
+        if self.pipe is not None:
+            self.pipe.close()
+            self.pipe = None
+        clip = bpy.data.movieclips[self.clip_name]
+        save_detection_cache(clip)
+        flush_track_store(clip, clip.tracking.tracks, stop=True)
 
     def __init__(self):
         self.t = time.time()
@@ -458,6 +902,42 @@ class TrackMarkersModalOperator(bpy.types.Operator):
     def poll(cls, context):
         return (context.area.spaces.active.clip is not None)
 
+class CLIP_OT_addTrackColor(bpy.types.Operator):
+    '''
+        Adds another color to track on the current clip. Markers of every color are found in the same pass over the frame.
+    '''
+    bl_idname = "clip.add_track_color"
+    bl_label = "Add Color"
+    bl_description = "Track another color on this clip"
+
+    def execute(self, context):
+        clip = context.edit_movieclip
+        extra = clip.extra_colors.add()
+        #start from the main color settings
+        extra.thresh = clip.track_color.thresh
+        extra.pattern_size = clip.track_color.pattern_size
+        extra.search_size = clip.track_color.search_size
+        return {'FINISHED'}
+
+    @classmethod
+    def poll(cls, context):
+        return context.edit_movieclip is not None
+
+class CLIP_OT_removeTrackColor(bpy.types.Operator):
+    bl_idname = "clip.remove_track_color"
+    bl_label = "Remove Color"
+    bl_description = "Stop tracking this color"
+
+    index = bpy.props.IntProperty()
+
+    def execute(self, context):
+        context.edit_movieclip.extra_colors.remove(self.index)
+        return {'FINISHED'}
+
+    @classmethod
+    def poll(cls, context):
+        return context.edit_movieclip is not None
+
 class CLIP_PT_color(bpy.types.Panel):
     #This is the panel that gives you access to the operator CLIP_OT_AssignMarkersOnColor
     bl_label = "Color Tracker"
@@ -481,9 +961,29 @@ class CLIP_PT_color(bpy.types.Panel):
         row = layout.row()
         row.label("Search box size")
         row.prop(an.track_color, "search_size")
+
+        #additional colors, only used by the NUMPY backend
+        for i, extra in enumerate(an.extra_colors):
+            row = layout.row(align=True)
+            row.prop(extra, "color", text="")
+            row.prop(extra, "thresh", text="")
+            row.operator("clip.remove_track_color", text="", icon="X").index = i
+        row = layout.row()
+        row.operator("clip.add_track_color", icon="ZOOMIN")
+
         row = layout.row()
         row.label("Height to ignore")
         row.prop(wm.op_props, "ignore_height")
+        row = layout.row()
+        row.prop(wm.op_props, "detection_backend", expand=True)
+        if wm.op_props.detection_backend == 'NUMPY' and movie_needs_raw_frames(an):
+            layout.label("Movies use the compositor, convert to raw frames for NumPy", icon='INFO')
+        row = layout.row()
+        row.prop(wm.op_props, "labeling", expand=True)
+        row = layout.row()
+        row.prop(wm.op_props, "detect_workers")
+        row = layout.row()
+        row.prop(wm.op_props, "pyramid_factor", expand=True)
         #layout.operator("clip.color_track")
         row = layout.row(align=True)
         row.scale_y = 1.5
@@ -509,6 +1009,9 @@ class TrackPanel(bpy.types.Panel):
         row = layout.row(align=True)
         row.scale_y = 1.5
         row.operator("tracking.move_markers", text="Automated tracking", icon="PLAY")
+        row = layout.row(align=True)
+        row.operator("clip.batch_track", text="Batch tracking", icon="FF")
+        row.prop(wm.op_props, "detect_processes")
 
         layout.separator()
 
@@ -516,4 +1019,28 @@ class TrackPanel(bpy.types.Panel):
         row.prop(wm.op_props, "time_step")
 
         row = layout.row()
-        row.prop(wm.op_props, "max_dist")
\ No newline at end of file
+        row.prop(wm.op_props, "max_dist")
+        row = layout.row()
+        row.prop(wm.op_props, "use_prediction")
+        row = layout.row()
+        row.prop(wm.op_props, "flush_every")
+
+        row = layout.row()
+        row.prop(wm.op_props, "use_detection_cache")
+        row = layout.row(align=True)
+        row.prop(wm.op_props, "prefetch_frames")
+        row.prop(wm.op_props, "frame_cache_size")
+        row = layout.row()
+        row.prop(wm.op_props, "use_pipeline")
+        row = layout.row()
+        row.active = wm.op_props.use_pipeline
+        row.prop(wm.op_props, "pipeline_depth")
+        clip = context.area.spaces.active.clip
+        if clip.source != 'MOVIE' and not clip.raw_frames_path and not have_decoder():
+            layout.label("Install Pillow to read frames in the background", icon='ERROR')
+
+        row = layout.row()
+        row.prop(wm.op_props, "roi_detection")
+        row = layout.row()
+        row.active = wm.op_props.roi_detection
+        row.prop(wm.op_props, "full_detect_every")
\ No newline at end of file
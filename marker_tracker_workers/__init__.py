@@ -0,0 +1,7 @@
+#The package the worker processes import the bpy free modules of the addon from, see utils.worker_module. It has no
+#modules of its own, its path is the addon folder: "marker_tracker_workers.pipeline" is pipeline.py, imported without the
+#addon's __init__.py, which needs bpy.
+
+import os
+
+__path__.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
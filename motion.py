@@ -0,0 +1,147 @@
+#Motion prediction for the tracks. The model keeps its own state per track name, marker_tracker.get_motion_model keeps one
+#per clip from one frame to the next.
+
+import numpy as np
+
+#Expected change of velocity from one frame to the next, in pixels per frame
+ACCELERATION_NOISE = 2.0
+#Expected error of a detected marker position, in pixels
+MEASUREMENT_NOISE = 1.0
+#How many standard deviations of the predicted position a marker can be away and still be matched
+GATE_SIGMAS = 3.0
+#Smallest search radius, in pixels
+MIN_GATE = 5.0
+#Uncertainty of the velocity of a track that just started, in pixels per frame
+INITIAL_VELOCITY = 20.0
+
+
+class MotionModel():
+    '''
+    Constant velocity Kalman filter running for all the tracks at once. The state of every track (x, y, vx, vy) and its
+    covariance are rows of numpy arrays, so predicting and updating many tracks is a handful of array operations.
+
+    Each track gets its own search radius from the uncertainty of its prediction: tracks that move steadily are searched
+    for in a small area around where they are expected to be, tracks that just started or were not seen for a while in a
+    bigger one, up to max_gate.
+
+    Tracks that are lost are not predicted: they are searched for where they were last seen, and start again from where
+    they are found with restart.
+
+    Usage:  idx = model.sync(names, positions, frames)
+            predicted, gates = model.predict(idx, frame)
+            ... match predicted positions to the detected points ...
+            model.update(idx[matched], points)
+            model.restart(idx[found], points, frame)    (lost tracks that were found again)
+    '''
+    def __init__(self, max_gate, min_gate=MIN_GATE, acceleration=ACCELERATION_NOISE, noise=MEASUREMENT_NOISE,
+                 sigmas=GATE_SIGMAS):
+        self.max_gate = max_gate
+        self.min_gate = min_gate
+        self.acceleration = acceleration
+        self.noise = noise
+        self.sigmas = sigmas
+        self.names = {}
+        self.state = np.zeros((0, 4))
+        self.cov = np.zeros((0, 4, 4))
+        #frame of the state and last measured position of every track
+        self.frame = np.zeros(0, dtype=np.intp)
+        self.measured = np.zeros((0, 2))
+
+    def sync(self, names, positions, frames):
+        '''
+        Makes sure the model knows the tracks. New tracks, and tracks whose last marker is not where the model saw it (the
+        marker was edited by hand), start again from their marker with no velocity.
+
+        :param names: Track names
+        :param positions: (n, 2) last known positions of the tracks, in pixels
+        :param frames: Frames of those positions
+        :return: Model index of every track
+        '''
+        positions = np.asarray(positions, dtype=np.float64).reshape(-1, 2)
+        new = [n for n in names if n not in self.names]
+        if new:
+            start = len(self.names)
+            for i, n in enumerate(new):
+                self.names[n] = start + i
+            self.state = np.concatenate((self.state, np.zeros((len(new), 4))))
+            self.cov = np.concatenate((self.cov, np.zeros((len(new), 4, 4))))
+            self.frame = np.concatenate((self.frame, np.zeros(len(new), dtype=np.intp)))
+            self.measured = np.concatenate((self.measured, np.full((len(new), 2), np.nan)))
+
+        idx = np.array([self.names[n] for n in names], dtype=np.intp)
+        moved = ~(np.abs(self.measured[idx] - positions) <= 0.5).all(axis=1)
+        self.restart(idx[moved], positions[moved], np.asarray(frames, dtype=np.intp)[moved])
+        return idx
+
+    def restart(self, idx, positions, frames):
+        '''
+        Starts the tracks again from a position, with no velocity. Used for tracks that were lost: the velocity they had
+        before says nothing about where they are when they are found again.
+
+        :param idx: Model indices of the tracks
+        :param positions: (n, 2) positions, in pixels
+        :param frames: Frame of every position, or a single frame for all of them
+        '''
+        positions = np.asarray(positions, dtype=np.float64).reshape(-1, 2)
+        self.state[idx] = 0
+        self.state[idx, :2] = positions
+        self.cov[idx] = np.diag([self.noise ** 2, self.noise ** 2, INITIAL_VELOCITY ** 2, INITIAL_VELOCITY ** 2])
+        self.frame[idx] = frames
+        self.measured[idx] = positions
+
+    def predict(self, idx, frame):
+        '''
+        Moves the state of the tracks forward to frame.
+
+        :param idx: Model indices of the tracks, from sync
+        :param frame: Frame to predict
+        :return: ((n, 2) predicted positions, (n,) search radius of every track)
+        '''
+        state, cov = self._propagate(idx, frame)
+        self.state[idx] = state
+        self.cov[idx] = cov
+        self.frame[idx] = frame
+        return state[:, :2].copy(), self.gates(cov)
+
+    def peek(self, idx, frame):
+        #like predict, but the state of the tracks doesn't change. Used to place the search windows before detecting
+        state, cov = self._propagate(idx, frame)
+        return state[:, :2], self.gates(cov)
+
+    def _propagate(self, idx, frame):
+        #(state, covariance) of the tracks at frame
+        dt = (frame - self.frame[idx]).astype(np.float64)
+        n = len(idx)
+        F = np.tile(np.eye(4), (n, 1, 1))
+        F[:, 0, 2] = F[:, 1, 3] = dt
+        #white acceleration noise integrated over dt
+        q = self.acceleration ** 2
+        Q = np.zeros((n, 4, 4))
+        Q[:, 0, 0] = Q[:, 1, 1] = q * dt ** 4 / 4
+        Q[:, 0, 2] = Q[:, 2, 0] = Q[:, 1, 3] = Q[:, 3, 1] = q * dt ** 3 / 2
+        Q[:, 2, 2] = Q[:, 3, 3] = q * dt ** 2
+        return (np.einsum('nij,nj->ni', F, self.state[idx]),
+                np.einsum('nij,njk,nlk->nil', F, self.cov[idx], F) + Q)
+
+    def gates(self, cov):
+        #radius of the circle containing the predicted position within `sigmas` standard deviations, from the
+        #(n, 4, 4) covariances of the tracks
+        S = cov[:, :2, :2] + np.eye(2) * self.noise ** 2
+        a, b, c = S[:, 0, 0], S[:, 0, 1], S[:, 1, 1]
+        largest = (a + c) / 2 + np.sqrt(((a - c) / 2) ** 2 + b ** 2)
+        return np.clip(self.sigmas * np.sqrt(largest), self.min_gate, self.max_gate)
+
+    def update(self, idx, positions):
+        '''
+        Corrects the state of the tracks with the positions they were matched to.
+
+        :param idx: Model indices of the matched tracks
+        :param positions: (n, 2) matched positions, in pixels
+        '''
+        positions = np.asarray(positions, dtype=np.float64).reshape(-1, 2)
+        P = self.cov[idx]
+        S = P[:, :2, :2] + np.eye(2) * self.noise ** 2
+        K = np.einsum('nij,njk->nik', P[:, :, :2], np.linalg.inv(S))
+        self.state[idx] += np.einsum('nij,nj->ni', K, positions - self.state[idx, :2])
+        self.cov[idx] = P - np.einsum('nij,njk->nik', K, P[:, :2, :])
+        self.measured[idx] = positions
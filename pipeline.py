@@ -0,0 +1,193 @@
+#Detection running ahead of the tracker on background threads, and the per frame functions the worker processes of the
+#batch tracker run. Blender data can only be touched from the main thread, so everything the threads need is copied out
+#of Blender before they start.
+
+from collections import deque, namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor
+import os
+
+import numpy as np
+
+if __package__:
+    from .detection import blobs_to_points, detect_blobs, detect_blobs_pyramid, detect_color_blobs
+    from .raw_frames import open_raw_frames
+else:
+    #imported on its own from the addon folder, by the tests
+    from detection import blobs_to_points, detect_blobs, detect_blobs_pyramid, detect_color_blobs
+    from raw_frames import open_raw_frames
+
+#Pillow is optional, Blender doesn't come with it. Without it image sequence frames are read by Blender, on the main thread
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+NO_DECODER = "Pillow is not installed: image sequence frames are read by Blender one at a time on the main thread"
+
+#File types the threads can decode themselves, other frames are read through Blender on the main thread
+DECODABLE = {".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff", ".tga"}
+#PIL image modes holding 8 bit values that convert to RGBA without losing anything
+BYTE_MODES = {"1", "L", "LA", "P", "RGB", "RGBA", "RGBX", "CMYK", "YCbCr"}
+
+#Plain copy of the detection settings of a clip, see marker_tracker.get_detect_settings.
+#colors and thresholds have one entry per color, the main color first.
+DetectSettings = namedtuple("DetectSettings", "colors thresholds height sparse workers pyramid")
+
+
+def have_decoder():
+    #True if image files can be decoded off the main thread, see NO_DECODER
+    return Image is not None
+
+
+def can_decode(path):
+    '''
+
+    :param path: Image file path
+    :return: True if decode_frame can read the file without Blender
+    '''
+    return have_decoder() and os.path.splitext(path)[1].lower() in DECODABLE
+
+
+def decode_frame(path):
+    '''
+    Reads an 8 bit image file without Blender, so it can run on any thread.
+
+    :param path: Image file path
+    :return: ((height, width, 4) float32 array in the 0..1 range, row 0 at the top, True since byte images are sRGB)
+    :raises ValueError: if the image is not 8 bit, Blender has to read those
+    '''
+    with Image.open(path) as img:
+        if img.mode not in BYTE_MODES:
+            raise ValueError("Can't decode {} image {}".format(img.mode, path))
+        pixels = np.asarray(img.convert("RGBA"), dtype=np.float32)
+    pixels /= 255
+    return pixels, True
+
+
+def detect_frame_blobs(pixels, srgb, settings):
+    '''
+    Finds the markers of every color on a frame, the same way marker_tracker.get_frame_points and
+    get_frame_points_by_color do, but from plain settings so it can run on any thread or process.
+
+    :param pixels: (height, width, 4) array, row 0 is the top of the image
+    :param srgb: See detection.chroma_key
+    :param settings: DetectSettings
+    :return: List with the detection.Blobs of every color
+    '''
+    if len(settings.colors) > 1:
+        return detect_color_blobs(pixels, settings.colors, settings.thresholds, settings.height, srgb=srgb,
+                                  sparse=settings.sparse)
+    if settings.pyramid > 1:
+        return [detect_blobs_pyramid(pixels, settings.colors[0], settings.thresholds[0], settings.height,
+                                     settings.pyramid, srgb, settings.sparse)]
+    return [detect_blobs(pixels, settings.colors[0], settings.thresholds[0], settings.height, srgb, settings.sparse,
+                         settings.workers)]
+
+
+def detect_frame(pixels, srgb, settings):
+    '''
+
+    :param pixels: (height, width, 4) array, row 0 is the top of the image
+    :param srgb: See detection.chroma_key
+    :param settings: DetectSettings
+    :return: One list of 2D Point locations per color
+    '''
+    return [blobs_to_points(b) for b in detect_frame_blobs(pixels, srgb, settings)]
+
+
+def detect_compact(pixels, srgb, settings):
+    '''
+    Like detect_frame, but only the centroids and areas of the clusters are kept, in small arrays that are cheap to send
+    between processes and to store (see detection_cache.py).
+
+    :param pixels: (height, width, 4) array, row 0 is the top of the image
+    :param srgb: See detection.chroma_key
+    :param settings: DetectSettings
+    :return: One (centroids (n, 2) float32, areas (n,) int32) tuple per color, see compact_to_points
+    '''
+    return [(b.centroid.astype(np.float32), b.area.astype(np.int32)) for b in detect_frame_blobs(pixels, srgb, settings)]
+
+
+def detect_file(path, settings):
+    #decodes and detects one frame on a worker thread or process, the pixels never leave it
+    return detect_compact(*decode_frame(path), settings=settings)
+
+
+def done_future(result):
+    #a Future that is already done, for results that don't need a worker
+    future = Future()
+    future.set_result(result)
+    return future
+
+
+def detect_raw_frame(path, frame, settings):
+    #detects a frame of a raw frame container on a worker process, each worker opens the container once
+    return detect_compact(*open_raw_frames(path).get(frame), settings=settings)
+
+
+def compact_to_points(compact):
+    #detect_file result to one list of 2D Point locations per color
+    return [[tuple(p) for p in centroids.tolist()] for centroids, areas in compact]
+
+
+class DetectionPipeline():
+    '''
+    Bounded queue of frames being detected on a thread pool. Frames are submitted in order, either as a file path that a
+    thread decodes, as pixels read on the main thread or as a result that is already known, and their results come out in
+    the same order, in the format of detect_compact.
+
+    At most `depth` frames are in the queue, so the threads never run too far ahead of the frames being applied and the
+    memory used stays bounded.
+
+    Usage:  pipe = DetectionPipeline(settings, threads, depth)
+            while not pipe.full(): pipe.submit_file(frame, path)   (or pipe.submit_pixels(frame, pixels.copy(), srgb))
+            while pipe.ready(): frame, compact = pipe.pop()
+            pipe.close()
+    '''
+    def __init__(self, settings, threads=1, depth=8):
+        self.settings = settings
+        self.depth = depth
+        self.pool = ThreadPoolExecutor(max_workers=threads)
+        self.queue = deque()
+
+    def __len__(self):
+        return len(self.queue)
+
+    def full(self):
+        return len(self.queue) >= self.depth
+
+    def submit_file(self, frame, path):
+        #the thread decodes the file itself
+        self.queue.append((frame, self.pool.submit(detect_file, path, self.settings)))
+
+    def submit_pixels(self, frame, pixels, srgb):
+        #pixels must not change until the frame is popped, pass a copy of a reused buffer
+        self.queue.append((frame, self.pool.submit(detect_compact, pixels, srgb, self.settings)))
+
+    def submit_result(self, frame, compact):
+        #a frame that doesn't need detecting, from the detection cache
+        self.queue.append((frame, done_future(compact)))
+
+    def ready(self):
+        #True if the oldest frame is done
+        return len(self.queue) > 0 and self.queue[0][1].done()
+
+    def oldest(self):
+        #frame that pop returns next
+        return self.queue[0][0]
+
+    def pop(self):
+        '''
+        Waits for the oldest frame if it isn't done.
+
+        :return: (frame, detect_compact result)
+        :raises: The error of the detection, if it failed
+        '''
+        frame, future = self.queue.popleft()
+        return frame, future.result()
+
+    def close(self):
+        #frames still queued are dropped, the ones being detected finish in the background
+        for frame, future in self.queue:
+            future.cancel()
+        self.queue.clear()
+        self.pool.shutdown(wait=False)
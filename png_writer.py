@@ -0,0 +1,53 @@
+#Minimal PNG encoder built on zlib, used by the sequence converter instead of the file output of a render. zlib releases
+#the GIL while it compresses, so several frames can be encoded at once on threads.
+
+import struct
+import zlib
+
+import numpy as np
+
+SIGNATURE = b"\x89PNG\r\n\x1a\n"
+#PNG row filters
+FILTER_NONE = 0
+FILTER_UP = 2
+
+
+def _chunk(kind, data):
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff)
+
+
+def encode_png(pixels, level=6):
+    '''
+
+    :param pixels: (height, width, 4) uint8 RGBA array, top row first
+    :param level: zlib compression level, 0 (stored uncompressed, fastest) to 9 (smallest)
+    :return: PNG file contents
+    '''
+    h, w, channels = pixels.shape
+    rows = np.empty((h, 1 + w * channels), dtype=np.uint8)
+    flat = pixels.reshape(h, w * channels)
+    if level > 0:
+        #every row stored as its difference to the row above, footage compresses a lot better that way
+        rows[:, 0] = FILTER_UP
+        rows[0, 1:] = flat[0]
+        np.subtract(flat[1:], flat[:-1], out=rows[1:, 1:])
+    else:
+        rows[:, 0] = FILTER_NONE
+        rows[:, 1:] = flat
+
+    color_type = {1: 0, 2: 4, 3: 2, 4: 6}[channels]
+    header = struct.pack(">IIBBBBB", w, h, 8, color_type, 0, 0, 0)
+    return b"".join((SIGNATURE, _chunk(b"IHDR", header), _chunk(b"IDAT", zlib.compress(rows.tobytes(), level)),
+                     _chunk(b"IEND", b"")))
+
+
+def write_png(path, pixels, level=6):
+    '''
+
+    :param path: File to write
+    :param pixels: See encode_png
+    :param level: See encode_png
+    '''
+    data = encode_png(pixels, level)
+    with open(path, "wb") as f:
+        f.write(data)
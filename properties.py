@@ -37,21 +37,148 @@ class TrackingProperties(bpy.types.PropertyGroup):
     #Measured in pixels
     max_dist = bpy.props.FloatProperty(
         name="max_dist",
-        description="Maximum distance between two frames that a marker can move(in pixels). If this is set too high, markers can override each other, set appropriately",
+        description="Maximum distance between two frames that a marker can move(in pixels). Markers are matched to the closest free cluster, but setting this too high slows the matching down",
         default=40
     )
+    #Predict where each marker will be from its velocity and search there, each marker within its own radius (at most max_dist).
+    use_prediction = bpy.props.BoolProperty(
+        name="Predict motion",
+        description="Search for markers where their velocity says they will be, allows a smaller search radius for steady markers",
+        default=False
+    )
     #Ignore a certain part of the image on the Y axis. Good for avoiding watermarks
     ignore_height = bpy.props.FloatProperty(
         name="ignore_height",
         description="Y axis height to ignore when choosing markers..good to use if you have a date watermark on the footage",
         default = 0
     )
+    #How the color matte is built. NUMPY works in memory, COMPOSITOR renders it through a node tree and a temporary png.
+    #COMPOSITOR stays the default, the NUMPY matte is close to the rendered one but not the same, see detection.MATTE_EPSILON
+    detection_backend = bpy.props.EnumProperty(
+        name="Detection",
+        description="How to filter the frame down to the chosen color",
+        items=[
+            ("NUMPY", "NumPy", "Build the color matte in memory with numpy"),
+            ("COMPOSITOR", "Compositor", "Render the color matte with a Chroma Key node tree")
+        ],
+        default="COMPOSITOR"
+    )
+    #How connected clusters are found in the matte. SPARSE only looks at the colored pixels and is faster when markers are small.
+    labeling = bpy.props.EnumProperty(
+        name="Labeling",
+        description="How clusters of the chosen color are found in the matte",
+        items=[
+            ("SPARSE", "Sparse", "Label run-length encoded rows, time depends on the amount of colored pixels"),
+            ("DENSE", "Dense", "Label the full frame")
+        ],
+        default="SPARSE"
+    )
+    #Threads used to detect markers on one frame. With more than 1, the frame is split in tiles that are processed in parallel.
+    detect_workers = bpy.props.IntProperty(
+        name="Threads",
+        description="Number of threads used to find the markers on a frame. Helps on high resolution footage",
+        default=1,
+        min=1,
+        max=64
+    )
+    #Find candidate markers on a smaller version of the frame first, then measure them at full resolution.
+    pyramid_factor = bpy.props.EnumProperty(
+        name="Coarse pass",
+        description="Look for markers on a downsampled frame first and only key the full frame around them",
+        items=[
+            ("1", "Off", "Key every pixel of the frame"),
+            ("2", "1/2", "Coarse pass at half resolution"),
+            ("4", "1/4", "Coarse pass at quarter resolution, markers must be at least 4 pixels wide")
+        ],
+        default="1"
+    )
+    #Only search for markers close to the existing tracks. The whole frame is still searched when a track is lost and every
+    #full_detect_every frames.
+    roi_detection = bpy.props.BoolProperty(
+        name="Search around tracks",
+        description="Only search for markers within max_dist of the tracks, unless a track is lost",
+        default=False
+    )
+    full_detect_every = bpy.props.IntProperty(
+        name="Full frame every",
+        description="Search the whole frame every this many frames when searching around tracks",
+        default=10,
+        min=1,
+        max=1000
+    )
     #This should pretty much never be changed. Slows down the process if increased.
     time_step = bpy.props.FloatProperty(
         name="time_step",
         description="How much time in between frames. The bigger, the more frames you see in between updates",
         default=0.1
     )
+    #Automated tracking keeps the new markers in memory and writes them to the clip every this many frames, 0 writes them at the end.
+    flush_every = bpy.props.IntProperty(
+        name="Update every",
+        description="Write tracked markers to the clip every this many frames, 0 to write them only when tracking ends",
+        default=25,
+        min=0,
+        max=10000
+    )
+    #Detect the next frames on background threads (detect_workers of them) while the tracker applies the finished ones, the
+    #UI stays responsive. NUMPY backend only. Frames are always searched whole, roi_detection needs the previous frame.
+    use_pipeline = bpy.props.BoolProperty(
+        name="Detect in background",
+        description="Find the markers of the next frames on background threads while tracking, keeps Blender responsive",
+        default=False
+    )
+    pipeline_depth = bpy.props.IntProperty(
+        name="Frames ahead",
+        description="How many frames can be detected ahead of the tracked frame",
+        default=8,
+        min=1,
+        max=64
+    )
+    #Batch tracking of image sequences can detect frames on a pool of processes, each reading its own frames from disk.
+    detect_processes = bpy.props.IntProperty(
+        name="Processes",
+        description="Number of processes detecting frames in parallel during batch tracking of image sequences, 1 to detect in Blender",
+        default=1,
+        min=1,
+        max=64
+    )
+    #Keep the markers found on every frame in a file next to the clip. Tracking the same frames again with the same color
+    #settings (to try another max_dist, for example) then doesn't read the frames at all.
+    use_detection_cache = bpy.props.BoolProperty(
+        name="Cache detections",
+        description="Save the markers found on every frame next to the clip and reuse them while the frames and color settings don't change",
+        default=False
+    )
+    #Image sequence frames are decoded ahead on background threads and kept in memory, see frames.FrameSource
+    prefetch_frames = bpy.props.IntProperty(
+        name="Read ahead",
+        description="Frames of an image sequence to decode ahead of the tracked frame, 0 to read every frame when it is needed",
+        default=4,
+        min=0,
+        max=64
+    )
+    frame_cache_size = bpy.props.IntProperty(
+        name="Frame cache (MB)",
+        description="Memory for decoded frames, tracking the same frames again doesn't decode them again while they fit",
+        default=1024,
+        min=0,
+        max=65536
+    )
+    #Converting a clip to an image sequence: png compression and threads encoding the frames.
+    png_compression = bpy.props.IntProperty(
+        name="Compression",
+        description="Compression level of the converted png frames, 0 writes them uncompressed (fastest, biggest files)",
+        default=1,
+        min=0,
+        max=9
+    )
+    encode_threads = bpy.props.IntProperty(
+        name="Threads",
+        description="Number of threads encoding frames while converting to a sequence",
+        default=4,
+        min=1,
+        max=64
+    )
     #On what layer to add empties.
     layer_empties = bpy.props.IntProperty(
         name="Layer",
@@ -98,6 +225,8 @@ def register():
     bpy.utils.register_class(TrackingProperties)
     bpy.utils.register_class(ColorProperty)
     bpy.types.MovieClip.track_color = bpy.props.PointerProperty(type=ColorProperty)
+    #More colors to track on the same clip. Every color gets its own markers, told apart by the track custom color.
+    bpy.types.MovieClip.extra_colors = bpy.props.CollectionProperty(type=ColorProperty)
     bpy.types.WindowManager.op_props = bpy.props.PointerProperty(type=TrackingProperties)
     #Path where the converted image sequence will be saved.
     bpy.types.MovieClip.convert_path = bpy.props.StringProperty(
@@ -107,6 +236,13 @@ def register():
         subtype="FILE_PATH"
     )
 
+    #Raw frame container the clip was converted to, tracking reads its frames from there. See raw_frames.py
+    bpy.types.MovieClip.raw_frames_path = bpy.props.StringProperty(
+        name="Raw frames",
+        description="Raw frame file converted from this clip, frames are read from it instead of being decoded",
+        default="",
+        subtype="FILE_PATH"
+    )
     bpy.types.MovieClip.current_path = bpy.props.StringProperty(
         default="",
         subtype="FILE_PATH"
@@ -114,8 +250,10 @@ def register():
 
 def unregister():
     del bpy.types.MovieClip.track_color
+    del bpy.types.MovieClip.extra_colors
     del bpy.types.WindowManager.op_props
     del bpy.types.MovieClip.convert_path
     del bpy.types.MovieClip.current_path
+    del bpy.types.MovieClip.raw_frames_path
     bpy.utils.unregister_class(ColorProperty)
     bpy.utils.unregister_class(TrackingProperties)
@@ -0,0 +1,156 @@
+#Raw frame container: all the frames of a clip, uncompressed, one after the other in a single file. Frames are read with
+#np.memmap, so getting a frame is a view on the file and nothing is decoded. Worker processes open the container
+#themselves, see pipeline.detect_raw_frame.
+#
+#Layout: a 64 byte header, then count frames of height x width x channels values of the header dtype, top row first.
+#Header (little endian): magic, version, width, height, channels, count, dtype (numpy dtype string), first frame, srgb.
+
+import struct
+
+import numpy as np
+
+if __package__:
+    from .detection import to_srgb_bytes
+else:
+    #imported on its own from the addon folder, by the tests
+    from detection import to_srgb_bytes
+
+MAGIC = b"MTFRAMES"
+VERSION = 1
+HEADER = struct.Struct("<8sIIIII8siB")
+HEADER_SIZE = 64
+RAW_SUFFIX = ".frames"
+
+
+def read_header(f):
+    '''
+
+    :param f: File opened in binary mode, at the start
+    :return: dict with width, height, channels, count, dtype, first_frame and srgb
+    :raises ValueError: if the file is not a raw frame container
+    '''
+    data = f.read(HEADER_SIZE)
+    if len(data) < HEADER_SIZE:
+        raise ValueError("File too short for a raw frame container")
+    magic, version, width, height, channels, count, dtype, first_frame, srgb = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("Not a raw frame container, or written by another version")
+    return dict(width=width, height=height, channels=channels, count=count, dtype=np.dtype(dtype.rstrip(b"\0").decode()),
+                first_frame=first_frame, srgb=bool(srgb))
+
+
+def write_header(f, width, height, channels, count, dtype, first_frame, srgb):
+    f.seek(0)
+    header = HEADER.pack(MAGIC, VERSION, width, height, channels, count, np.dtype(dtype).str.encode(), first_frame, srgb)
+    f.write(header.ljust(HEADER_SIZE, b"\0"))
+
+
+class RawFrameWriter():
+    '''
+    Writes frames to a raw frame container, in order. The file is created at full size and filled through a memmap;
+    close() cuts it down to the frames actually written, so a cancelled conversion still leaves a valid file.
+
+    Frames are stored as sRGB bytes (dtype uint8), like the png sequences the converter writes, or as float32 in the
+    encoding they come in.
+
+    Usage:  writer = RawFrameWriter(path, width, height, count, first_frame)
+            writer.write(pixels, srgb)    (once per frame, top row first)
+            writer.close()
+    '''
+    def __init__(self, path, width, height, count, first_frame=1, channels=4, dtype=np.uint8, srgb=True):
+        self.path = path
+        self.shape = (height, width, channels)
+        self.dtype = np.dtype(dtype)
+        self.first_frame = first_frame
+        self.srgb = srgb if self.dtype != np.uint8 else True
+        self.written = 0
+        with open(path, "wb") as f:
+            write_header(f, width, height, channels, count, self.dtype, first_frame, self.srgb)
+            f.truncate(HEADER_SIZE + count * self.frame_bytes)
+        self.frames = np.memmap(path, dtype=self.dtype, mode="r+", offset=HEADER_SIZE, shape=(count,) + self.shape)
+
+    @property
+    def frame_bytes(self):
+        return int(np.prod(self.shape)) * self.dtype.itemsize
+
+    def write(self, pixels, srgb):
+        '''
+
+        :param pixels: (height, width, channels) array with values in the 0..1 range, top row first
+        :param srgb: True if pixels are sRGB encoded, False if they are linear
+        '''
+        out = self.frames[self.written]
+        if self.dtype == np.uint8:
+            to_srgb_bytes(pixels, srgb, out)
+        elif srgb == self.srgb:
+            out[...] = pixels
+        else:
+            raise ValueError("Frames of a float container must all have the same encoding")
+        self.written += 1
+
+    def close(self):
+        self.frames.flush()
+        del self.frames
+        with open(self.path, "r+b") as f:
+            write_header(f, self.shape[1], self.shape[0], self.shape[2], self.written, self.dtype, self.first_frame,
+                         self.srgb)
+            f.truncate(HEADER_SIZE + self.written * self.frame_bytes)
+
+
+#Containers opened by this process, by path. See open_raw_frames
+_open_files = {}
+
+
+def open_raw_frames(path):
+    '''
+
+    :param path: Path of a raw frame container
+    :return: RawFrames of the file, opened once per process and reused after that
+    :raises OSError, ValueError: if the file can't be read or is not a raw frame container
+    '''
+    raw = _open_files.get(path)
+    if raw is None:
+        raw = _open_files[path] = RawFrames(path)
+    return raw
+
+
+def close_raw_frames(path):
+    #forget an open container, before it is written again
+    raw = _open_files.pop(path, None)
+    if raw is not None:
+        raw.frames = None
+
+
+class RawFrames():
+    '''
+    Read access to a raw frame container.
+
+    Usage:  raw = RawFrames(path)
+            if frame in raw:
+                pixels, srgb = raw.get(frame)
+
+    pixels is a read only view on the file, uint8 frames can be passed to detection as they are.
+    '''
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            header = read_header(f)
+        self.width, self.height = header["width"], header["height"]
+        self.count = header["count"]
+        self.first_frame = header["first_frame"]
+        self.srgb = header["srgb"]
+        self.frames = None
+        if self.count:
+            self.frames = np.memmap(path, dtype=header["dtype"], mode="r", offset=HEADER_SIZE,
+                                    shape=(self.count, self.height, self.width, header["channels"]))
+
+    def __contains__(self, frame):
+        return self.first_frame <= frame < self.first_frame + self.count
+
+    def get(self, frame):
+        '''
+
+        :param frame: Frame number
+        :return: ((height, width, channels) view of the frame, True if it is sRGB encoded)
+        '''
+        return self.frames[frame - self.first_frame], self.srgb
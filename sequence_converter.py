@@ -1,54 +1,42 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import os
+
 import bpy
 from .utils import (
-    get_vars_from_context,
     GlDrawOnScreen,
     draw_callback
 )
+from .detection import to_srgb_bytes
+from .frames import get_grabber
+from .png_writer import write_png
+from .raw_frames import RAW_SUFFIX, RawFrameWriter, close_raw_frames
 import time
 
-class CLIP_OT_ToSequence(bpy.types.Operator):
-    '''
-    This Operator simply renders the current scene and node_tree. Not meant to work by itself, it is
-    invoked by the ConverModalOperator on every step.
-    '''
-    bl_label = "Move Markers to Positions"
-    bl_idname = "clip.movtosequence"
-    clip = None
-    def execute(self, context):
-        scene, props, space, clip, tracks, current_frame, clip_end, clip_start = get_vars_from_context(context)
-        # Check if there is a clip to work on
-        context.area.type = "CLIP_EDITOR"
-        self.clip = context.edit_movieclip
-        context.area.type = "NODE_EDITOR"
-        if not self.clip:
-            print("No clip recorded")
-            return {'CANCELLED'}
-
+#Longest time a TIMER event of ConvertRawModalOperator spends converting frames, in seconds
+RAW_STEP_TIME = 0.1
+#Longest time a TIMER event of ConvertModalOperator spends reading frames, in seconds
+CONVERT_STEP_TIME = 0.05
 
-        #render the current node_tree with these settings.
-        #self.clip.current_path is the path where the current frame should be saved as an image.
-
-        bpy.data.scenes[scene.name].render.filepath = self.clip.current_path
-        bpy.data.scenes[scene.name].render.resolution_x = self.clip.size[0]
-        bpy.data.scenes[scene.name].render.resolution_y = self.clip.size[1]
-        bpy.data.scenes[scene.name].render.resolution_percentage = 100
-        bpy.ops.render.render(write_still=True)
-
-        return {'FINISHED'}
 
+def encode_frame(path, pixels, srgb, level):
+    #runs on the threads of ConvertModalOperator
+    write_png(path, to_srgb_bytes(pixels, srgb), level)
 
 class ConvertModalOperator(bpy.types.Operator):
     '''
     This operator converts current clip from movie to image sequence.
     You have to specify a directory where the image sequence will be saved.
-    The image sequence is saved as : capture0001 up to however many frames you are converting.
-    No matter what your frame_start is set inside Blender, the count always starts from capture0001
+    The image sequence is saved as : capture00001 up to however many frames you are converting.
+    No matter what your frame_start is set inside Blender, the count always starts from capture00001
 
     Best used to synchronize two different clips so that they have the same start frame and end frame.
     Other operators work better on image sequences than movies, so it's good to convert first.
 
-    WARNING: This operator will crash Blender, but the image sequence will be saved. Make sure you save
-             your work before executing this operator.
+    Frames are read through frames.FrameGrabber and encoded to png on a thread pool (see png_writer.py). Movie frames are
+    still decoded by rendering the small compositor scene of the grabber, one render per frame, but the render no longer
+    writes the file: only the encoding moved off the main thread. Each TIMER event only reads frames and hands them to
+    the threads, as long as there is room in the queue.
     '''
     bl_idname = "clip.convertit"
     bl_label = "Convert to Sequence"
@@ -67,91 +55,75 @@ class ConvertModalOperator(bpy.types.Operator):
     def modal(self, context, event):
         #Only respond to TIMER events.
         #If ESC is pressed, exit operator.
-        scene = context.scene
         if event.type in {'ESC'}:
             self.cancel(context)
             return {'FINISHED'}
         elif event.type not in {'TIMER'}:
             return {'PASS_THROUGH'}
 
-
-        #If work is done, set scene and area to the CLIP_EDITOR and finish operator
-        if scene.frame_current >= scene.frame_end:
-
-            context.space_data.node_tree = self.default_tree
-            context.area.type = "CLIP_EDITOR"
-            context.screen.scene = self.default_scene
-            bpy.data.node_groups.remove(self.node_tree, True)
-            bpy.data.scenes.remove(self.scene,True)
+        #any error stops the conversion, otherwise the timer and the draw handler would stay registered
+        try:
+            done = self.step()
+        except Exception as e:
+            self.report({'ERROR'}, "Couldn't convert frame: {}".format(e))
+            self.cancel(context)
+            return {'CANCELLED'}
+        if done:
             self.cancel(context)
             return {'FINISHED'}
-
-        #Stop the TIMER event and perform the work
-        self.stop_timer(context)
-
-
-        scene, props, space, clip, tracks, current_frame, clip_end, clip_start = get_vars_from_context(context)
-        #creating the path for the current frame
-        save_dir = self.clip.convert_path[:self.clip.convert_path.rfind("\\") + 1] + "capture" + str(self.count).zfill(
-            5) + ".png"
-        print("Working on {}".format(save_dir))
-        self.clip.current_path = save_dir
-        #invoke the operator from above
-        bpy.ops.clip.movtosequence('INVOKE_DEFAULT')
-        #increase frame and continue
-        scene.frame_current+=1
-        self.count+=1
-        self.progress = (self.current - self.start + 1) / self.total
-        self.current += 1
-
-        # Start the TIMER again. When the TIMER event is called, this function will execute again.
-        self.start_timer(context)
-
         return {'RUNNING_MODAL'}
 
+    def step(self):
+        #the work of one TIMER event, returns True once every frame is written
+        #frames that are written
+        while self.pending and self.pending[0].done():
+            self.pending.popleft().result()
+            self.written += 1
+        self.progress = self.written / self.total
+
+        #If work is done, finish operator
+        if self.written == self.total:
+            return True
+
+        #read the next frames while the threads have room for them
+        clip = bpy.data.movieclips[self.clip_name]
+        grabber = get_grabber(clip)
+        t = time.time()
+        while self.current <= self.end and len(self.pending) < self.queue_size and time.time() - t < CONVERT_STEP_TIME:
+            pixels, srgb = grabber.grab(self.current)
+            save_dir = os.path.join(self.folder, "capture" + str(self.count).zfill(5) + ".png")
+            #the grabber reuses its buffer, the threads get a copy
+            self.pending.append(self.pool.submit(encode_frame, save_dir, pixels.copy(), srgb, self.level))
+            self.current += 1
+            self.count += 1
+        return False
+
     def invoke(self, context, event):
-        #Creates a new scene with a new CompositorNodeTree that simply captures the current frame in an image.
         scene = context.scene
+        props = context.window_manager.op_props
+        clip = context.edit_movieclip
+        self.clip_name = clip.name
+        self.folder = os.path.dirname(bpy.path.abspath(clip.convert_path or "//"))
+        self.level = props.png_compression
         self.count = 1
-        self.context = context
-        self.clip = context.area.spaces.active.clip
-        context.scene.frame_current = context.scene.frame_start
-        self.default_scene = context.scene
-        self.scene =bpy.data.scenes.new("ConvertStuff")
-        self.scene.frame_start = self.default_scene.frame_start
-        self.scene.frame_end = self.default_scene.frame_end
-        self.scene.frame_current = self.default_scene.frame_start
-
-        context.screen.scene = self.scene
-        context.area.type = "NODE_EDITOR"
-        context.space_data.tree_type = "CompositorNodeTree"
-        context.scene.use_nodes = True
-
-        tree_name = str(time.time()).partition(".")[0]
-        self.node_tree =bpy.data.node_groups.new(tree_name,"CompositorNodeTree")
-        self.default_tree = context.space_data.node_tree
-        context.space_data.node_tree = self.node_tree
-        tree = context.space_data.node_tree
-
-        for node in tree.nodes:
-            tree.nodes.remove(node)
-        input_node = tree.nodes.new(type="CompositorNodeMovieClip")
-        input_node.clip = self.clip
-
-        output_node = tree.nodes.new(type="CompositorNodeComposite")
-        links = tree.links
-        links.new(input_node.outputs[0], output_node.inputs[0])
-
-        self.total = scene.frame_end - scene.frame_current + 1
-        self.progress = 0
-        self.start = scene.frame_current
+        self.start = scene.frame_start
+        self.end = scene.frame_end
         self.current = self.start
+        self.total = self.end - self.start + 1
+        self.written = 0
+        self.progress = 0
+
+        #frames waiting to be encoded are kept in memory, a couple per thread is enough to keep them busy
+        self.pool = ThreadPoolExecutor(max_workers=props.encode_threads)
+        self.queue_size = 2 * props.encode_threads
+        self.pending = deque()
+
         # draw progress
         args = (self, context)
 
         #add the draw handler to the Space. This lets us draw on the screen at the end of each step. The draw function called is imported from utils.py
         #under the name draw_callback
-        self._draw_handler = bpy.types.SpaceNodeEditor.draw_handler_add(
+        self._draw_handler = bpy.types.SpaceClipEditor.draw_handler_add(
             draw_callback, args,
             'WINDOW', 'POST_PIXEL'
         )
@@ -176,16 +148,100 @@ class ConvertModalOperator(bpy.types.Operator):
 
         self.stop_timer(context)
         bpy.types.SpaceClipEditor.draw_handler_remove(self._draw_handler, 'WINDOW')
+        #frames the threads haven't started are dropped, the ones being encoded finish in the background so the UI
+        #doesn't wait for them
+        for future in self.pending:
+            future.cancel()
+        self.pool.shutdown(wait=False)
+        print("Converted {} frames to {}".format(self.written, self.folder))
 
-    def __init__(self):
-        pass
+    @classmethod
+    def poll(cls, context):
+        return (context.area.spaces.active.clip is not None)
 
-    def __del__(self):
-        pass
+class ConvertRawModalOperator(bpy.types.Operator):
+    '''
+    Converts the current clip to a raw frame container (see raw_frames.py) next to convert_path, from the scene start
+    frame to the end frame. Frames are stored uncompressed as sRGB bytes, so tracking can read them with np.memmap
+    without decoding anything. The clip keeps its footage, its raw_frames_path is set to the new file and tracking
+    reads the frames from there.
+
+    Frames are copied straight from Blender (see frames.FrameGrabber), there is no scene or editor switching.
+    '''
+    bl_idname = "clip.convert_raw"
+    bl_label = "Convert to Raw Frames"
+    bl_description = "Store the frames of the clip uncompressed in one file, tracking then reads them without decoding"
+
+    _timer = None
+
+    _draw_handler = None
+
+    gl = GlDrawOnScreen()
+
+    progress = 0
+
+    def modal(self, context, event):
+        if event.type in {'ESC'}:
+            self.cancel(context)
+            return {'FINISHED'}
+        elif event.type not in {'TIMER'}:
+            return {'PASS_THROUGH'}
+
+        clip = bpy.data.movieclips[self.clip_name]
+        grabber = get_grabber(clip)
+        t = time.time()
+        while self.current <= self.end and time.time() - t < RAW_STEP_TIME:
+            pixels, srgb = grabber.grab(self.current)
+            self.writer.write(pixels, srgb)
+            self.current += 1
+        self.progress = (self.current - self.start) / self.total
+
+        if self.current > self.end:
+            self.cancel(context)
+            return {'FINISHED'}
+        return {'RUNNING_MODAL'}
+
+    def invoke(self, context, event):
+        scene = context.scene
+        clip = context.edit_movieclip
+        self.clip_name = clip.name
+        self.start = scene.frame_start
+        self.end = scene.frame_end
+        self.current = self.start
+        self.total = self.end - self.start + 1
+        self.progress = 0
+
+        folder = os.path.dirname(bpy.path.abspath(clip.convert_path or "//"))
+        self.path = os.path.join(folder, bpy.path.clean_name(clip.name) + RAW_SUFFIX)
+        #the file may be open from an earlier conversion
+        close_raw_frames(self.path)
+        if clip.raw_frames_path and bpy.path.abspath(clip.raw_frames_path) == self.path:
+            clip.raw_frames_path = ""
+        self.writer = RawFrameWriter(self.path, clip.size[0], clip.size[1], self.total, first_frame=self.start)
+        print("Converting {} to {}".format(clip.name, self.path))
+
+        args = (self, context)
+        self._draw_handler = bpy.types.SpaceClipEditor.draw_handler_add(
+            draw_callback, args,
+            'WINDOW', 'POST_PIXEL'
+        )
+        context.window_manager.modal_handler_add(self)
+        self._timer = context.window_manager.event_timer_add(time_step=0.01, window=context.window)
+        return {'RUNNING_MODAL'}
+
+    def cancel(self, context):
+        context.window_manager.event_timer_remove(self._timer)
+        bpy.types.SpaceClipEditor.draw_handler_remove(self._draw_handler, 'WINDOW')
+        #a cancelled conversion keeps the frames written so far
+        self.writer.close()
+        clip = bpy.data.movieclips[self.clip_name]
+        if self.writer.written:
+            clip.raw_frames_path = self.path
+        print("Converted {} frames to {}".format(self.writer.written, self.path))
 
     @classmethod
     def poll(cls, context):
-        return (context.area.spaces.active.clip is not None)
+        return context.edit_movieclip is not None
 
 class ConvertPanel(bpy.types.Panel):
     bl_label = "Converter"
@@ -201,4 +257,11 @@ class ConvertPanel(bpy.types.Panel):
         row.operator("clip.convertit", text="Convert to Sequence", icon="PLAY")
         row = layout.row()
         row.prop(mv,"convert_path")
+        row = layout.row(align=True)
+        row.prop(context.window_manager.op_props, "png_compression")
+        row.prop(context.window_manager.op_props, "encode_threads")
+        row = layout.row()
+        row.operator("clip.convert_raw", icon="FILE_IMAGE")
+        row = layout.row()
+        row.prop(mv, "raw_frames_path")
 
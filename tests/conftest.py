@@ -0,0 +1,9 @@
+#The tests cover the modules that don't use bpy. They are imported on their own from the addon folder, or through the
+#marker_tracker_workers package like the worker processes do (see utils.worker_module), because the addon package itself
+#needs Blender.
+#pytest.ini stops collection at this folder, above it pytest would import the addon's __init__.py.
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
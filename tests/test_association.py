@@ -0,0 +1,50 @@
+import itertools
+
+import numpy as np
+import pytest
+
+from association import associate, candidate_pairs
+
+
+def best_assignment(positions, points, gate):
+    #brute force: most matched tracks, then the smallest total distance
+    d = np.hypot(*(positions[:, None] - points[None]).T).T
+    best = (0, 0.0)
+    for perm in itertools.permutations(range(len(points) + len(positions)), len(positions)):
+        pairs = [(t, p) for t, p in enumerate(perm) if p < len(points) and d[t, p] < gate]
+        score = (len(pairs), -sum(d[t, p] for t, p in pairs))
+        best = max(best, score)
+    return best[0], -best[1]
+
+
+def test_candidate_pairs_gate_per_track():
+    positions = np.array([[0, 0], [10, 0]])
+    points = np.array([[1, 0], [10, 3]])
+    ti, pi, d = candidate_pairs(positions, points, [2, 2])
+    assert list(zip(ti, pi)) == [(0, 0)]
+    ti, pi, d = candidate_pairs(positions, points, [2, 4])
+    assert sorted(zip(ti, pi)) == [(0, 0), (1, 1)]
+
+
+def test_not_greedy():
+    #greedy would give track 0 the point at 1 and leave track 1 without a point
+    positions = np.array([[0.0, 0], [2.0, 0]])
+    points = np.array([[1.0, 0], [-1.5, 0]])
+    tracks, matched = associate(positions, points, 2.5)
+    assert dict(zip(tracks, matched)) == {0: 1, 1: 0}
+
+
+@pytest.mark.parametrize("seed", range(40))
+def test_assignment_is_optimal(seed):
+    rng = np.random.RandomState(seed)
+    positions = rng.uniform(0, 10, (rng.randint(1, 6), 2))
+    points = rng.uniform(0, 10, (rng.randint(0, 6), 2))
+    gate = rng.uniform(1, 5)
+    tracks, matched = associate(positions, points, gate)
+
+    assert len(set(tracks)) == len(tracks) and len(set(matched)) == len(matched)
+    distance = np.hypot(*(positions[tracks] - points[matched]).T)
+    assert (distance < gate).all()
+    count, total = best_assignment(positions, points, gate)
+    assert len(tracks) == count
+    assert distance.sum() == pytest.approx(total)
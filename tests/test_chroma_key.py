@@ -0,0 +1,81 @@
+import math
+
+import numpy as np
+import pytest
+from numpy.testing import assert_allclose
+
+from detection import (
+    CHROMA_GAIN,
+    CHROMA_THRESHOLD,
+    CHROMA_TOLERANCE,
+    MATTE_EPSILON,
+    chroma_key,
+    chroma_matte,
+    srgb_to_linear
+)
+
+
+def compositor_key(rgba, key):
+    '''
+    One pixel through the nodes getPoints renders, written after Blender's compositor: ConvertRGBToYCCOperation
+    (ITU BT.709), ChromaMatteOperation and the Invert node.
+    '''
+    def ycc(r, g, b):
+        #rgb_to_ycc with BLI_YCC_ITU_BT709 works on 0..255 values, the operation divides the result by 255
+        r, g, b = r * 255, g * 255, b * 255
+        cb = -0.101 * r - 0.338 * g + 0.439 * b + 128
+        cr = 0.439 * r - 0.399 * g - 0.040 * b + 128
+        return cb / 255, cr / 255
+
+    image_cb, image_cr = (v * 2 - 1 for v in ycc(*rgba[:3]))
+    key_cb, key_cr = (v * 2 - 1 for v in ycc(*key[:3]))
+    theta = math.atan2(key_cr, key_cb)
+    x_angle = image_cb * math.cos(theta) + image_cr * math.sin(theta)
+    z_angle = image_cr * math.cos(theta) - image_cb * math.sin(theta)
+    kfg = x_angle - abs(z_angle) / math.tan(CHROMA_TOLERANCE / 2)
+    if kfg > 0:
+        alpha = 1 - kfg / CHROMA_GAIN
+        if abs(math.atan2(z_angle, x_angle)) < CHROMA_THRESHOLD / 2:
+            alpha = 0
+        alpha = min(alpha, rgba[3])
+    else:
+        alpha = rgba[3]
+    return min(max(1 - alpha, 0), 1)
+
+
+KEYS = [(0.0, 1.0, 0.0), (1.0, 0.0, 0.0), (0.1, 0.2, 0.9), (0.8, 0.2, 0.6)]
+
+
+@pytest.mark.parametrize("key", KEYS)
+def test_matches_the_compositor_on_linear_pixels(key):
+    rng = np.random.RandomState(0)
+    rgba = rng.random_sample((40, 50, 4)).astype(np.float32)
+    rgba[::3, :, 3] = 1
+    #pixels close to the key, so every branch is taken
+    rgba[::2, ::2, :3] = np.clip(np.asarray(key) + rng.normal(0, 0.15, (20, 25, 3)), 0, 1)
+    expected = np.array([[compositor_key(p, key) for p in row] for row in rgba.astype(np.float64)])
+    assert_allclose(chroma_key(rgba, key, srgb=False), expected, rtol=0, atol=1e-4)
+
+
+@pytest.mark.parametrize("key", KEYS)
+def test_byte_pixels_are_keyed_as_linear(key):
+    rgba = np.random.RandomState(1).randint(0, 256, (30, 30, 4)).astype(np.uint8)
+    rgba[..., 3] = 255
+    linear = np.concatenate((srgb_to_linear(rgba[..., :3]), np.ones((30, 30, 1), dtype=np.float32)), axis=2)
+    expected = np.array([[compositor_key(p, key) for p in row] for row in linear.astype(np.float64)])
+    assert_allclose(chroma_key(rgba, key, srgb=True), expected, rtol=0, atol=1e-4)
+
+
+def test_known_values():
+    green = (0.0, 1.0, 0.0)
+    #the key color, gray, the opposite color, and a transparent gray pixel: the node never makes a pixel more opaque
+    pixels = np.array([[[0, 1, 0, 1], [0.5, 0.5, 0.5, 1], [1, 0, 1, 1], [0.5, 0.5, 0.5, 0]]], dtype=np.float32)
+    assert_allclose(chroma_key(pixels, green, srgb=False), [[1, 0, 0, 1]])
+
+
+def test_matte_cut_is_half_a_display_byte():
+    #a linear matte value is kept once 12.92 times it rounds to a byte of at least 1
+    assert 12.92 * MATTE_EPSILON * 255 == pytest.approx(0.5)
+    green = np.zeros((1, 1, 4), dtype=np.float32)
+    green[..., 1] = green[..., 3] = 1
+    assert chroma_matte(green, (0.0, 1.0, 0.0), srgb=False).all()
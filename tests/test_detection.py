@@ -0,0 +1,114 @@
+import numpy as np
+import pytest
+from numpy.testing import assert_allclose, assert_array_equal
+from scipy.ndimage import label
+
+import detection
+
+GREEN = (0.0, 1.0, 0.0)
+BACKGROUND = (128, 128, 128, 255)
+
+
+def make_frame(h=240, w=320, markers=30, noise=0, seed=0):
+    #gray sRGB byte frame with green discs of a few sizes, some cut by the border, and a U shape whose arms only meet
+    #at the bottom, so it is split in two clusters by most tiles
+    rng = np.random.RandomState(seed)
+    frame = np.empty((h, w, 4), dtype=np.uint8)
+    frame[...] = BACKGROUND
+    ys, xs = np.mgrid[:h, :w]
+    for _ in range(markers):
+        cx, cy, r = rng.uniform(-5, w + 5), rng.uniform(-5, h + 5), rng.uniform(3, 9)
+        #soft edge, partly keyed pixels weight the centroid
+        a = np.clip(r + 0.5 - np.hypot(xs + 0.5 - cx, ys + 0.5 - cy), 0, 1)[..., None]
+        frame[..., :3] = (frame[..., :3] * (1 - a) + np.array([0, 255, 0]) * a).astype(np.uint8)
+    frame[h // 4:h // 2, 20:24, :3] = (0, 255, 0)
+    frame[h // 4:h // 2, 40:44, :3] = (0, 255, 0)
+    frame[h // 2 - 4:h // 2, 20:44, :3] = (0, 255, 0)
+    if noise:
+        frame[..., :3] = np.clip(frame[..., :3] + rng.normal(0, noise, (h, w, 3)), 0, 255).astype(np.uint8)
+    return frame
+
+
+def assert_same_blobs(a, b):
+    assert_array_equal(a.area, b.area)
+    assert_array_equal(a.bbox, b.bbox)
+    assert_allclose(a.centroid, b.centroid, rtol=0, atol=1e-9)
+
+
+def random_matte(h, w, density, seed):
+    return np.random.RandomState(seed).random_sample((h, w)) < density
+
+
+@pytest.mark.parametrize("density", [0.05, 0.3, 0.6])
+def test_label_runs_matches_ndimage_label(density):
+    matte = random_matte(60, 70, density, seed=1)
+    row, start, end = detection.find_runs(matte)
+    labels, n = detection.label_runs(row, start, end, matte.shape[1])
+    expected, expected_n = label(matte, np.ones((3, 3), dtype=np.uint8))
+    assert n == expected_n
+    for r, s, e, l in zip(row, start, end, labels):
+        assert (expected[r, s:e] == l + 1).all()
+
+
+@pytest.mark.parametrize("density", [0.0, 0.05, 0.3, 0.6])
+def test_sparse_matches_dense(density):
+    matte = random_matte(80, 90, density, seed=2)
+    weights = np.random.RandomState(3).random_sample(matte.shape)
+    assert_same_blobs(detection.find_blobs(matte, 0, -1, weights, sparse=True),
+                      detection.find_blobs(matte, 0, -1, weights, sparse=False))
+
+
+@pytest.mark.parametrize("sparse", [False, True])
+def test_sparse_matches_dense_on_frame(sparse):
+    frame = make_frame()
+    assert_same_blobs(detection.detect_blobs(frame, GREEN, 0, -1, sparse=sparse),
+                      detection.detect_blobs(frame, GREEN, 0, -1))
+
+
+@pytest.mark.parametrize("workers", [2, 3, 7, 16])
+@pytest.mark.parametrize("sparse", [False, True])
+def test_tiles_match_single_worker(workers, sparse):
+    frame = make_frame()
+    expected = detection.detect_blobs(frame, GREEN, 0, -1)
+    assert len(expected.area) > 10
+    assert_same_blobs(detection.detect_blobs(frame, GREEN, 0, -1, sparse=sparse, workers=workers), expected)
+
+
+def test_tiles_match_single_worker_on_random_matte():
+    #a random color frame has clusters of every shape crossing the seams
+    rng = np.random.RandomState(4)
+    frame = np.where(rng.random_sample((97, 50, 1)) < 0.45, [0, 255, 0, 255], [128, 128, 128, 255]).astype(np.uint8)
+    expected = detection.detect_blobs(frame, GREEN, 0, -1)
+    for workers in (2, 5, 48):
+        assert_same_blobs(detection.detect_blobs(frame, GREEN, 0, -1, workers=workers), expected)
+
+
+def test_windows_around_markers_match_full_frame():
+    frame = make_frame()
+    expected = detection.detect_blobs(frame, GREEN, 25, -1)
+    windows = detection.window_around(expected.centroid, 30)
+    found = detection.detect_blobs_in_windows(frame, GREEN, 25, -1, windows)
+    order = np.lexsort(found.centroid.T)
+    expected_order = np.lexsort(expected.centroid.T)
+    assert_array_equal(found.area[order], expected.area[expected_order])
+    assert_allclose(found.centroid[order], expected.centroid[expected_order], rtol=0, atol=1e-9)
+
+
+@pytest.mark.parametrize("factor", [2, 4])
+def test_pyramid_matches_full_resolution(factor):
+    frame = make_frame()
+    expected = detection.detect_blobs(frame, GREEN, 25, -1)
+    assert_same_blobs(detection.detect_blobs_pyramid(frame, GREEN, 25, -1, factor), expected)
+
+
+@pytest.mark.parametrize("factor", [2, 4])
+def test_pyramid_within_tolerance_on_noise(factor):
+    #noise pixels next to a marker but outside the searched blocks can be missed, and small noise clusters with them,
+    #the markers must still be found and stay sub-pixel
+    frame = make_frame(noise=40, seed=5)
+    expected = detection.detect_blobs(frame, GREEN, 25, -1)
+    markers = expected.centroid[expected.area > 40]
+    found = detection.detect_blobs_pyramid(frame, GREEN, 25, -1, factor)
+    distance = np.hypot(*(markers[:, None] - found.centroid[None]).T)
+    assert len(markers) > 10
+    assert distance.min(axis=0).max() < 0.5
@@ -0,0 +1,68 @@
+import numpy as np
+from numpy.testing import assert_allclose
+
+from motion import MIN_GATE, MotionModel
+
+
+def track(model, names, start, velocity, frames):
+    #tracks moving at a constant velocity, every predicted position is matched to the true one
+    start = np.asarray(start, dtype=np.float64)
+    velocity = np.asarray(velocity, dtype=np.float64)
+    idx = model.sync(names, start, [0] * len(names))
+    for frame in range(1, frames + 1):
+        model.predict(idx, frame)
+        model.update(idx, start + velocity * frame)
+    return idx
+
+
+def test_constant_velocity_is_learned():
+    model = MotionModel(50)
+    idx = track(model, ["a", "b"], [[100, 100], [300, 200]], [[5, 0], [-2, 3]], 10)
+    predicted, gates = model.predict(idx, 11)
+    assert_allclose(predicted, [[155, 100], [278, 233]], atol=0.5)
+    assert (gates < 15).all() and (gates >= MIN_GATE).all()
+
+
+def test_new_tracks_get_a_wide_gate():
+    model = MotionModel(50)
+    idx = model.sync(["a"], [[10, 10]], [0])
+    predicted, gates = model.predict(idx, 1)
+    assert_allclose(predicted, [[10, 10]])
+    assert gates[0] == 50
+
+
+def test_tracks_are_independent():
+    together = MotionModel(50)
+    track(together, ["a", "b"], [[0, 0], [50, 50]], [[1, 2], [-3, 0]], 6)
+    alone = MotionModel(50)
+    track(alone, ["b"], [[50, 50]], [[-3, 0]], 6)
+    for a, b in zip(together.predict(together.sync(["b"], [[32, 50]], [6]), 7),
+                    alone.predict(alone.sync(["b"], [[32, 50]], [6]), 7)):
+        assert_allclose(a, b)
+
+
+def test_peek_leaves_the_state_alone():
+    model = MotionModel(50)
+    idx = track(model, ["a"], [[0, 0]], [[4, 4]], 5)
+    position, gate = model.peek(idx, 6)
+    for again in (model.peek(idx, 6), model.predict(idx, 6)):
+        assert_allclose(again[0], position)
+        assert_allclose(again[1], gate)
+
+
+def test_edited_markers_restart_the_track():
+    model = MotionModel(50)
+    idx = track(model, ["a"], [[0, 0]], [[4, 0]], 5)
+    #the last marker was moved by hand, away from where the model saw it
+    idx = model.sync(["a"], [[100, 100]], [5])
+    predicted, gates = model.predict(idx, 6)
+    assert_allclose(predicted, [[100, 100]])
+    assert gates[0] == 50
+
+
+def test_restart_drops_the_velocity():
+    model = MotionModel(50)
+    idx = track(model, ["a"], [[0, 0]], [[4, 0]], 5)
+    model.restart(idx, [[60, 60]], 9)
+    predicted, gates = model.predict(idx, 10)
+    assert_allclose(predicted, [[60, 60]])
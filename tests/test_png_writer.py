@@ -0,0 +1,64 @@
+import io
+import struct
+import zlib
+
+import numpy as np
+import pytest
+from numpy.testing import assert_array_equal
+
+from png_writer import SIGNATURE, encode_png, write_png
+
+
+def read_chunks(data):
+    assert data[:8] == SIGNATURE
+    pos, chunks = 8, []
+    while pos < len(data):
+        length, kind = struct.unpack(">I4s", data[pos:pos + 8])
+        body = data[pos + 8:pos + 8 + length]
+        crc, = struct.unpack(">I", data[pos + 8 + length:pos + 12 + length])
+        assert crc == zlib.crc32(kind + body) & 0xffffffff
+        chunks.append((kind, body))
+        pos += 12 + length
+    return chunks
+
+
+def decode_png(data):
+    #decoder for what encode_png writes: 8 bit, no interlacing, rows filtered with None or Up
+    chunks = read_chunks(data)
+    assert [kind for kind, body in chunks] == [b"IHDR", b"IDAT", b"IEND"]
+    w, h, depth, color_type, compression, filtering, interlace = struct.unpack(">IIBBBBB", chunks[0][1])
+    assert (depth, compression, filtering, interlace) == (8, 0, 0, 0)
+    channels = {0: 1, 4: 2, 2: 3, 6: 4}[color_type]
+    rows = np.frombuffer(zlib.decompress(chunks[1][1]), dtype=np.uint8).reshape(h, 1 + w * channels)
+    pixels = rows[:, 1:].copy()
+    for y in range(h):
+        assert rows[y, 0] in (0, 2)
+        if rows[y, 0] == 2 and y > 0:
+            pixels[y] += pixels[y - 1]
+    return pixels.reshape(h, w, channels)
+
+
+@pytest.mark.parametrize("level", [0, 1, 6, 9])
+@pytest.mark.parametrize("channels", [1, 2, 3, 4])
+def test_round_trip(level, channels):
+    pixels = np.random.RandomState(channels).randint(0, 256, (7, 9, channels)).astype(np.uint8)
+    assert_array_equal(decode_png(encode_png(pixels, level)), pixels)
+
+
+def test_single_row():
+    pixels = np.arange(12, dtype=np.uint8).reshape(1, 3, 4)
+    assert_array_equal(decode_png(encode_png(pixels)), pixels)
+
+
+def test_write_png(tmp_path):
+    pixels = np.random.RandomState(0).randint(0, 256, (4, 5, 4)).astype(np.uint8)
+    path = str(tmp_path / "frame.png")
+    write_png(path, pixels)
+    with open(path, "rb") as f:
+        assert_array_equal(decode_png(f.read()), pixels)
+
+
+def test_pillow_reads_it():
+    Image = pytest.importorskip("PIL.Image")
+    pixels = np.random.RandomState(0).randint(0, 256, (16, 20, 4)).astype(np.uint8)
+    assert_array_equal(np.asarray(Image.open(io.BytesIO(encode_png(pixels)))), pixels)
@@ -0,0 +1,87 @@
+import os
+
+import numpy as np
+import pytest
+from numpy.testing import assert_array_equal
+
+from detection import to_srgb_bytes
+from raw_frames import HEADER_SIZE, RawFrames, RawFrameWriter, close_raw_frames, open_raw_frames
+
+
+def random_frames(count, h=6, w=5, seed=0):
+    return np.random.RandomState(seed).randint(0, 256, (count, h, w, 4)).astype(np.uint8)
+
+
+def test_byte_frames_round_trip(tmp_path):
+    path = str(tmp_path / "clip.frames")
+    frames = random_frames(3)
+    writer = RawFrameWriter(path, 5, 6, 3, first_frame=10)
+    for pixels in frames:
+        writer.write(pixels / np.float32(255), True)
+    writer.close()
+
+    raw = RawFrames(path)
+    assert (raw.width, raw.height, raw.count, raw.first_frame) == (5, 6, 3, 10)
+    assert 9 not in raw and 10 in raw and 12 in raw and 13 not in raw
+    for i, pixels in enumerate(frames):
+        stored, srgb = raw.get(10 + i)
+        assert srgb
+        assert_array_equal(stored, pixels)
+
+
+def test_linear_frames_are_stored_as_srgb_bytes(tmp_path):
+    path = str(tmp_path / "clip.frames")
+    linear = np.random.RandomState(1).random_sample((6, 5, 4)).astype(np.float32)
+    writer = RawFrameWriter(path, 5, 6, 1)
+    writer.write(linear, False)
+    writer.close()
+    stored, srgb = RawFrames(path).get(1)
+    assert srgb
+    assert_array_equal(stored, to_srgb_bytes(linear, False))
+
+
+def test_float_frames_keep_their_encoding(tmp_path):
+    path = str(tmp_path / "clip.frames")
+    linear = np.random.RandomState(2).random_sample((2, 6, 5, 4)).astype(np.float32)
+    writer = RawFrameWriter(path, 5, 6, 2, dtype=np.float32, srgb=False)
+    writer.write(linear[0], False)
+    with pytest.raises(ValueError):
+        writer.write(linear[1], True)
+    writer.close()
+    stored, srgb = RawFrames(path).get(1)
+    assert not srgb
+    assert_array_equal(stored, linear[0])
+
+
+def test_close_keeps_only_the_written_frames(tmp_path):
+    path = str(tmp_path / "clip.frames")
+    writer = RawFrameWriter(path, 5, 6, 5)
+    for pixels in random_frames(2):
+        writer.write(pixels / np.float32(255), True)
+    writer.close()
+    assert os.path.getsize(path) == HEADER_SIZE + 2 * 6 * 5 * 4
+    raw = RawFrames(path)
+    assert raw.count == 2 and 2 in raw and 3 not in raw
+
+
+def test_other_files_are_refused(tmp_path):
+    path = tmp_path / "clip.png"
+    path.write_bytes(b"\x89PNG" + b"\0" * 100)
+    with pytest.raises(ValueError):
+        RawFrames(str(path))
+    path.write_bytes(b"short")
+    with pytest.raises(ValueError):
+        RawFrames(str(path))
+
+
+def test_open_raw_frames_reuses_the_container(tmp_path):
+    path = str(tmp_path / "clip.frames")
+    writer = RawFrameWriter(path, 5, 6, 1)
+    writer.write(random_frames(1)[0] / np.float32(255), True)
+    writer.close()
+    raw = open_raw_frames(path)
+    assert open_raw_frames(path) is raw
+    close_raw_frames(path)
+    assert raw.frames is None
+    assert open_raw_frames(path) is not raw
+    close_raw_frames(path)
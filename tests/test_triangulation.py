@@ -0,0 +1,126 @@
+import numpy as np
+from numpy.testing import assert_allclose, assert_array_equal
+
+from triangulation import (
+    key_changes,
+    observation_rays,
+    reprojection_errors,
+    triangulate_in_processes,
+    triangulate_rays
+)
+
+
+def apply_key_changes(existing, frames, remove):
+    #keys left after WriteKeys, as {frame: index of the key it was in existing, or None for a new key}
+    at, found, deleted = key_changes(existing, frames, remove)
+    keys = dict((f, i) for i, f in enumerate(existing))
+    for i in deleted:
+        del keys[existing[i]]
+    for f, i, hit in zip(frames, at, found):
+        assert keys.get(f) == (i if hit else None)
+        keys[f] = i if hit else None
+    return keys
+
+
+def test_key_changes_keeps_the_other_keys():
+    existing = [1.0, 2.0, 5.0, 7.0, 9.0]
+    keys = apply_key_changes(existing, [2.0, 3.0, 8.0, 9.0], [5.0, 6.0])
+    assert keys == {1.0: 0, 2.0: 1, 3.0: None, 7.0: 3, 8.0: None, 9.0: 4}
+
+
+def test_key_changes_deletes_highest_first():
+    at, found, deleted = key_changes([4.0, 1.0, 3.0, 2.0], [], [1.0, 2.0, 4.0])
+    assert_array_equal(deleted, [3, 1, 0])
+
+
+def test_key_changes_written_frames_are_not_deleted():
+    at, found, deleted = key_changes([1.0, 2.0], [2.0], [2.0, 1.0])
+    assert_array_equal(found, [True])
+    assert_array_equal(at, [1])
+    assert_array_equal(deleted, [0])
+
+
+def test_key_changes_without_keys():
+    at, found, deleted = key_changes([], [1.0, 2.0], [3.0])
+    assert not found.any()
+    assert len(deleted) == 0
+
+
+def look_at(position, target):
+    #camera world matrix with normalized rotation, the camera looks down its -Z axis like in Blender
+    back = np.asarray(position, dtype=np.float64) - target
+    back /= np.linalg.norm(back)
+    right = np.cross([0.0, 0.0, 1.0], back)
+    right /= np.linalg.norm(right)
+    m = np.eye(4)
+    m[:3, 0], m[:3, 1], m[:3, 2], m[:3, 3] = right, np.cross(back, right), back, position
+    return m
+
+
+def make_scene(points=50, frames=4, seed=0):
+    #three cameras looking at random points around the origin, the markers are where the cameras see the points
+    rng = np.random.RandomState(seed)
+    cameras = np.array([look_at(p, [0, 0, 0]) for p in ([10, 0, 2], [0, 12, 1], [-8, -8, 3])])
+    corners = np.array([[-0.5, -0.28125, -1.5], [0.5, 0.28125, -1.5]])
+    matrices = np.repeat(cameras[:, None], frames, axis=1)
+    corners = np.broadcast_to(corners, (3, frames, 2, 3)).copy()
+    truth = rng.uniform(-2, 2, (points, frames, 3))
+    local = np.einsum('cji,tfcj->tfci', cameras[:, :3, :3], truth[:, :, None] - cameras[:, :3, 3])
+    on_frame = local[..., :2] * (-1.5 / local[..., 2:])
+    coords = (on_frame - corners[0, 0, 0, :2]) / (corners[0, 0, 1, :2] - corners[0, 0, 0, :2])
+    views = np.tile(np.arange(3), (points, 1))
+    sizes = np.array([[1920, 1080]] * 3, dtype=np.float64)
+    t, f = [a.ravel() for a in np.meshgrid(np.arange(points), np.arange(frames), indexing='ij')]
+    return truth, coords, views, matrices, corners, sizes, t, f
+
+
+def test_two_rays_meet_halfway():
+    origins = np.array([[[0, 0, 0], [0, 0, 2]]], dtype=np.float64)
+    directions = np.array([[[1, 0, 0], [0, 1, 0]]], dtype=np.float64)
+    positions, errors, residuals = triangulate_rays(origins, directions)
+    assert_allclose(positions, [[0, 0, 1]], atol=1e-12)
+    assert_allclose(errors, [2.0])
+    assert_allclose(residuals, [[1.0, 1.0]])
+
+
+def test_parallel_and_single_rays_are_not_solved():
+    origins = np.array([[[0, 0, 0], [0, 1, 0]], [[0, 0, 0], [0, 1, 0]]], dtype=np.float64)
+    directions = np.array([[[1, 0, 0], [1, 0, 0]], [[1, 0, 0], [0, 0, 1]]], dtype=np.float64)
+    mask = np.array([[True, True], [True, False]])
+    positions, errors, residuals = triangulate_rays(origins, directions, mask)
+    assert np.isnan(positions).all() and np.isnan(errors).all()
+    assert np.isnan(residuals[1, 1])
+
+
+def test_markers_triangulate_back_to_their_points():
+    truth, coords, views, matrices, corners, sizes, t, f = make_scene()
+    positions, errors, residuals = triangulate_rays(*observation_rays(coords, views, matrices, corners, t, f))
+    assert_allclose(positions, truth[t, f], atol=1e-9)
+    assert (errors < 1e-9).all()
+    assert_allclose(reprojection_errors(positions, coords, views, matrices, corners, sizes, t, f), 0, atol=1e-6)
+
+
+def test_reprojection_error_is_in_pixels():
+    truth, coords, views, matrices, corners, sizes, t, f = make_scene()
+    coords[:, :, 1, 0] += 3.0 / 1920
+    coords[:, :, 2] = np.nan
+    positions, errors, residuals = triangulate_rays(*observation_rays(coords, views, matrices, corners, t, f))
+    reprojection = reprojection_errors(truth[t, f], coords, views, matrices, corners, sizes, t, f)
+    assert_allclose(reprojection[:, 0], 0, atol=1e-6)
+    assert_allclose(reprojection[:, 1], 3.0, rtol=1e-6)
+    assert np.isnan(reprojection[:, 2]).all()
+
+
+def test_processes_match_a_single_process():
+    truth, coords, views, matrices, corners, sizes, t, f = make_scene(points=40, frames=30, seed=1)
+    #some tracks are seen by a single clip on some frames, and the frames come in any order
+    coords[::3, ::2, 1:] = np.nan
+    shuffle = np.random.RandomState(2).permutation(len(t))
+    t, f = t[shuffle], f[shuffle]
+    positions, errors, _ = triangulate_rays(*observation_rays(coords, views, matrices, corners, t, f))
+    reprojection = reprojection_errors(positions, coords, views, matrices, corners, sizes, t, f)
+    result = triangulate_in_processes(coords, views, matrices, corners, sizes, t, f, 2)
+    assert np.isnan(errors).any()
+    assert_allclose(result[0], positions, rtol=0, atol=1e-12)
+    assert_allclose(result[1], errors, rtol=0, atol=1e-12)
+    assert_allclose(result[2], reprojection, rtol=0, atol=1e-9)
@@ -0,0 +1,19 @@
+import importlib
+import os
+import sys
+
+ADDON_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_worker_modules_are_the_addon_files():
+    for name in ("pipeline", "triangulation", "raw_frames"):
+        module = importlib.import_module("marker_tracker_workers." + name)
+        assert os.path.dirname(os.path.abspath(module.__file__)) == ADDON_DIR
+        assert module.__package__ == "marker_tracker_workers"
+
+
+def test_worker_modules_import_each_other_in_the_package():
+    pipeline = importlib.import_module("marker_tracker_workers.pipeline")
+    assert pipeline.open_raw_frames.__module__ == "marker_tracker_workers.raw_frames"
+    assert "marker_tracker_workers.detection" in sys.modules
+
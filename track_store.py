@@ -0,0 +1,162 @@
+#In-memory state of the tracks of a clip, kept between frames while tracking so the markers don't have to be searched for
+#through the Blender API over and over.
+
+import numpy as np
+
+
+class MarkerIndex():
+    '''
+    Last marker of every track before a given frame: its frame, position (Blender space) and mute state.
+
+    The index is built with one pass over the markers of every track and then kept up to date by the tracker as it inserts
+    and mutes markers, so finding the last marker of a track costs the same no matter how long the track has been lost.
+
+    Usage:  index = MarkerIndex(tracks, frame)
+            last_frame, co, mute = index.last(track.name)
+            ... track frame ...
+            index.insert(track.name, frame, co) / index.set_mute(track.name, True)
+            index.advance(frame + 1)
+    '''
+    def __init__(self, tracks, frame):
+        self.frame = frame
+        self.rows = {}
+        n = len(tracks)
+        self.last_frame = np.full(n, -1, dtype=np.intp)
+        self.co = np.zeros((n, 2))
+        self.mute = np.zeros(n, dtype=bool)
+
+        for i, t in enumerate(tracks):
+            self.rows[t.name] = i
+            count = len(t.markers)
+            if count == 0:
+                continue
+            frames = np.empty(count, dtype=np.int32)
+            t.markers.foreach_get("frame", frames)
+            before = np.flatnonzero(frames < frame)
+            if len(before) == 0:
+                continue
+            j = before[frames[before].argmax()]
+            mrk = t.markers[int(j)]
+            self.last_frame[i] = frames[j]
+            self.co[i] = mrk.co
+            self.mute[i] = mrk.mute
+
+    def matches(self, tracks, frame):
+        '''
+
+        :param tracks: Blender Tracks
+        :param frame: Frame about to be tracked
+        :return: True if the index is up to date for these tracks at that frame
+        '''
+        return frame == self.frame and len(tracks) == len(self.rows) and all(t.name in self.rows for t in tracks)
+
+    def last(self, name):
+        '''
+
+        :param name: Track name
+        :return: (frame, co, mute) of the last marker before the index frame, None if the track has none
+        '''
+        i = self.rows[name]
+        if self.last_frame[i] < 0:
+            return None
+        return int(self.last_frame[i]), tuple(self.co[i]), bool(self.mute[i])
+
+    def insert(self, name, frame, co):
+        #a marker was inserted at frame, it becomes the last marker of the track
+        i = self.rows[name]
+        if frame >= self.last_frame[i]:
+            self.last_frame[i] = frame
+            self.co[i] = co
+            self.mute[i] = False
+
+    def set_mute(self, name, mute):
+        #the last marker of the track was muted or unmuted
+        self.mute[self.rows[name]] = mute
+
+    def advance(self, frame):
+        #lookups are now for markers before frame. Nothing changes, the markers of the frames in between are already recorded
+        self.frame = frame
+
+
+class TrackStore(MarkerIndex):
+    '''
+    Columnar store of the markers tracked over a frame range. Positions are kept in a (frames, tracks, 2) array and the
+    state of every marker in a (frames, tracks) array of flags. While tracking, markers are only written to the store,
+    flush() then writes them to the Blender tracks in one go per track.
+
+    The store is also a MarkerIndex, the last markers it reports include the ones not flushed yet.
+
+    Usage:  store = TrackStore(tracks, start, end)
+            ... track frames, store.insert / store.set_mute ...
+            store.flush(tracks)
+    '''
+    #flags
+    MARKER = 1
+    MUTE = 2
+
+    #moveMarkers leaves the Blender tracks alone and lets flush() write them
+    deferred = True
+
+    def __init__(self, tracks, start, end):
+        MarkerIndex.__init__(self, tracks, start)
+        self.start = start
+        self.positions = np.full((end - start + 1, len(self.rows), 2), np.nan, dtype=np.float32)
+        self.flags = np.zeros((end - start + 1, len(self.rows)), dtype=np.uint8)
+        #mute changes of markers from before the stored range, {(row, frame): mute}
+        self.mute_changes = {}
+
+    def insert(self, name, frame, co):
+        MarkerIndex.insert(self, name, frame, co)
+        i = self.rows[name]
+        self.positions[frame - self.start, i] = co
+        self.flags[frame - self.start, i] = self.MARKER
+
+    def set_mute(self, name, mute):
+        MarkerIndex.set_mute(self, name, mute)
+        i = self.rows[name]
+        f = self.last_frame[i] - self.start
+        if 0 <= f < len(self.flags) and self.flags[f, i] & self.MARKER:
+            self.flags[f, i] = self.MARKER | (self.MUTE if mute else 0)
+        else:
+            self.mute_changes[(i, int(self.last_frame[i]))] = mute
+
+    def flush(self, tracks):
+        '''
+        Writes the stored markers to the Blender tracks and empties the store. Markers have to be created one at a time, but
+        positions and mute states are set for all the markers of a track with a single foreach_set.
+
+        :param tracks: Blender Tracks the store was built from
+        '''
+        changed = set(np.flatnonzero(self.flags.any(axis=0)).tolist()) | set(i for i, f in self.mute_changes)
+        names = dict((i, name) for name, i in self.rows.items())
+        for i in sorted(changed):
+            t = tracks[names[i]]
+            new = np.flatnonzero(self.flags[:, i])
+            for f in new:
+                t.markers.insert_frame(int(f + self.start))
+
+            count = len(t.markers)
+            frames = np.empty(count, dtype=np.int32)
+            co = np.empty(count * 2, dtype=np.float32)
+            mute = np.empty(count, dtype=bool)
+            t.markers.foreach_get("frame", frames)
+            t.markers.foreach_get("co", co)
+            t.markers.foreach_get("mute", mute)
+            co = co.reshape(-1, 2)
+
+            #markers are kept sorted by frame
+            at = np.searchsorted(frames, new + self.start)
+            co[at] = self.positions[new, i]
+            mute[at] = self.flags[new, i] & self.MUTE > 0
+            for (row, frame), value in self.mute_changes.items():
+                if row == i:
+                    j = np.searchsorted(frames, frame)
+                    if j < count and frames[j] == frame:
+                        mute[j] = value
+
+            t.markers.foreach_set("co", co.ravel())
+            t.markers.foreach_set("mute", mute)
+
+        self.positions[:] = np.nan
+        self.flags[:] = 0
+        self.mute_changes = {}
@@ -0,0 +1,209 @@
+#Triangulation of the 3D position of the tracks from the rays of all the cameras that see them. Triangulate.py gathers
+#the markers and cameras into numpy arrays, everything here works on those arrays so worker processes can import it on
+#its own, see triangulate_in_processes.
+
+import ctypes
+import multiprocessing
+from multiprocessing.sharedctypes import RawArray
+
+import numpy as np
+
+#Rays closer to parallel than this can't be intersected, see triangulate_rays
+MIN_DETERMINANT = 1e-12
+#Chunks of frames given to every process by triangulate_in_processes, more than one so a slow chunk doesn't hold up the rest
+CHUNKS_PER_PROCESS = 4
+
+
+def triangulate_rays(origins, directions, mask=None):
+    '''
+    Least squares intersection of the rays of every point, for many points at once: each point is the position with the
+    smallest sum of squared distances to its rays, which for two rays is the middle of their closest points. Solves one
+    3x3 system per point, all of them in a single batched call.
+
+    Points can have a different number of rays, the missing ones are left out with mask.
+
+    :param origins: (points, views, 3) array of ray origins
+    :param directions: (points, views, 3) array of ray directions, they don't need to be normalized
+    :param mask: (points, views) bool array, False where a view has no ray. All the rays are used if None
+    :return: (positions (points, 3), errors (points,), residuals (points, views)). The residuals are the distances of the
+             position to each of its rays, NaN for missing rays. The error is twice the root mean square of the residuals,
+             for two rays that is the distance between them. Points with less than two rays, or with rays that are all
+             parallel, have NaN positions and errors.
+    '''
+    origins = np.asarray(origins, dtype=np.float64)
+    directions = np.asarray(directions, dtype=np.float64)
+    if mask is None:
+        mask = np.ones(origins.shape[:2], dtype=bool)
+
+    length = np.sqrt(np.einsum('pvi,pvi->pv', directions, directions))
+    mask = mask & (length > 0)
+    #unit directions, zero for the missing rays so they don't add anything to the sums below
+    d = np.where(mask[..., None], directions / np.where(mask, length, 1)[..., None], 0)
+    o = np.where(mask[..., None], origins, 0)
+    count = mask.sum(axis=1)
+
+    #sum over the rays of (I - d d^T), and of (I - d d^T) o
+    a = count[:, None, None] * np.eye(3) - np.einsum('pvi,pvj->pij', d, d)
+    b = o.sum(axis=1) - np.einsum('pvi,pv->pi', d, np.einsum('pvi,pvi->pv', d, o))
+
+    solvable = (count >= 2) & (np.abs(np.linalg.det(a)) > MIN_DETERMINANT)
+    positions = np.full((len(origins), 3), np.nan)
+    if solvable.any():
+        positions[solvable] = np.linalg.solve(a[solvable], b[solvable][..., None])[..., 0]
+
+    #distance of the position to each ray, the part of (position - origin) that is not along the ray
+    v = positions[:, None, :] - o
+    v -= d * np.einsum('pvi,pvi->pv', v, d)[..., None]
+    residuals = np.where(mask, np.sqrt(np.einsum('pvi,pvi->pv', v, v)), np.nan)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        errors = 2 * np.sqrt((np.where(mask, residuals, 0) ** 2).sum(axis=1) / count)
+    errors[~solvable] = np.nan
+    return positions, errors, residuals
+
+
+def marker_rays(matrices, corners, coords):
+    '''
+    Rays from the cameras through the markers, for many markers at once.
+
+    :param matrices: (n, 4, 4) world matrices of the cameras, with normalized rotation (Matrix.normalized())
+    :param corners: (n, 2, 3) bottom left and top right corners of the camera frames, in camera space (Camera.view_frame)
+    :param coords: (n, 2) marker positions, normalized to the frame, (0, 0) at the bottom left
+    :return: (origins (n, 3), directions (n, 3)) of the rays
+    '''
+    bottom_left, top_right = corners[:, 0], corners[:, 1]
+    local = np.empty((len(coords), 3))
+    local[:, :2] = bottom_left[:, :2] + coords * (top_right[:, :2] - bottom_left[:, :2])
+    local[:, 2] = top_right[:, 2]
+    return matrices[:, :3, 3], np.einsum('nij,nj->ni', matrices[:, :3, :3], local)
+
+
+def observation_rays(coords, views, matrices, corners, t, f):
+    '''
+    Rays through the markers of many tracks and frames, for triangulate_rays.
+
+    :param coords: (tracks, frames, views, 2) normalized marker positions, NaN where a clip has no marker on a frame
+    :param views: (tracks, views) index of the camera of every clip of a track, -1 where a track is in less clips
+    :param matrices: (cameras, frames, 4, 4) world matrices of the cameras, see marker_rays
+    :param corners: (cameras, frames, 2, 3) frame corners of the cameras, see marker_rays
+    :param t: (n,) track indices
+    :param f: (n,) frame indices
+    :return: (origins (n, views, 3), directions (n, views, 3), mask (n, views))
+    '''
+    mask = ~np.isnan(coords[t, f, :, 0])
+    origins = np.zeros(mask.shape + (3,))
+    directions = np.zeros(mask.shape + (3,))
+    n, v = np.nonzero(mask)
+    c, fn = views[t[n], v], f[n]
+    origins[n, v], directions[n, v] = marker_rays(matrices[c, fn], corners[c, fn], coords[t[n], fn, v])
+    return origins, directions, mask
+
+
+def reprojection_errors(positions, coords, views, matrices, corners, sizes, t, f):
+    '''
+    How far from its markers every triangulated position lands when it is seen by the cameras again, in pixels.
+
+    :param positions: (n, 3) triangulated positions, from triangulate_rays
+    :param coords, views, matrices, corners, t, f: See observation_rays
+    :param sizes: (cameras, 2) width and height in pixels of the clip of every camera
+    :return: (n, views) distances in pixels, NaN where a clip has no marker on the frame or the position is NaN
+    '''
+    mask = ~np.isnan(coords[t, f, :, 0])
+    errors = np.full(mask.shape, np.nan)
+    n, v = np.nonzero(mask)
+    c, fn = views[t[n], v], f[n]
+    m, frame = matrices[c, fn], corners[c, fn]
+    bottom_left, top_right = frame[:, 0], frame[:, 1]
+    #into camera space, then onto the plane of the frame corners along the ray from the camera
+    local = np.einsum('nji,nj->ni', m[:, :3, :3], positions[n] - m[:, :3, 3])
+    with np.errstate(invalid='ignore', divide='ignore'):
+        onFrame = local[:, :2] * (top_right[:, 2] / local[:, 2])[:, None]
+        projected = (onFrame - bottom_left[:, :2]) / (top_right[:, :2] - bottom_left[:, :2])
+    errors[n, v] = np.hypot(*((projected - coords[t[n], fn, v]) * sizes[c]).T)
+    return errors
+
+
+#Arrays shared with the processes of triangulate_in_processes, by name, set when a process starts
+_shared = {}
+
+
+def _share(array):
+    #copy of the array in memory the processes can map, with what they need to see it as an array again
+    array = np.ascontiguousarray(array)
+    raw = RawArray(ctypes.c_char, max(array.nbytes, 1))
+    np.frombuffer(raw, dtype=array.dtype, count=array.size).reshape(array.shape)[...] = array
+    return raw, array.dtype.str, array.shape
+
+
+def _init_process(arrays):
+    for name, (raw, dtype, shape) in arrays.items():
+        _shared[name] = np.frombuffer(raw, dtype=dtype, count=int(np.prod(shape))).reshape(shape)
+
+
+def _solve_chunk(start, end):
+    #triangulates the entries start:end of the shared track and frame indices, only the results are sent back
+    a = _shared
+    t, f = a["t"][start:end], a["f"][start:end]
+    observed = a["coords"], a["views"], a["matrices"], a["corners"]
+    positions, errors, _ = triangulate_rays(*observation_rays(*observed, t=t, f=f))
+    reprojection = reprojection_errors(positions, *observed, sizes=a["sizes"], t=t, f=f)
+    return positions, errors, reprojection
+
+
+def triangulate_in_processes(coords, views, matrices, corners, sizes, t, f, processes):
+    '''
+    triangulate_rays(*observation_rays(...)) and reprojection_errors on a pool of processes. The markers and cameras are
+    copied once to shared memory that every process maps when it starts, then every process solves chunks of
+    consecutive frames.
+
+    :param coords, views, matrices, corners, t, f: See observation_rays
+    :param sizes: See reprojection_errors
+    :param processes: Number of processes
+    :return: (positions (n, 3), errors (n,), reprojection (n, views)), see triangulate_rays and reprojection_errors
+    '''
+    order = np.argsort(f, kind='mergesort')
+    arrays = dict(coords=_share(coords), views=_share(views), matrices=_share(matrices), corners=_share(corners),
+                  sizes=_share(sizes), t=_share(t[order]), f=_share(f[order]))
+    bounds = np.linspace(0, len(t), processes * CHUNKS_PER_PROCESS + 1).astype(int)
+    chunks = [(int(start), int(end)) for start, end in zip(bounds[:-1], bounds[1:]) if end > start]
+    pool = multiprocessing.Pool(processes, _init_process, (arrays,))
+    try:
+        results = pool.starmap(_solve_chunk, chunks)
+    finally:
+        pool.terminate()
+    positions = np.empty((len(t), 3))
+    errors = np.empty(len(t))
+    reprojection = np.empty((len(t), views.shape[1]))
+    positions[order] = np.concatenate([p for p, e, r in results] or [np.zeros((0, 3))])
+    errors[order] = np.concatenate([e for p, e, r in results] or [np.zeros(0)])
+    reprojection[order] = np.concatenate([r for p, e, r in results] or [np.zeros((0, views.shape[1]))])
+    return positions, errors, reprojection
+
+
+def key_changes(existing, frames, remove=()):
+    '''
+    How to key an F-curve on some frames and delete its keys on others, leaving every other key as it is, see
+    Triangulate.WriteKeys.
+
+    :param existing: Frames of the keys the F-curve has, in the order of its keyframe points
+    :param frames: Frames to key
+    :param remove: Frames whose keys are deleted, unless they are also in frames
+    :return: (at, found, deleted). found is True for the frames that already have a key, at is the index of that key in
+             existing (meaningless where found is False). deleted are the indices in existing of the keys to delete,
+             highest first so they can be removed one after the other.
+    '''
+    existing = np.asarray(existing, dtype=np.float64).ravel()
+    frames = np.asarray(frames, dtype=np.float64).ravel()
+    remove = np.setdiff1d(np.asarray(remove, dtype=np.float64).ravel(), frames)
+    order = np.argsort(existing, kind='mergesort')
+    ordered = existing[order]
+
+    def lookup(values):
+        #index in existing of the key on each of the values, and whether there is one
+        pos = np.searchsorted(ordered, values).clip(0, max(len(ordered) - 1, 0))
+        if len(ordered) == 0:
+            return pos, np.zeros(len(values), dtype=bool)
+        return order[pos], ordered[pos] == values
+
+    at, found = lookup(frames)
+    gone, hit = lookup(remove)
+    return at, found, np.sort(gone[hit])[::-1]
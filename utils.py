@@ -1,7 +1,11 @@
 import bpy
 import bgl
 import blf
+import importlib
 from math import sqrt, pow
+import multiprocessing
+import os
+import sys
 import time
 
 def time_it(f):
@@ -44,6 +48,25 @@ def space_to_normalized(loc,size):
     #inverse of normalized_to_space
     return (loc[0]*size[0],size[1]-size[1]*loc[1])
 
+def worker_module(name):
+    '''
+    Worker processes can't import the addon package, its __init__ needs bpy. The bpy free modules they run (pipeline.py,
+    triangulation.py and the modules these import) are imported through the marker_tracker_workers package instead, both
+    here and in the workers, so the functions sent to the workers are found under the same name on both sides. The addon
+    folder is appended to sys.path, not prepended, so its modules can't shadow other modules of the same name: the only
+    new top level name is marker_tracker_workers.
+
+    :param name: Module name, like "pipeline"
+    :return: The module, imported as marker_tracker_workers.<name>
+    '''
+    addon_dir = os.path.dirname(os.path.abspath(__file__))
+    if addon_dir not in sys.path:
+        sys.path.append(addon_dir)
+    if os.name == 'nt':
+        #new processes are started from the python executable, by default it would be Blender itself
+        multiprocessing.set_executable(bpy.app.binary_path_python)
+    return importlib.import_module("marker_tracker_workers." + name)
+
 # http://blenderscripting.blogspot.ch/2011/07/bgl-drawing-with-opengl-onto-blender-25.html
 class GlDrawOnScreen():
     '''